@@ -0,0 +1,110 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from wyniki_posrednie import SinogramSteps
+
+# Percentyle okna wyświetlania, liczone na ostatniej klatce (jak przy statycznym podglądzie)
+WINDOW_PERCENTILES = (1, 99)
+# Czas odtwarzania całej animacji oraz najkrótsza klatka GIF (przeglądarki spowalniają krótsze do 100 ms)
+ANIMATION_SECONDS = 2.0
+MIN_FRAME_MS = 20
+# Najwięcej klatek w GIF-ie - przy większej liczbie kroków co któraś klatka jest pomijana (ostatnia zostaje)
+MAX_GIF_FRAMES = 90
+# Najdłuższy bok klatki (rozmiar wyświetlania w kolumnie strony) - większe obrazy są zmniejszane
+# uśrednianiem bloków, żeby stos klatek nie zajmował (kroki x pełna rozdzielczość) bajtów
+MAX_FRAME_SIDE = 512
+
+
+def window_limits(image, percentiles=WINDOW_PERCENTILES):
+    """
+    :return: granice okna (vmin, vmax) wyznaczone oboma percentylami w jednym przebiegu
+    """
+    low, high = np.percentile(image, percentiles)
+    return float(low), float(high)
+
+
+def to_uint8(frames, low, high):
+    """
+    Okienkowanie [low, high] -> 0..255 pojedynczej klatki lub całego stosu klatek naraz
+
+    :param frames: - ndarray klatki lub stosu klatek
+    :return: ndarray uint8 o tym samym kształcie
+    """
+    scale = 255.0 / (high - low) if high > low else 0.0
+    scaled = np.array(frames, dtype=np.float32)
+    scaled -= np.float32(low)
+    scaled *= np.float32(scale)
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def downscale(image, factor):
+    """
+    Zmniejszenie obrazu factor razy uśrednianiem bloków factor x factor (niepełne bloki
+    na prawym i dolnym brzegu są pomijane)
+    """
+    image = np.asarray(image)
+    if factor <= 1:
+        return image
+    height, width = image.shape[0] // factor, image.shape[1] // factor
+    blocks = image[:height * factor, :width * factor].reshape(height, factor, width, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float64)
+
+
+def _frame_factor(shape, max_side):
+    return 1 if max_side is None else max(1, -(-max(shape) // max_side))
+
+
+def render_frames(result, transpose=False, percentiles=WINDOW_PERCENTILES, max_side=MAX_FRAME_SIDE):
+    """
+    Zamiana wszystkich wyników pośrednich na gotowe do wyświetlenia klatki uint8 ze wspólnym
+    oknem ostatniej klatki. Sinogram jest okienkowany raz, a klatki powstają z niego jedną
+    operacją (stan po kroku k to wiersze do kroku k); projekcja wsteczna jest odtwarzana
+    przyrostowo i okienkowana klatka po klatce do wspólnego bufora
+
+    :param result: - SinogramSteps, BackprojectionSteps lub inna sekwencja obrazów
+    :param transpose: - transpozycja klatek (sinogram jest wyświetlany z kątami w poziomie)
+    :param max_side: - najdłuższy bok klatki, większe są zmniejszane (downscale); None - pełna rozdzielczość
+    :return: ndarray uint8 o kształcie (liczba kroków, wysokość, szerokość)
+    """
+    if isinstance(result, SinogramSteps):
+        sinogram = result.sinogram
+        low, high = window_limits(sinogram, percentiles)
+        factor = _frame_factor(sinogram.shape, max_side)
+        rows = to_uint8(downscale(sinogram, factor), low, high)
+        empty = to_uint8(0.0, low, high)
+        steps = len(result)
+        # Zmniejszony wiersz jest widoczny od kroku, w którym jest już cały jego blok wierszy
+        filled = (np.arange(len(rows)) + 1)[None, :] * factor - 1 <= np.arange(steps)[:, None]
+        frames = np.where(filled[:, :, None], rows[None], empty)
+    else:
+        last = np.asarray(result[-1])
+        low, high = window_limits(last, percentiles)
+        factor = _frame_factor(last.shape, max_side)
+        frames = np.empty((len(result),) + downscale(last, factor).shape, dtype=np.uint8)
+        for idx, frame in enumerate(result):
+            frames[idx] = to_uint8(downscale(frame, factor), low, high)
+    if transpose:
+        frames = frames.transpose(0, 2, 1)
+    return np.ascontiguousarray(frames)
+
+
+def encode_gif(frames, seconds=ANIMATION_SECONDS):
+    """
+    Zakodowanie klatek jako jednego GIF-a odtwarzanego przez przeglądarkę (raz, zatrzymuje się
+    na ostatniej klatce), bez rysowania kolejnych klatek przez serwer
+
+    :param frames: - ndarray uint8 o kształcie (liczba klatek, wysokość, szerokość)
+    :return: bajty pliku GIF
+    """
+    stride = -(-len(frames) // MAX_GIF_FRAMES)
+    if stride > 1:
+        frames = np.concatenate([frames[stride - 1::stride], frames[-1:]]) if len(frames) % stride else \
+            frames[stride - 1::stride]
+    duration = max(MIN_FRAME_MS, int(round(seconds * 1000 / max(1, len(frames)))))
+    images = [Image.fromarray(frame) for frame in frames]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="GIF", save_all=True, append_images=images[1:], duration=duration)
+    return buffer.getvalue()
@@ -0,0 +1,354 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from fantom import phantom_sinogram, rasterize, shepp_logan
+from geometria import clear_geometry_cache, get_bresenham_points, get_geometry, rasterize_rays
+from jadra import available_backends
+from obliczenia import (FLOAT32_TOLERANCE, calculate_sinogram, create_shepp_logan_kernel, filter_sinogram,
+                        filter_sinogram_fft, reverse_radon_transform)
+from pliki_dicom import save_as_dicom, to_uint16
+from przeglad import RESULTS_FILE, parameter_grid, run_sweep
+
+# Dopuszczalna różnica wyników implementacji względem 'numpy' (względem największej wartości)
+PARITY_TOLERANCE = 1e-9
+
+# Domyślne obrazy i plik wyników są względem katalogu skryptu, nie katalogu bieżącego
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_IMAGES = ['phantom', os.path.join(BENCHMARK_DIR, 'scans', 'Shepp_logan.jpg')]
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, 'benchmark.json')
+
+
+def load_case_image(name, size):
+    """
+    Obraz przypadku testowego: 'phantom' lub ścieżka do pliku przeskalowanego do size x size
+    """
+    if name == 'phantom':
+        return rasterize(shepp_logan(), (size, size)).astype(np.float32)
+    image = Image.open(name).convert("L").resize((size, size), Image.BILINEAR)
+    return np.array(image).astype(np.float32)
+
+
+def measure(func, repeat):
+    """
+    Najlepszy czas z repeat wywołań oraz szczytowe zużycie pamięci (tracemalloc) przy pierwszym wywołaniu
+
+    :return: krotka (czas w sekundach, szczytowa liczba bajtów, wynik funkcji)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    best = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best, peak, result
+
+
+def _trace_with_bresenham(img, steps, span, num_rays, max_angle):
+    # Referencyjne śledzenie promieni jednego kąta czystym Pythonem
+    geometry = get_geometry(img.shape, steps, span, num_rays, max_angle, trace=False)
+    return [get_bresenham_points(ray[0][0], ray[0][1], ray[1][0], ray[1][1]) for ray in geometry.rays(0)]
+
+
+def _trace_with_rasterizer(img, steps, span, num_rays, max_angle):
+    geometry = get_geometry(img.shape, steps, span, num_rays, max_angle, trace=False)
+    return rasterize_rays(geometry.rays(0), img.shape)
+
+
+def _cold_sinogram(img, steps, span, num_rays, max_angle):
+    clear_geometry_cache()
+    return calculate_sinogram(img, steps, span, num_rays, max_angle)
+
+
+def run_case(image_name, size, steps, span, num_rays, max_angle, repeat):
+    """
+    Pomiary wszystkich gorących ścieżek dla jednej kombinacji parametrów
+
+    :return: lista wyników (słowników)
+    """
+    img = load_case_image(image_name, size)
+    args = (steps, span, num_rays, max_angle)
+    pixels = size * size
+
+    # (nazwa, funkcja, liczba przetworzonych "pikseli" do przeliczenia przepustowości)
+    cases = [
+        ('get_bresenham_points', lambda: _trace_with_bresenham(img, *args), num_rays * 2 * size),
+        ('rasterize_rays', lambda: _trace_with_rasterizer(img, *args), num_rays * 2 * size),
+        ('calculate_sinogram[cold]', lambda: _cold_sinogram(img, *args), pixels * steps),
+        ('calculate_sinogram', lambda: calculate_sinogram(img, *args), pixels * steps),
+        ('calculate_sinogram[float32]', lambda: calculate_sinogram(img, *args, dtype=np.float32), pixels * steps),
+        ('phantom_sinogram', lambda: phantom_sinogram(shepp_logan(), img.shape, *args), pixels * steps),
+    ]
+    # Skompilowane implementacje jąder (referencyjna 'python' jest za wolna na pomiary - patrz --parity)
+    for backend in available_backends():
+        if backend not in ('python', 'numpy'):
+            cases.append((f'calculate_sinogram[{backend}]',
+                          lambda backend=backend: calculate_sinogram(img, *args, backend=backend), pixels * steps))
+    results = []
+    sinogram = None
+    for name, func, work in cases:
+        elapsed, peak, result = measure(func, 1 if name.endswith('[cold]') else repeat)
+        if name == 'calculate_sinogram':
+            sinogram = result
+        results.append((name, elapsed, peak, work))
+
+    kernel = create_shepp_logan_kernel(9)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.dcm')
+        reconstruction = reverse_radon_transform(img, sinogram, *args)
+        cases = [
+            ('reverse_radon_transform', lambda: reverse_radon_transform(img, sinogram, *args), pixels * steps),
+            ('reverse_radon_transform[float32]',
+             lambda: reverse_radon_transform(img, sinogram, *args, dtype=np.float32), pixels * steps),
+            ('reverse_radon_transform[pixel]',
+             lambda: reverse_radon_transform(img, sinogram, *args, method='pixel'), pixels * steps),
+        ] + [
+            (f'reverse_radon_transform[{backend}]',
+             lambda backend=backend: reverse_radon_transform(img, sinogram, *args, backend=backend), pixels * steps)
+            for backend in available_backends() if backend not in ('python', 'numpy')
+        ] + [
+            ('filter_sinogram', lambda: filter_sinogram(sinogram, kernel), sinogram.size),
+            ('filter_sinogram_fft', lambda: filter_sinogram_fft(sinogram, 'shepp-logan'), sinogram.size),
+            ('save_as_dicom', lambda: save_as_dicom(to_uint16(reconstruction), path, 'Benchmark', '0',
+                                                    datetime.date.today(), ''), pixels),
+        ]
+        for name, func, work in cases:
+            elapsed, peak, _ = measure(func, repeat)
+            results.append((name, elapsed, peak, work))
+
+    return [dict(name=name, image=os.path.basename(image_name), size=size, steps=steps, span=span,
+                 num_rays=num_rays, max_angle=max_angle, time_s=elapsed, peak_bytes=peak,
+                 pixels_per_s=work / elapsed if elapsed > 0 else None)
+            for name, elapsed, peak, work in results]
+
+
+def check_parity(image_name, size, steps, span, num_rays, max_angle):
+    """
+    Porównanie sinogramu i rekonstrukcji wszystkich dostępnych implementacji oraz obliczeń float32
+    z implementacją 'numpy' w float64
+
+    :return: lista krotek (wariant, różnica sinogramu, różnica rekonstrukcji, dopuszczalna różnica) -
+             różnice względem największej wartości wyniku
+    """
+    img = load_case_image(image_name, size)
+    args = (steps, span, num_rays, max_angle)
+    sinogram = calculate_sinogram(img, *args, backend='numpy')
+    reconstruction = reverse_radon_transform(img, sinogram, *args, backend='numpy')
+    variants = [(backend, dict(backend=backend), PARITY_TOLERANCE)
+                for backend in available_backends() if backend != 'numpy']
+    variants.append(('float32', dict(backend='numpy', dtype=np.float32), FLOAT32_TOLERANCE))
+    results = []
+    for name, options, tolerance in variants:
+        other = calculate_sinogram(img, *args, **options)
+        sinogram_diff = np.abs(other - sinogram).max() / max(np.abs(sinogram).max(), 1e-300)
+        dtypes = [other.dtype]
+        other = reverse_radon_transform(img, sinogram, *args, **options)
+        reconstruction_diff = np.abs(other - reconstruction).max()
+        dtypes.append(other.dtype)
+        if 'dtype' in options:
+            # Wyniki pośrednie (punkt kontrolny + dosumowane kroki i odtwarzanie przyrostowe) też w typie obliczeń
+            steps = reverse_radon_transform(img, sinogram.astype(options['dtype']), *args, intermediate=True,
+                                            **options)
+            dtypes += [steps[len(steps) // 2 + 1].dtype, steps[0].dtype, next(iter(steps)).dtype]
+            # Inny typ któregokolwiek wyniku to błąd niezależnie od różnic wartości
+            if any(dtype != np.dtype(options['dtype']) for dtype in dtypes):
+                sinogram_diff = reconstruction_diff = np.inf
+        results.append((name, float(sinogram_diff), float(reconstruction_diff), tolerance))
+    return results
+
+
+def _special_rays(size):
+    # Promienie brzegowe dla algorytmu Bresenhama: poziome, pionowe, dokładnie ukośne (w obu
+    # kierunkach), strome i płaskie o nachyleniu 1 +/- 1 piksel, zdegenerowane (jeden punkt)
+    # oraz końce ułamkowe i ujemne (obcięcie w stronę zera) wychodzące poza obraz
+    last = size - 1
+    ends = [((0, last), (0, last)), ((last, 0), (last, 0)), ((0, last), (last, 0)), ((last, 0), (0, last)),
+            ((0, last), (0, last - 1)), ((0, last - 1), (0, last)), ((last, 0), (1, last)), ((1, last), (last, 0)),
+            ((0, last), (size // 2, size // 2)), ((size // 2, size // 2), (last, 0)),
+            ((size // 3, size // 3), (size // 3, size // 3)), ((0, 1), (0, 7)), ((0, 7), (0, 1)),
+            ((-3.7, size + 2.5), (-0.5, size * 0.6)), ((size + 2.5, -3.7), (size * 0.6, -0.5)),
+            ((-size * 0.5, size * 1.5), (-size * 0.5 + 0.9, size * 1.5 - 0.9))]
+    return np.array(ends, dtype=np.float64)
+
+
+def check_rasterizer_parity(size, spans, num_rays, max_angle=360, steps=360):
+    """
+    Porównanie pikseli (zbiór i kolejność) rasterize_rays z get_bresenham_points ograniczonym do obrazu:
+    promienie skanu co max_angle / steps stopni dla każdego zakresu promieni na obrazach kwadratowym
+    i prostokątnych oraz promienie brzegowe z _special_rays
+
+    :return: lista krotek (opis przypadku, liczba promieni, liczba niezgodnych promieni)
+    """
+    results = []
+    shapes = [(size, size), (size, size // 2 + 1), (size // 2 + 1, size)]
+    for shape in shapes:
+        cases = [(f"l={span:g}", get_geometry(shape, steps, span, num_rays, max_angle, trace=False))
+                 for span in spans]
+        for name, geometry in cases:
+            rays = np.concatenate([geometry.rays(idx) for idx in range(steps)])
+            results.append((f"{shape[0]}x{shape[1]} {name}", len(rays), _rasterizer_mismatches(rays, shape)))
+        rays = _special_rays(min(shape))
+        results.append((f"{shape[0]}x{shape[1]} special", len(rays), _rasterizer_mismatches(rays, shape)))
+    return results
+
+
+def _rasterizer_mismatches(rays, shape):
+    height, width = shape
+    indices, offsets = rasterize_rays(rays, shape)
+    mismatches = 0
+    for r, ray in enumerate(rays):
+        expected = [x * width + y for x, y in get_bresenham_points(ray[0][0], ray[0][1], ray[1][0], ray[1][1])
+                    if 0 <= x < height and 0 <= y < width]
+        if not np.array_equal(indices[offsets[r]:offsets[r + 1]], expected):
+            mismatches += 1
+    return mismatches
+
+
+def check_sweep_resume(size=32):
+    """
+    Wznowienie przerwanego przeglądu: ostatni wpis pliku przeglądu jest ucinany w połowie (jak po
+    przerwaniu w trakcie dopisywania), a ponowne uruchomienie musi policzyć tylko ten punkt
+
+    :return: krotka (liczba ponownie policzonych punktów, czy RMSE wszystkich punktów jest takie samo)
+    """
+    images = {'phantom': load_case_image('phantom', size)}
+    grid = parameter_grid([20, 24], [120], [30], [180], ['none', 'ramp'])
+    with tempfile.TemporaryDirectory() as directory:
+        first = run_sweep(images, grid, cache_dir=directory)
+        path = os.path.join(directory, RESULTS_FILE)
+        with open(path, 'rb') as f:
+            data = f.read()
+        last = data.rstrip(b'\n').rfind(b'\n') + 1
+        with open(path, 'wb') as f:
+            f.write(data[:last + (len(data) - last) // 2])
+        logged = []
+        second = run_sweep(images, grid, cache_dir=directory, log=logged.append)
+    recomputed = sum(int(line.rsplit(': ', 1)[1].split()[0]) for line in logged)
+    return recomputed, [row['rmse'] for row in first] == [row['rmse'] for row in second]
+
+
+def case_key(result):
+    return (result['name'], result['image'], result['size'], result['steps'], result['span'], result['num_rays'],
+            result['max_angle'])
+
+
+def compare(results, baseline, threshold):
+    """
+    Porównanie z zapisanym punktem odniesienia
+
+    :param threshold: dopuszczalny względny wzrost czasu (np. 0.1 = 10%)
+    :return: lista krotek (wynik, czas bazowy, względna zmiana) dla przypadków przekraczających próg
+    """
+    reference = {case_key(entry): entry for entry in baseline['results']}
+    regressions = []
+    for result in results:
+        base = reference.get(case_key(result))
+        if base is None or base['time_s'] <= 0:
+            continue
+        change = result['time_s'] / base['time_s'] - 1
+        if change > threshold:
+            regressions.append((result, base['time_s'], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the projection, filtering and reconstruction "
+                                                 "hot paths. Results are written to JSON and can be compared "
+                                                 "with a saved baseline.")
+    parser.add_argument("--images", nargs="+", default=DEFAULT_IMAGES,
+                        help="'phantom' (generated Shepp-Logan) and/or image paths, e.g. scans/*.jpg")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512],
+                        help="square image sizes, e.g. 128 256 512 1024 2048")
+    parser.add_argument("--steps", type=int, nargs="+", default=[180])
+    parser.add_argument("--span", type=float, nargs="+", default=[120])
+    parser.add_argument("--num-rays", type=int, nargs="+", default=[250])
+    parser.add_argument("--max-angle", type=float, default=180)
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions per case (best time is kept)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT,
+                        help="where to write the results (default: benchmark.json next to this script)")
+    parser.add_argument("--baseline", help="JSON file from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown counted as a regression (default: 0.1 = 10%%)")
+    parser.add_argument("--parity", action="store_true",
+                        help="instead of timing, check that the vectorised rasterizer gives exactly the pixels of "
+                             "get_bresenham_points, that every available backend (python, numba) gives the "
+                             "same sinogram and reconstruction as numpy, that float32 stays within "
+                             "FLOAT32_TOLERANCE of float64, and that an interrupted parameter sweep resumes; "
+                             "use small sizes, e.g. --sizes 64")
+    args = parser.parse_args(argv)
+
+    if args.parity:
+        failed = False
+        for size in args.sizes:
+            for num_rays in args.num_rays:
+                for case, rays, mismatches in check_rasterizer_parity(size, sorted(set(args.span) | {90, 180, 360}),
+                                                                      num_rays):
+                    failed |= mismatches > 0
+                    print(f"{'OK  ' if not mismatches else 'FAIL'} rasterizer {case:>22s} n={num_rays}: "
+                          f"{mismatches} of {rays} rays differ")
+        recomputed, same = check_sweep_resume()
+        ok = recomputed == 1 and same
+        failed |= not ok
+        print(f"{'OK  ' if ok else 'FAIL'} sweep resume after a truncated last record: {recomputed} point(s) "
+              f"recomputed, results {'match' if same else 'differ'}")
+        for image_name in args.images:
+            for size in args.sizes:
+                for steps in args.steps:
+                    for span in args.span:
+                        for num_rays in args.num_rays:
+                            for backend, sinogram_diff, reconstruction_diff, tolerance in check_parity(
+                                    image_name, size, steps, span, num_rays, args.max_angle):
+                                ok = max(sinogram_diff, reconstruction_diff) <= tolerance
+                                failed |= not ok
+                                print(f"{'OK  ' if ok else 'FAIL'} {backend:8s} {os.path.basename(image_name):>18s} "
+                                      f"{size:5d}px steps={steps} n={num_rays} l={span:g}: "
+                                      f"sinogram {sinogram_diff:.2e}, reconstruction {reconstruction_diff:.2e}")
+        return 1 if failed else 0
+
+    results = []
+    for image_name in args.images:
+        for size in args.sizes:
+            for steps in args.steps:
+                for span in args.span:
+                    for num_rays in args.num_rays:
+                        for result in run_case(image_name, size, steps, span, num_rays, args.max_angle, args.repeat):
+                            results.append(result)
+                            print(f"{result['name']:32s} {result['image']:>18s} {size:5d}px steps={steps} "
+                                  f"n={num_rays} l={span:g}: {result['time_s'] * 1000:10.2f} ms "
+                                  f"{result['peak_bytes'] / 2 ** 20:9.1f} MiB")
+
+    report = {
+        'meta': {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                 'numpy': np.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for result, base_time, change in regressions:
+            print(f"REGRESSION {result['name']} {result['image']} {result['size']}px steps={result['steps']} "
+                  f"n={result['num_rays']}: {base_time * 1000:.2f} ms -> {result['time_s'] * 1000:.2f} ms "
+                  f"(+{change:.0%})", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+import numpy as np
+
+from geometria import get_geometry
+
+# Dozwolone wagi sinogramu analitycznego: dokładna całka po długości albo liczba kroków Bresenhama
+WEIGHTINGS = ('length', 'bresenham')
+
+# Zmodyfikowany fantom Shepp-Logana (wartości wg Tofta):
+# (wartość, półoś a, półoś b, środek x, środek y, kąt w stopniach)
+SHEPP_LOGAN_ELLIPSES = (
+    (1.0, 0.69, 0.92, 0.0, 0.0, 0),
+    (-0.8, 0.6624, 0.874, 0.0, -0.0184, 0),
+    (-0.2, 0.11, 0.31, 0.22, 0.0, -18),
+    (-0.2, 0.16, 0.41, -0.22, 0.0, 18),
+    (0.1, 0.21, 0.25, 0.0, 0.35, 0),
+    (0.1, 0.046, 0.046, 0.0, 0.1, 0),
+    (0.1, 0.046, 0.046, 0.0, -0.1, 0),
+    (0.1, 0.046, 0.023, -0.08, -0.605, 0),
+    (0.1, 0.023, 0.023, 0.0, -0.606, 0),
+    (0.1, 0.023, 0.046, 0.06, -0.605, 0),
+)
+
+
+class Shape:
+    """
+    Jednorodny obiekt fantomu opisany we współrzędnych znormalizowanych: oś x w prawo, oś y w górę,
+    jednostką jest połowa krótszego boku obrazu, a środek obrazu leży w (0, 0). Dzięki temu ten sam
+    fantom można zrasteryzować lub prześwietlić w dowolnej rozdzielczości.
+    """
+
+    def __init__(self, value, a, b, x0=0.0, y0=0.0, angle=0.0):
+        """
+        :param value: - wartość (gęstość) dodawana wewnątrz obiektu
+        :param a: - połowa rozmiaru wzdłuż obróconej osi x
+        :param b: - połowa rozmiaru wzdłuż obróconej osi y
+        :param x0: - współrzędna x środka
+        :param y0: - współrzędna y środka
+        :param angle: - obrót w stopniach (przeciwnie do ruchu wskazówek zegara)
+        """
+        if a <= 0 or b <= 0:
+            raise ValueError("Półosie obiektu fantomu muszą być dodatnie")
+        self.value = value
+        self.a = a
+        self.b = b
+        self.x0 = x0
+        self.y0 = y0
+        self.angle = angle
+
+    def __repr__(self):
+        return (f"{type(self).__name__}({self.value!r}, {self.a!r}, {self.b!r}, "
+                f"{self.x0!r}, {self.y0!r}, {self.angle!r})")
+
+    def _local(self, x, y):
+        # Współrzędne w układzie obiektu (przesunięcie do środka i obrót o -angle)
+        phi = np.radians(self.angle)
+        dx, dy = x - self.x0, y - self.y0
+        return dx * np.cos(phi) + dy * np.sin(phi), -dx * np.sin(phi) + dy * np.cos(phi)
+
+    def contains(self, x, y):
+        raise NotImplementedError
+
+    def chord(self, start, direction):
+        """
+        Przedział parametru t odcinka start + t * direction leżący wewnątrz obiektu
+
+        :param start: - krotka tablic (x, y) punktów początkowych we współrzędnych znormalizowanych
+        :param direction: - krotka tablic (x, y) wektorów kierunku
+        :return: tablice (t_min, t_max), puste przecięcie ma t_min >= t_max
+        """
+        raise NotImplementedError
+
+
+class Ellipse(Shape):
+
+    def contains(self, x, y):
+        u, v = self._local(x, y)
+        return (u / self.a) ** 2 + (v / self.b) ** 2 <= 1
+
+    def chord(self, start, direction):
+        # Po przeskalowaniu osi elipsa staje się okręgiem jednostkowym: |p + t d|^2 = 1
+        pu, pv = self._local(*start)
+        phi = np.radians(self.angle)
+        du = direction[0] * np.cos(phi) + direction[1] * np.sin(phi)
+        dv = -direction[0] * np.sin(phi) + direction[1] * np.cos(phi)
+        pu, pv, du, dv = pu / self.a, pv / self.b, du / self.a, dv / self.b
+
+        quad = du ** 2 + dv ** 2
+        half = pu * du + pv * dv
+        disc = half ** 2 - quad * (pu ** 2 + pv ** 2 - 1)
+        root = np.sqrt(np.maximum(disc, 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_min = np.where(disc > 0, (-half - root) / quad, 0.0)
+            t_max = np.where(disc > 0, (-half + root) / quad, 0.0)
+        return t_min, t_max
+
+
+class Rectangle(Shape):
+
+    def contains(self, x, y):
+        u, v = self._local(x, y)
+        return (np.abs(u) <= self.a) & (np.abs(v) <= self.b)
+
+    def chord(self, start, direction):
+        # Przecięcie dwóch pasów |u| <= a oraz |v| <= b (metoda slabów)
+        pu, pv = self._local(*start)
+        phi = np.radians(self.angle)
+        du = direction[0] * np.cos(phi) + direction[1] * np.sin(phi)
+        dv = -direction[0] * np.sin(phi) + direction[1] * np.cos(phi)
+
+        t_min = np.full(np.shape(pu), -np.inf)
+        t_max = np.full(np.shape(pu), np.inf)
+        for p, d, half_size in ((pu, du, self.a), (pv, dv, self.b)):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t1 = (-half_size - p) / d
+                t2 = (half_size - p) / d
+            # Kierunek równoległy do pasa: cała prosta w środku albo całkiem poza nim
+            parallel = d == 0
+            outside = parallel & (np.abs(p) > half_size)
+            low = np.where(parallel, np.where(outside, np.inf, -np.inf), np.minimum(t1, t2))
+            high = np.where(parallel, np.where(outside, -np.inf, np.inf), np.maximum(t1, t2))
+            t_min = np.maximum(t_min, low)
+            t_max = np.minimum(t_max, high)
+        return t_min, t_max
+
+
+def shepp_logan():
+    """
+    :return: lista elips zmodyfikowanego fantomu Shepp-Logana
+    """
+    return [Ellipse(*ellipse) for ellipse in SHEPP_LOGAN_ELLIPSES]
+
+
+def _scale(shape):
+    # Środek obrazu i liczba pikseli na jednostkę współrzędnych znormalizowanych
+    height, width = shape[0], shape[1]
+    return height / 2, width / 2, min(height, width) / 2
+
+
+def rasterize(objects, shape, supersample=1):
+    """
+    Rasteryzacja fantomu w dowolnej rozdzielczości. Wartość piksela img[x][y] to wartość w środku
+    piksela albo średnia z supersample x supersample punktów wewnątrz niego
+
+    :param objects: - lista obiektów fantomu (Ellipse, Rectangle)
+    :param shape: - kształt obrazu (wysokość, szerokość)
+    :param supersample: - liczba próbek na bok piksela
+    :return: ndarray o kształcie shape (float64)
+    """
+    height, width = int(shape[0]), int(shape[1])
+    center_x, center_y, scale = _scale((height, width))
+    offsets = (np.arange(supersample) + 0.5) / supersample
+
+    # Wiersz obrazu rośnie w dół (oś y fantomu w górę), kolumna w prawo (oś x fantomu)
+    rows = (np.arange(height)[:, None] + offsets[None, :]).ravel()
+    cols = (np.arange(width)[:, None] + offsets[None, :]).ravel()
+    x = ((cols - center_y) / scale)[None, :]
+    y = ((center_x - rows) / scale)[:, None]
+
+    image = np.zeros((len(rows), len(cols)))
+    for obj in objects:
+        image += np.where(obj.contains(x, y), obj.value, 0.0)
+    return image.reshape(height, supersample, width, supersample).mean(axis=(1, 3))
+
+
+def line_integrals(objects, rays, shape, weighting='length'):
+    """
+    Dokładne całki liniowe fantomu wzdłuż odcinków emiter-detektor
+
+    :param objects: - lista obiektów fantomu
+    :param rays: - ndarray o kształcie (..., 2, 2) w formacie get_parallel_rays (współrzędne pikseli)
+    :param shape: - kształt obrazu, w którego układzie pikseli podane są promienie
+    :param weighting: - 'length' - całka po długości w pikselach, 'bresenham' - całka przeskalowana
+                        przez liczbę kroków Bresenhama na jednostkę długości, porównywalna
+                        z sumami calculate_sinogram
+    :return: ndarray o kształcie rays.shape[:-2]
+    """
+    if weighting not in WEIGHTINGS:
+        raise ValueError("Niepoprawne ważenie. Dozwolone wartości: 'length', 'bresenham'")
+    rays = np.asarray(rays, dtype=np.float64)
+    center_x, center_y, scale = _scale(shape)
+
+    # Końce promieni we współrzędnych znormalizowanych (x - kolumna, y - wiersz w górę)
+    start = ((rays[..., 1, 0] - center_y) / scale, (center_x - rays[..., 0, 0]) / scale)
+    end = ((rays[..., 1, 1] - center_y) / scale, (center_x - rays[..., 0, 1]) / scale)
+    direction = (end[0] - start[0], end[1] - start[1])
+
+    # Długość odcinka w pikselach - parametr t z przedziału [0, 1] to cały odcinek
+    length = np.hypot(*direction) * scale
+    total = np.zeros(rays.shape[:-2])
+    for obj in objects:
+        t_min, t_max = obj.chord(start, direction)
+        inside = np.clip(t_max, 0, 1) - np.clip(t_min, 0, 1)
+        total += obj.value * np.maximum(inside, 0) * length
+
+    if weighting == 'bresenham':
+        # Bresenham stawia jeden punkt na każdy piksel osi wiodącej
+        steps = np.maximum(np.abs(rays[..., 0, 1] - rays[..., 0, 0]), np.abs(rays[..., 1, 1] - rays[..., 1, 0]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            total *= np.where(length > 0, steps / length, 0)
+    return total
+
+
+def phantom_sinogram(objects, shape, steps, span, num_rays, max_angle, weighting='bresenham'):
+    """
+    Sinogram fantomu policzony analitycznie dla wszystkich kątów i promieni naraz, w tej samej
+    geometrii co calculate_sinogram (bez rasteryzacji obrazu i bez macierzy systemowej)
+
+    :param objects: - lista obiektów fantomu
+    :param shape: - kształt obrazu
+    :param steps: - ilość kroków (emiterów oraz detektorów)
+    :param span: - zakres promieni
+    :param num_rays: - liczba promieni
+    :param max_angle: - maksymalny kąt
+    :param weighting: - 'bresenham' (domyślnie, skala jak w calculate_sinogram) lub 'length'
+    :return: ndarray o wymiarach (steps, num_rays)
+    """
+    geometry = get_geometry(shape, steps, span, num_rays, max_angle, trace=False)
+    rays = np.stack([geometry.rays(idx) for idx in range(geometry.steps)])
+    return line_integrals(objects, rays, geometry.shape, weighting)
@@ -0,0 +1,840 @@
+import contextlib
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+from profilowanie import count, stage
+
+# Domyślny limit pamięci dla macierzy systemowych trzymanych w pamięci procesu (1 GiB)
+DEFAULT_CACHE_BYTES = 1 << 30
+
+# Zmienna środowiskowa wskazująca katalog dyskowego cache'a macierzy (.npz)
+CACHE_DIR_ENV = "CT_GEOMETRY_CACHE_DIR"
+
+# Dostępne sposoby projekcji wstecznej: sterowana promieniami (Bresenham) lub pikselami (interpolacja)
+BACKPROJECTION_METHODS = ('ray', 'pixel')
+
+# Modele projektora macierzy systemowej: 'bresenham' - waga 1 dla każdego piksela z algorytmu
+# Bresenhama, 'siddon' - dokładna długość przecięcia promienia z pikselem (algorytm Siddona)
+PROJECTORS = ('bresenham', 'siddon')
+
+# Orientacyjna liczba punktów rasteryzowanych w jednej paczce przy budowie macierzy
+TRACE_CHUNK_POINTS = 1 << 22
+
+
+def get_parallel_rays(radius, pos, angle, span, num_rays):
+    """
+    Funkcja obliczająca współrzędne emitorów i detektorów dla zadanych parametrów
+
+    :param radius: promień okręgu
+    :param pos: środek badanego zdjęcia
+    :param angle: kąt pod którym padają promienie (w równaniach oznaczany alfa)
+    :param span: rozpiętość promieni (w równania oznaczana phi)
+    :param num_rays: liczba emiterów oraz detektorów
+
+    :return: ndarray współrzędnych emiterów i odpowiadających im detektorów
+    """
+
+    alpha = np.radians(angle)
+    theta = np.radians(span)
+
+    # Wektor indeksów promieni
+    ray_indices = np.linspace(0, num_rays - 1, num_rays)
+
+    # Obliczenie kątów dla detektorów i emiterów
+    detector_angles = alpha - (ray_indices * theta / (num_rays - 1)) + theta / 2
+    emitter_angles = alpha + np.pi - (theta / 2) + (ray_indices * theta / (num_rays - 1))
+
+    # Obliczenie współrzędnych emiterów
+    x_e = radius * np.cos(emitter_angles) + pos[0]
+    y_e = radius * np.sin(emitter_angles) + pos[1]
+
+    # Obliczenie współrzędnych detektorów
+    x_d = radius * np.cos(detector_angles) + pos[0]
+    y_d = radius * np.sin(detector_angles) + pos[1]
+
+    # Łączenie współrzędnych w jedną tablicę: dla każdego promienia
+    # element = [[x_det, x_em], [y_det, y_em]]
+    rays = np.empty((num_rays, 2, 2))
+    rays[:, 0, 0] = x_e
+    rays[:, 0, 1] = x_d
+    rays[:, 1, 0] = y_e
+    rays[:, 1, 1] = y_d
+
+    return rays
+
+def get_bresenham_points(x1, x2, y1, y2):
+    """
+    Funkcja obliczająca współrzędne promieni na podstawie algorytmu Bresenhama
+
+    :param x1: - współrzędne x emitera
+    :param x2: - współrzędne x detektora
+    :param y1: - współrzędne y emitera
+    :param y2: - współrzędne y detektora
+
+    :return: lista punktów odpowiadających wiązce
+    """
+    # floaty -> inty
+    x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+    dx = x2 - x1
+    dy = y2 - y1
+
+    # Określenie wiodącej osi
+    is_steep = abs(dy) > abs(dx)
+
+    # Jeżeli OY jest wiodąca odwracamy współrzędne inaczej dzielenie przez 0 przy kącie prostym
+    if is_steep:
+        x1, y1 = y1, x1
+        x2, y2 = y2, x2
+
+    # Jeżeli współrzędne są odwrócone to zamieniamy na potrzeby obliczeń
+    swapped = False
+    if x1 > x2:
+        x1, x2 = x2, x1
+        y1, y2 = y2, y1
+        swapped = True
+
+    # Obliczenie delt jeszcze raz po posprzątaniu inputu
+    dx = x2 - x1
+    dy = y2 - y1
+
+    # Obliczenie błędu
+    error = int(dx / 2.0)
+    ystep = 1 if y1 < y2 else -1
+
+    y = y1
+    points = []
+    for x in range(x1, x2 + 1):
+        coord = (y, x) if is_steep else (x, y)
+        points.append(coord)
+        error -= abs(dy)
+        if error < 0:
+            y += ystep
+            error += dx
+
+    # Odwrócenie współrzędnych punktów jeżeli były w złej kolejności na potrzeby obliczeń
+    if swapped:
+        points.reverse()
+    return points
+
+
+def rasterize_rays(rays, shape):
+    """
+    Wektorowa wersja algorytmu Bresenhama dla wielu promieni jednocześnie. Dla każdego promienia
+    zwraca dokładnie te same piksele co get_bresenham_points, ograniczone do granic obrazu
+
+    :param rays: - ndarray o kształcie (..., 2, 2) w formacie zwracanym przez get_parallel_rays
+                   (można podać promienie wielu kątów naraz)
+    :param shape: - kształt obrazu (wysokość, szerokość)
+
+    :return: płaskie indeksy pikseli (x * szerokość + y) oraz tablica offsetów, w której piksele
+             promienia i to indices[offsets[i]:offsets[i + 1]]
+    """
+    rays = np.reshape(rays, (-1, 2, 2))
+    height, width = int(shape[0]), int(shape[1])
+
+    # floaty -> inty (obcięcie w stronę zera tak jak int())
+    x1 = np.trunc(rays[:, 0, 0]).astype(np.int64)
+    x2 = np.trunc(rays[:, 0, 1]).astype(np.int64)
+    y1 = np.trunc(rays[:, 1, 0]).astype(np.int64)
+    y2 = np.trunc(rays[:, 1, 1]).astype(np.int64)
+
+    # Oś wiodąca (a) i poboczna (b) - odpowiednik zamiany współrzędnych dla stromych promieni
+    is_steep = np.abs(y2 - y1) > np.abs(x2 - x1)
+    a1, a2 = np.where(is_steep, y1, x1), np.where(is_steep, y2, x2)
+    b1, b2 = np.where(is_steep, x1, y1), np.where(is_steep, x2, y2)
+
+    # Zamiana końców tak, żeby a1 <= a2
+    swapped = a1 > a2
+    a1, a2 = np.where(swapped, a2, a1), np.where(swapped, a1, a2)
+    b1, b2 = np.where(swapped, b2, b1), np.where(swapped, b1, b2)
+
+    da = a2 - a1
+    db = np.abs(b2 - b1)
+    error = da // 2
+    b_step = np.where(b1 < b2, 1, -1)
+
+    # Numer promienia i numer kroku wzdłuż osi wiodącej dla każdego punktu
+    lengths = da + 1
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    ray_ids = np.repeat(np.arange(len(rays)), lengths)
+    t = np.arange(ray_ids.size) - starts[ray_ids]
+    # Kolejność punktów jak w get_bresenham_points (od emitera), żeby sumy wychodziły identyczne
+    t = np.where(swapped[ray_ids], da[ray_ids] - t, t)
+
+    # Liczba przesunięć osi pobocznej przed krokiem t wynika wprost z akumulacji błędu:
+    # k = ceil((t * |db| - error) / da), bo błąd po każdym kroku pozostaje w przedziale [0, da)
+    k = -((error[ray_ids] - t * db[ray_ids]) // np.maximum(da, 1)[ray_ids])
+    major = a1[ray_ids] + t
+    minor = b1[ray_ids] + b_step[ray_ids] * k
+
+    steep = is_steep[ray_ids]
+    px = np.where(steep, minor, major)
+    py = np.where(steep, major, minor)
+
+    # Tylko piksele w granicach obrazu
+    inside = (px >= 0) & (px < height) & (py >= 0) & (py < width)
+    indices = px[inside] * width + py[inside]
+    offsets = np.zeros(len(rays) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ray_ids[inside], minlength=len(rays)), out=offsets[1:])
+
+    return indices, offsets
+
+
+def siddon_rays(rays, shape):
+    """
+    Wektorowa wersja algorytmu Siddona dla wielu promieni jednocześnie. Piksel img[x][y] zajmuje
+    kwadrat [x, x + 1) x [y, y + 1), a dla każdego promienia wyznaczane są wszystkie przecięcia
+    odcinka emiter-detektor z liniami siatki i długości kolejnych fragmentów między nimi
+
+    :param rays: - ndarray o kształcie (..., 2, 2) w formacie zwracanym przez get_parallel_rays
+    :param shape: - kształt obrazu (wysokość, szerokość)
+
+    :return: płaskie indeksy pikseli (x * szerokość + y), długości przecięć (w pikselach) oraz tablica
+             offsetów, w której dane promienia i to indices[offsets[i]:offsets[i + 1]]
+    """
+    rays = np.reshape(rays, (-1, 2, 2))
+    height, width = int(shape[0]), int(shape[1])
+    x1, x2 = rays[:, 0, 0], rays[:, 0, 1]
+    y1, y2 = rays[:, 1, 0], rays[:, 1, 1]
+    dx, dy = x2 - x1, y2 - y1
+    length = np.hypot(dx, dy)
+
+    # Parametry alfa przecięć z liniami x = 0..H i y = 0..W (odcinek to alfa z [0, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha_x = (np.arange(height + 1)[None, :] - x1[:, None]) / dx[:, None]
+        alpha_y = (np.arange(width + 1)[None, :] - y1[:, None]) / dy[:, None]
+    # Promień równoległy do osi nie przecina jej linii - przedział wejścia/wyjścia wyznacza druga oś
+    inside_x = (x1 >= 0) & (x1 <= height)
+    inside_y = (y1 >= 0) & (y1 <= width)
+    x_low = np.where(dx != 0, np.minimum(alpha_x[:, 0], alpha_x[:, -1]), np.where(inside_x, -np.inf, np.inf))
+    x_high = np.where(dx != 0, np.maximum(alpha_x[:, 0], alpha_x[:, -1]), np.where(inside_x, np.inf, -np.inf))
+    y_low = np.where(dy != 0, np.minimum(alpha_y[:, 0], alpha_y[:, -1]), np.where(inside_y, -np.inf, np.inf))
+    y_high = np.where(dy != 0, np.maximum(alpha_y[:, 0], alpha_y[:, -1]), np.where(inside_y, np.inf, -np.inf))
+    # Promień omijający obraz dostaje pusty przedział [alpha_min, alpha_min] wewnątrz [0, 1]
+    alpha_min = np.minimum(np.maximum.reduce([x_low, y_low, np.zeros(len(rays))]), 1)
+    alpha_max = np.minimum.reduce([x_high, y_high, np.ones(len(rays))])
+    alpha_max = np.maximum(alpha_max, alpha_min)
+
+    # Wszystkie przecięcia obcięte do części odcinka wewnątrz obrazu; przecięcia spoza niej
+    # i nieistniejące (nan) stają się fragmentami zerowej długości, które są na końcu odrzucane
+    alphas = np.concatenate([alpha_min[:, None], alpha_x, alpha_y, alpha_max[:, None]], axis=1)
+    alphas = np.where(np.isfinite(alphas), alphas, alpha_min[:, None])
+    alphas = np.clip(alphas, alpha_min[:, None], alpha_max[:, None])
+    alphas.sort(axis=1)
+
+    segment = np.diff(alphas, axis=1)
+    middle = (alphas[:, 1:] + alphas[:, :-1]) / 2
+    px = np.floor(x1[:, None] + middle * dx[:, None]).astype(np.int64)
+    py = np.floor(y1[:, None] + middle * dy[:, None]).astype(np.int64)
+    lengths = segment * length[:, None]
+
+    keep = (lengths > 1e-9) & (px >= 0) & (px < height) & (py >= 0) & (py < width)
+    indices = px[keep] * width + py[keep]
+    offsets = np.zeros(len(rays) + 1, dtype=np.int64)
+    np.cumsum(keep.sum(axis=1), out=offsets[1:])
+    return indices, lengths[keep], offsets
+
+
+def ray_symmetries(rays, shape):
+    """
+    Wykrycie promieni, których piksele Bresenhama wynikają z pikseli innego promienia. Promień
+    o zamienionych końcach przechodzi przez te same piksele w odwrotnej kolejności, a na obrazie
+    kwadratowym promień o zamienionych współrzędnych x i y przechodzi przez piksele transponowane
+    (przy max_angle=180 tak są powiązane m.in. kąty theta i 90 - theta z odwróconą kolejnością
+    detektorów, a przy pełnym obrocie dodatkowo theta i theta + 180). Porównywane są końce po
+    obcięciu do liczb całkowitych, więc wyprowadzone piksele są identyczne z wyznaczonymi wprost
+
+    :param rays: - ndarray o kształcie (..., 2, 2) w formacie zwracanym przez get_parallel_rays
+    :param shape: - kształt obrazu (wysokość, szerokość)
+    :return: krotka (source, transposed, reversed) tablic długości liczby promieni: numer promienia
+             źródłowego (pierwszego w grupie; source[i] == i dla promieni wyznaczanych wprost) oraz
+             czy piksele źródła trzeba transponować i czy odwrócić ich kolejność
+    """
+    rays = np.reshape(rays, (-1, 2, 2))
+    x1 = np.trunc(rays[:, 0, 0]).astype(np.int64)
+    x2 = np.trunc(rays[:, 0, 1]).astype(np.int64)
+    y1 = np.trunc(rays[:, 1, 0]).astype(np.int64)
+    y2 = np.trunc(rays[:, 1, 1]).astype(np.int64)
+
+    # Postacie promienia: bez zmian, odwrócony, transponowany, transponowany i odwrócony
+    forms = [(x1, x2, y1, y2), (x2, x1, y2, y1)]
+    if shape[0] == shape[1]:
+        forms += [(y1, y2, x1, x2), (y2, y1, x2, x1)]
+
+    # Każda postać zakodowana jako jedna liczba (końce leżą w odległości mniejszej niż 2 * rozmiar od obrazu)
+    bound = 2 * max(int(shape[0]), int(shape[1])) + 1
+    base = 2 * bound + 1
+    codes = np.stack([((((a + bound) * base + (b + bound)) * base + (c + bound)) * base + (d + bound))
+                      for a, b, c, d in forms])
+
+    # Promienie o tej samej najmniejszej postaci tworzą grupę, źródłem jest pierwszy z nich
+    _, first, inverse = np.unique(codes.min(axis=0), return_index=True, return_inverse=True)
+    source = first[np.ravel(inverse)]
+    # Postacie są inwolucjami, więc szukana jest ta, która ze źródła daje dany promień
+    form = np.argmax(codes[:, source] == codes[0], axis=0)
+    return source, form >= 2, form % 2 == 1
+
+
+def typed_matrix(matrix, dtype):
+    """
+    Macierz CSR z wagami typu dtype, współdzieląca tablice indeksów z matrix. W przeciwieństwie do
+    matrix.astype zachowuje kolejność pikseli w wierszach (od emitera), więc sumy są liczone w tej
+    samej kolejności niezależnie od tego, czy macierz jest cała, czy podzielona na kroki
+    """
+    if matrix.dtype == dtype:
+        return matrix
+    return sparse.csr_matrix((matrix.data.astype(dtype), matrix.indices, matrix.indptr), shape=matrix.shape)
+
+
+class ScanGeometry:
+    """
+    Geometria skanu zapisana jako rzadka macierz systemowa (CSR).
+
+    Wiersz ``idx * num_rays + ray_idx`` macierzy odpowiada promieniowi ``ray_idx`` w kroku ``idx``,
+    a kolumna ``x * shape[1] + y`` pikselowi ``img[x][y]``. Dzięki temu projekcja to ``A @ img.ravel()``,
+    a projekcja wsteczna to ``A.T @ sinogram.ravel()``.
+    """
+
+    def __init__(self, shape, steps, span, num_rays, max_angle, matrix=None, trace=True, projector='bresenham'):
+        """
+        :param shape: - kształt obrazu (wysokość, szerokość)
+        :param steps: - ilość kroków (emiterów oraz detektorów)
+        :param span: - zakres promieni
+        :param num_rays: - liczba promieni
+        :param max_angle: - maksymalny kąt
+        :param matrix: - gotowa macierz systemowa (np. wczytana z dysku), jeżeli None to jest wyznaczana
+        :param trace: - jeżeli False macierz nie jest wyznaczana od razu (można ją budować krokami przez trace_steps)
+        :param projector: - model projektora (jeden z PROJECTORS)
+        """
+        if projector not in PROJECTORS:
+            raise ValueError("Niepoprawny projektor. Dozwolone projektory: 'bresenham', 'siddon'")
+        self.projector = projector
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.steps = int(steps)
+        self.span = span
+        self.num_rays = int(num_rays)
+        self.max_angle = max_angle
+        self._symmetries = None
+        self._typed = {}
+        if matrix is None and trace:
+            matrix = self.trace_steps(0, self.steps)
+        self.matrix = matrix
+
+    @property
+    def key(self):
+        return geometry_key(self.shape, self.steps, self.span, self.num_rays, self.max_angle, self.projector)
+
+    @property
+    def radius(self):
+        return max(self.shape[0] // 2, self.shape[1] // 2) * np.sqrt(2)
+
+    @property
+    def center(self):
+        return self.shape[0] // 2, self.shape[1] // 2
+
+    @property
+    def nbytes(self):
+        return self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes
+
+    def angle(self, idx):
+        return idx * (self.max_angle / self.steps)
+
+    def rays(self, idx):
+        return get_parallel_rays(self.radius, self.center, self.angle(idx), self.span, self.num_rays)
+
+    def symmetries(self):
+        """
+        Symetrie promieni całego skanu (ray_symmetries), wyznaczane raz. Dla projektora Siddona
+        każdy promień jest swoim źródłem - długości przecięć promieni symetrycznych różnią się
+        błędami zaokrągleń, więc nie byłyby identyczne
+
+        :return: krotka (source, transposed, reversed) indeksowana numerem wiersza macierzy
+        """
+        if self._symmetries is None:
+            num_rows = self.steps * self.num_rays
+            if self.projector == 'bresenham':
+                rays = np.stack([self.rays(idx) for idx in range(self.steps)])
+                self._symmetries = ray_symmetries(rays, self.shape)
+            else:
+                self._symmetries = np.arange(num_rows), np.zeros(num_rows, bool), np.zeros(num_rows, bool)
+        return self._symmetries
+
+    def trace_steps(self, first, last):
+        """
+        Wyznaczenie punktów wszystkich promieni kroków [first, last) i zapisanie ich w macierzy CSR.
+        Śledzone są tylko promienie źródłowe (symmetries), a wiersze pozostałych powstają z nich
+        przez przenumerowanie pikseli
+
+        :param first: - numer pierwszego kroku
+        :param last: - numer kroku za ostatnim
+        :return: fragment macierzy systemowej o wymiarach ((last - first) * num_rays, H * W)
+        """
+        height, width = self.shape
+        source, transposed, reversed_ = self.symmetries()
+        rows = np.arange(first * self.num_rays, last * self.num_rays)
+        traced = np.unique(source[rows])
+        indices = []
+        lengths = []
+        counts = []
+        with stage('geometry.trace'):
+            # Promienie są rasteryzowane paczkami, żeby ograniczyć pamięć tablic pomocniczych
+            if self.projector == 'siddon':
+                points_per_ray = height + width + 3
+            else:
+                points_per_ray = 2 * int(self.radius + 2)
+            chunk = max(1, TRACE_CHUNK_POINTS // (self.num_rays * points_per_ray)) * self.num_rays
+            for start in range(0, len(traced), chunk):
+                block = traced[start:start + chunk]
+                block_steps, step_of_ray = np.unique(block // self.num_rays, return_inverse=True)
+                rays = np.stack([self.rays(idx) for idx in block_steps])[np.ravel(step_of_ray),
+                                                                          block % self.num_rays]
+                if self.projector == 'siddon':
+                    chunk_indices, chunk_lengths, offsets = siddon_rays(rays, self.shape)
+                    lengths.append(chunk_lengths)
+                else:
+                    chunk_indices, offsets = rasterize_rays(rays, self.shape)
+                indices.append(chunk_indices.astype(np.int32))
+                counts.append(np.diff(offsets))
+
+            num_rows = len(rows)
+            indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+            counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+            pixels_traced = len(indices)
+            if not np.array_equal(traced, rows):
+                indices, counts = self._derive_rows(indices, counts, traced, rows, chunk)
+            indptr = np.zeros(num_rows + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            if self.projector == 'siddon':
+                data = np.concatenate(lengths) if lengths else np.zeros(0)
+            else:
+                data = np.ones(len(indices), dtype=np.float64)
+        count('rays_traced', len(traced))
+        count('rays_derived', num_rows - len(traced))
+        count('pixels_traced', pixels_traced)
+        count('bytes_allocated', data.nbytes + indices.nbytes + indptr.nbytes)
+        return sparse.csr_matrix((data, indices, indptr), shape=(num_rows, height * width))
+
+    def _derive_rows(self, indices, counts, traced, rows, chunk):
+        # Wiersze rows złożone z pikseli promieni źródłowych traced (w kolejności emiter -> detektor).
+        # Wiersz to ciągły fragment pikseli źródła (albo ich transpozycji) czytany od początku
+        # lub, dla promieni odwróconych, od końca; paczki po chunk wierszy ograniczają pamięć
+        source, transposed, reversed_ = self.symmetries()
+        width = self.shape[1]
+        offsets = np.zeros(len(traced) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        position = np.searchsorted(traced, source[rows])
+        row_counts = counts[position]
+        is_transposed = transposed[rows]
+        pool = indices
+        if is_transposed.any():
+            pool = np.concatenate([indices, (indices % width) * width + indices // width])
+        is_reversed = reversed_[rows]
+        direction = np.where(is_reversed, -1, 1)
+        begin = np.where(is_reversed, offsets[position + 1] - 1, offsets[position]) + is_transposed * len(indices)
+        out_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(row_counts, out=out_offsets[1:])
+        # Piksel k wyjścia należący do wiersza r to pool[begin[r] + direction[r] * (k - out_offsets[r])]
+        shift = begin - direction * out_offsets[:-1]
+        derived = np.empty(out_offsets[-1], dtype=np.int32)
+        for start in range(0, len(rows), chunk):
+            part = slice(start, start + chunk)
+            low, high = out_offsets[start], out_offsets[min(start + chunk, len(rows))]
+            gather = np.repeat(direction[part], row_counts[part]) * np.arange(low, high)
+            gather += np.repeat(shift[part], row_counts[part])
+            derived[low:high] = pool[gather]
+        return derived, row_counts
+
+    def typed(self, dtype):
+        """
+        Macierz systemowa z wagami typu dtype (np. float32), żeby iloczyn z obrazem float32 nie był
+        liczony w float64. Wyznaczana raz i współdzieli tablice indeksów z matrix
+
+        :return: macierz CSR o wagach typu dtype
+        """
+        dtype = np.dtype(dtype)
+        if dtype == self.matrix.dtype:
+            return self.matrix
+        source, typed = self._typed.get(dtype, (None, None))
+        # Macierz mogła zostać podmieniona (np. po wyznaczaniu krok po kroku)
+        if source is not self.matrix:
+            typed = typed_matrix(self.matrix, dtype)
+            self._typed[dtype] = (self.matrix, typed)
+        return typed
+
+    def rows(self, first, last=None, dtype=None):
+        """
+        :param first: - numer pierwszego kroku
+        :param last: - numer kroku za ostatnim (domyślnie tylko krok first)
+        :param dtype: - typ wag (domyślnie typ macierzy systemowej)
+        :return: fragment macierzy systemowej z promieniami danych kroków
+        """
+        last = first + 1 if last is None else last
+        matrix = self.matrix if dtype is None else self.typed(dtype)
+        return matrix[first * self.num_rays:last * self.num_rays]
+
+    def project(self, img):
+        """
+        :param img: - ndarray obrazu o kształcie shape
+        :return: sinogram o wymiarach (steps, num_rays)
+        """
+        return (self.matrix @ np.ravel(img)).reshape(self.steps, self.num_rays)
+
+    def backproject(self, sinogram):
+        """
+        :param sinogram: - sinogram o wymiarach (steps, num_rays)
+        :return: nieznormalizowany obraz o kształcie shape
+        """
+        return (self.matrix.T @ np.ravel(sinogram)).reshape(self.shape)
+
+    def backproject_step(self, idx, row):
+        """
+        :param idx: - numer kroku
+        :param row: - wiersz sinogramu dla danego kroku
+        :return: wkład jednego kroku do obrazu o kształcie shape
+        """
+        return (self.rows(idx).T @ np.ravel(row)).reshape(self.shape)
+
+
+    def backproject_rows(self, rows, first=0, method='ray'):
+        """
+        :param rows: - wiersze sinogramu kolejnych kroków, zaczynając od kroku first
+        :param first: - numer kroku odpowiadającego pierwszemu wierszowi
+        :param method: - 'ray' (macierz systemowa) lub 'pixel' (backproject_pixels)
+        :return: suma wkładów podanych kroków jako obraz o kształcie shape (float32 dla wierszy float32,
+                 w pozostałych przypadkach float64)
+        """
+        rows = np.atleast_2d(rows)
+        if method == 'pixel':
+            return self.backproject_pixels(rows, first)
+        if method != 'ray':
+            raise ValueError("Niepoprawna metoda projekcji wstecznej. Dozwolone metody: 'ray', 'pixel'")
+        block = self.rows(first, first + len(rows), np.result_type(rows, np.float32))
+        return (block.T @ np.ravel(rows)).reshape(self.shape)
+
+    def backproject_pixels(self, rows, first=0):
+        """
+        Projekcja wsteczna sterowana pikselami (nie wymaga macierzy systemowej). Dla każdego kąta
+        wszystkie piksele jednocześnie są rzutowane na oś detektorów, a wartość jest pobierana
+        z sinogramu z interpolacją liniową między sąsiednimi detektorami
+
+        :param rows: - wiersze sinogramu kolejnych kroków, zaczynając od kroku first
+        :param first: - numer kroku odpowiadającego pierwszemu wierszowi
+        :return: nieznormalizowany obraz o kształcie shape (float32 dla wierszy float32, inaczej float64)
+        """
+        # Środki pikseli względem środka obrazu (Bresenham przypisuje punkt do piksela przez obcięcie)
+        x = np.arange(self.shape[0]) + 0.5 - self.center[0]
+        y = np.arange(self.shape[1]) + 0.5 - self.center[1]
+        return self.backproject_points(rows, x, y, first)
+
+    def pixel_branches(self):
+        """
+        Promień i ma odległość R * sin(beta_i) od środka, gdzie beta_i = theta/2 - i * delta.
+        Dla rozpiętości ponad 180 stopni ta sama prosta odpowiada kilku promieniom, więc
+        sumowane są wszystkie gałęzie arcsin, które mieszczą się w [-theta/2, theta/2]
+
+        :return: lista gałęzi (odbita, numer obrotu)
+        """
+        theta = np.radians(self.span)
+        branches = []
+        for mirrored in (False, True):
+            for turn in range(-2, 3):
+                low, high = (np.pi / 2, 3 * np.pi / 2) if mirrored else (-np.pi / 2, np.pi / 2)
+                if low + 2 * np.pi * turn < theta / 2 and high + 2 * np.pi * turn > -theta / 2:
+                    branches.append((mirrored, turn))
+        return branches
+
+    def backproject_points(self, rows, x, y, first=0):
+        """
+        Projekcja wsteczna sterowana pikselami na dowolnej prostokątnej siatce punktów, np. na
+        fragmencie obrazu (ROI) albo w innej rozdzielczości niż obraz wejściowy. Siatka jest
+        rozdzielna, więc rzut punktów na oś detektorów to suma zewnętrzna dwóch wektorów
+
+        :param rows: - wiersze sinogramu kolejnych kroków, zaczynając od kroku first
+        :param x: - współrzędne wierszy siatki względem środka obrotu (w pikselach obrazu wejściowego)
+        :param y: - współrzędne kolumn siatki względem środka obrotu
+        :param first: - numer kroku odpowiadającego pierwszemu wierszowi
+        :return: nieznormalizowany obraz o kształcie (len(x), len(y)), float32 dla wierszy float32,
+                 inaczej float64 (położenia i interpolacja są liczone w float64)
+        """
+        rows = np.atleast_2d(rows)
+        dtype = np.result_type(rows, np.float32)
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        theta = np.radians(self.span)
+        delta = theta / (self.num_rays - 1)
+        branches = self.pixel_branches()
+        detectors = np.arange(self.num_rays)
+        # Punkty poza okręgiem promieni nie dostają nic; zwykle cała siatka leży wewnątrz
+        all_inside = np.hypot(np.abs(x).max(initial=0), np.abs(y).max(initial=0)) <= self.radius
+
+        out_image = np.zeros((len(x), len(y)), dtype=dtype)
+        ratio = np.empty(out_image.shape)
+        base = np.empty(out_image.shape)
+        position = np.empty(out_image.shape)
+        for k, row in enumerate(rows):
+            alpha = np.radians(self.angle(first + k))
+            np.subtract((y * np.cos(alpha))[None, :], (x * np.sin(alpha))[:, None], out=ratio)
+            ratio /= self.radius
+            if not all_inside:
+                outside = np.abs(ratio) > 1
+                np.clip(ratio, -1, 1, out=ratio)
+            np.arcsin(ratio, out=base)
+            for mirrored, turn in branches:
+                # position = (theta/2 - beta) / delta, beta = (pi - base lub base) + 2 * pi * turn
+                if mirrored:
+                    np.subtract(np.pi, base, out=position)
+                else:
+                    position[...] = base
+                if turn:
+                    position += 2 * np.pi * turn
+                np.subtract(theta / 2, position, out=position)
+                position /= delta
+                if not all_inside:
+                    position[outside] = -1
+                # Interpolacja liniowa między detektorami, poza zakresem detektorów wartość 0
+                out_image += np.interp(position, detectors, row, left=0, right=0)
+        return out_image
+
+
+def geometry_key(shape, steps, span, num_rays, max_angle, projector='bresenham'):
+    return int(shape[0]), int(shape[1]), int(steps), float(span), int(num_rays), float(max_angle), projector
+
+
+class GeometryCache:
+    """
+    Cache LRU geometrii skanu z limitem pamięci oraz opcjonalnym zapisem macierzy na dysk (.npz)
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, cache_dir=None):
+        """
+        :param max_bytes: - maksymalny łączny rozmiar macierzy trzymanych w pamięci
+        :param cache_dir: - katalog cache'a dyskowego, jeżeli None to używana jest zmienna CT_GEOMETRY_CACHE_DIR
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def _directory(self):
+        return self.cache_dir if self.cache_dir is not None else os.environ.get(CACHE_DIR_ENV)
+
+    def _path(self, key):
+        height, width, steps, span, num_rays, max_angle, projector = key
+        # Nazwy plików macierzy Bresenhama bez przyrostka, żeby istniejące cache dyskowe pozostały ważne
+        suffix = '' if projector == 'bresenham' else f"_{projector}"
+        name = f"geometry_{height}x{width}_s{steps}_l{span:g}_n{num_rays}_a{max_angle:g}{suffix}.npz"
+        return os.path.join(self._directory(), name)
+
+    def get(self, shape, steps, span, num_rays, max_angle, projector='bresenham'):
+        """
+        Zwraca geometrię z pamięci, z dysku lub wyznacza ją od nowa (w tej kolejności)
+
+        :return: obiekt ScanGeometry
+        """
+        key = geometry_key(shape, steps, span, num_rays, max_angle, projector)
+        # Blokada chroni przed równoległym wyznaczaniem tej samej geometrii przez kilka wątków
+        with self._lock:
+            return self._get(key, shape, steps, span, num_rays, max_angle, projector)
+
+    def _get(self, key, shape, steps, span, num_rays, max_angle, projector):
+        geometry = self._find(key, shape, steps, span, num_rays, max_angle, projector)
+        if geometry is None:
+            geometry = ScanGeometry(shape, steps, span, num_rays, max_angle, projector=projector)
+            self._put(key, geometry)
+        return geometry
+
+    def _find(self, key, shape, steps, span, num_rays, max_angle, projector):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        directory = self._directory()
+        if directory is not None and os.path.exists(self._path(key)):
+            try:
+                matrix = sparse.load_npz(self._path(key)).tocsr()
+            except (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile):
+                # Uszkodzony lub niepełny plik (np. po przerwanym zapisie) to brak w cache'u,
+                # geometria zostanie wyznaczona i zapisana od nowa
+                return None
+            geometry = ScanGeometry(shape, steps, span, num_rays, max_angle, matrix=matrix, projector=projector)
+            self._store(key, geometry)
+            return geometry
+        return None
+
+    def _put(self, key, geometry):
+        directory = self._directory()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            # Zapis przez plik tymczasowy o unikalnej nazwie - katalog jest współdzielony przez procesy
+            # (wsadowe.py, przeglad.py), więc inny proces nigdy nie wczyta niepełnego pliku
+            partial_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(partial_path, 'wb') as f:
+                sparse.save_npz(f, geometry.matrix)
+            os.replace(partial_path, self._path(key))
+        self._store(key, geometry)
+
+    def find(self, shape, steps, span, num_rays, max_angle, projector='bresenham'):
+        """
+        Zwraca geometrię z pamięci lub z dysku, a jeżeli jej tam nie ma to None (bez wyznaczania)
+        """
+        key = geometry_key(shape, steps, span, num_rays, max_angle, projector)
+        with self._lock:
+            return self._find(key, shape, steps, span, num_rays, max_angle, projector)
+
+    def put(self, geometry):
+        """
+        Dodaje do cache'a geometrię wyznaczoną poza nim (np. krok po kroku)
+        """
+        with self._lock:
+            self._put(geometry.key, geometry)
+
+    def _store(self, key, geometry):
+        # Zbyt duże macierze nie trafiają do pamięci, żeby nie wypchnąć całej reszty
+        if geometry.nbytes > self.max_bytes:
+            return
+        self._entries[key] = geometry
+        self._bytes += geometry.nbytes
+        self._evict()
+
+    def get_custom(self, key, build):
+        """
+        Geometria o kluczu spoza geometry_key (np. o dowolnym harmonogramie kątów), trzymana tylko
+        w pamięci - w tym samym limicie bajtów i kolejności LRU co pozostałe geometrie
+
+        :param key: - klucz geometrii (krotka różna od kluczy geometry_key)
+        :param build: - funkcja bez argumentów wyznaczająca geometrię, gdy nie ma jej w cache'u
+        :return: obiekt ScanGeometry
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            geometry = build()
+            self._store(key, geometry)
+            return geometry
+
+    def _evict(self):
+        # Usuwanie najdawniej używanych geometrii aż do zmieszczenia się w limicie
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+
+_cache = GeometryCache()
+
+
+def get_geometry(shape, steps, span, num_rays, max_angle, trace=True, projector='bresenham'):
+    """
+    Funkcja zwracająca (współdzieloną) geometrię skanu dla zadanych parametrów
+
+    :param shape: - kształt obrazu
+    :param steps: - ilość kroków (emiterów oraz detektorów)
+    :param span: - zakres promieni
+    :param num_rays: - liczba promieni
+    :param max_angle: - maksymalny kąt
+    :param trace: - jeżeli False i geometrii nie ma w cache'u, zwracana jest geometria bez macierzy
+                    systemowej (wystarczająca np. do projekcji wstecznej sterowanej pikselami)
+    :param projector: - sposób śledzenia promieni (jeden z PROJECTORS)
+
+    :return: obiekt ScanGeometry
+    """
+    if not trace:
+        geometry = _cache.find(shape[:2], steps, span, num_rays, max_angle, projector)
+        return geometry if geometry is not None else ScanGeometry(shape[:2], steps, span, num_rays, max_angle,
+                                                                  trace=False, projector=projector)
+    return _cache.get(shape[:2], steps, span, num_rays, max_angle, projector)
+
+
+def get_custom_geometry(key, build):
+    """
+    Funkcja zwracająca (współdzieloną) geometrię o własnym kluczu, np. harmonogram.ScheduleGeometry,
+    liczoną w limicie pamięci współdzielonego cache'a (GeometryCache.get_custom)
+    """
+    return _cache.get_custom(key, build)
+
+
+def find_geometry(shape, steps, span, num_rays, max_angle, projector='bresenham'):
+    """
+    Funkcja zwracająca geometrię skanu tylko jeżeli jest już w cache'u (w pamięci lub na dysku)
+
+    :return: obiekt ScanGeometry lub None
+    """
+    return _cache.find(shape[:2], steps, span, num_rays, max_angle, projector)
+
+
+def store_geometry(geometry):
+    """
+    Funkcja zapisująca w cache'u geometrię wyznaczoną poza nim
+    """
+    _cache.put(geometry)
+
+
+def iter_geometry_steps(shape, steps, span, num_rays, max_angle, projector='bresenham'):
+    """
+    Generator fragmentów macierzy systemowej dla kolejnych kroków. Jeżeli geometrii nie ma jeszcze
+    w cache'u, każdy krok jest wyznaczany dopiero gdy jest potrzebny, a po przejściu wszystkich
+    kroków pełna macierz trafia do cache'a
+
+    :return: generator krotek (numer kroku, kąt, fragment macierzy systemowej)
+    """
+    geometry = find_geometry(shape, steps, span, num_rays, max_angle, projector)
+    if geometry is not None:
+        for idx in range(geometry.steps):
+            yield idx, geometry.angle(idx), geometry.rows(idx)
+        return
+
+    geometry = ScanGeometry(shape[:2], steps, span, num_rays, max_angle, trace=False, projector=projector)
+    blocks = []
+    for idx in range(geometry.steps):
+        blocks.append(geometry.trace_steps(idx, idx + 1))
+        yield idx, geometry.angle(idx), blocks[-1]
+    geometry.matrix = sparse.vstack(blocks, format='csr')
+    store_geometry(geometry)
+
+
+def clear_geometry_cache():
+    """
+    Usunięcie wszystkich geometrii z pamięci (pliki .npz na dysku pozostają)
+    """
+    with _cache._lock:
+        _cache.clear()
+
+
+def configure_geometry_cache(max_bytes=None, cache_dir=None):
+    """
+    Zmiana limitu pamięci i katalogu dyskowego dla współdzielonego cache'a geometrii
+    """
+    if max_bytes is not None:
+        with _cache._lock:
+            _cache.max_bytes = max_bytes
+            _cache._evict()
+    if cache_dir is not None:
+        _cache.cache_dir = cache_dir
+
+
+@contextlib.contextmanager
+def geometry_cache_dir(cache_dir):
+    """
+    Tymczasowa zmiana katalogu dyskowego współdzielonego cache'a geometrii na czas bloku with
+    (np. katalog jednego przebiegu) - poprzedni katalog jest przywracany także po błędzie
+    """
+    previous = _cache.cache_dir
+    _cache.cache_dir = cache_dir
+    try:
+        yield
+    finally:
+        _cache.cache_dir = previous
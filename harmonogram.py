@@ -0,0 +1,282 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from geometria import BACKPROJECTION_METHODS, ScanGeometry, get_custom_geometry
+from profilowanie import count, stage
+
+# Złoty podział zakresu kątów: każdy kolejny kąt trafia w największą dotychczasową lukę,
+# więc dowolny początkowy fragment harmonogramu pokrywa zakres prawie równomiernie
+GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+
+# Dokładność (liczba miejsc po przecinku, w stopniach), z jaką kąty z różnych harmonogramów
+# są uznawane za ten sam kąt, np. 3 * (180 / 60) i 9 * (180 / 180)
+ANGLE_DECIMALS = 9
+
+# Liczba brakujących kątów liczonych jedną geometrią (jedna macierz systemowa na paczkę)
+ANGLE_BATCH = 32
+
+# Domyślna liczba wierszy sinogramu pamiętanych przez ProjectionCache (najdawniej dodane są usuwane)
+MAX_CACHED_ANGLES = 4096
+
+
+def uniform_angles(steps, max_angle):
+    """
+    Harmonogram równomierny - taki sam jak w ScanGeometry (kąt kroku idx to idx * (max_angle / steps))
+    """
+    return np.arange(int(steps)) * (max_angle / steps)
+
+
+def golden_angles(count, max_angle=180):
+    """
+    Harmonogram złotego kąta: kolejne kąty co max_angle * GOLDEN_RATIO (modulo max_angle).
+    Skan można przerwać lub przedłużyć w dowolnym momencie bez zmiany wcześniejszych kątów
+    """
+    return np.mod(np.arange(int(count)) * (max_angle * GOLDEN_RATIO), max_angle)
+
+
+def limited_angles(steps, start, stop):
+    """
+    Harmonogram ograniczonego zakresu: steps kątów równomiernie w [start, stop)
+    """
+    return start + np.arange(int(steps)) * ((stop - start) / steps)
+
+
+def angle_key(angle):
+    """
+    :return: klucz kąta w cache'ach - kąt zaokrąglony do ANGLE_DECIMALS, sprowadzony do [0, 360)
+    """
+    return round(float(angle), ANGLE_DECIMALS) % 360.0
+
+
+class ScheduleGeometry(ScanGeometry):
+    """
+    Geometria skanu o dowolnym harmonogramie kątów: kąt kroku idx to angles[idx] zamiast
+    idx * (max_angle / steps). Promienie danego kąta są takie same jak w ScanGeometry, więc
+    wiersze macierzy systemowej (a więc projekcja i wkład do projekcji wstecznej) jednego kąta
+    nie zależą od pozostałych kątów harmonogramu.
+    """
+
+    def __init__(self, shape, angles, span, num_rays, matrix=None, trace=True, projector='bresenham'):
+        """
+        :param angles: - kąty kolejnych kroków (w stopniach)
+        Pozostałe parametry jak w ScanGeometry
+        """
+        self.angles = np.array(angles, dtype=np.float64).reshape(-1)
+        if len(self.angles) == 0:
+            raise ValueError("Harmonogram musi zawierać co najmniej jeden kąt")
+        self.angles.setflags(write=False)
+        # max_angle nie jest używany przez angle(), zostaje jako wartość nominalna
+        super().__init__(shape, len(self.angles), span, num_rays, 180, matrix, trace, projector)
+
+    @property
+    def key(self):
+        return super().key + ('schedule', tuple(self.angles.tolist()))
+
+    def angle(self, idx):
+        return self.angles[idx]
+
+
+def get_schedule_geometry(shape, angles, span, num_rays, projector='bresenham', trace=True):
+    """
+    Funkcja zwracająca (współdzieloną) geometrię o danym harmonogramie kątów. Geometrie są trzymane
+    we współdzielonym cache'u geometrii (kluczem jest też krotka kątów), więc ich macierze mieszczą się
+    w tym samym limicie pamięci co geometrie równomierne
+
+    :param trace: - jeżeli False zwracana jest geometria bez macierzy systemowej (nie trafia do cache'a)
+    :return: obiekt ScheduleGeometry
+    """
+    shape = (int(shape[0]), int(shape[1]))
+    angles = tuple(float(angle) for angle in np.ravel(angles))
+    if not trace:
+        return ScheduleGeometry(shape, angles, span, num_rays, trace=False, projector=projector)
+    # Klucz jak ScheduleGeometry.key, wyznaczony bez śledzenia promieni
+    key = ScheduleGeometry(shape, angles, span, num_rays, trace=False, projector=projector).key
+    return get_custom_geometry(key, lambda: ScheduleGeometry(shape, angles, span, num_rays, projector=projector))
+
+
+class ProjectionCache:
+    """
+    Wiersze sinogramu jednego obrazu pamiętane osobno dla każdego kąta. Nowy harmonogram (np. po
+    zmianie kroku kąta z 4 na 2 stopnie) liczy tylko kąty, których jeszcze nie było, a sinogram
+    z wcześniejszego skanu można dołożyć przez add() i dalej rozszerzać o kolejne kąty.
+    """
+
+    def __init__(self, img, span, num_rays, projector='bresenham', dtype=np.float64, max_angles=MAX_CACHED_ANGLES):
+        """
+        :param img: - ndarray obrazu wejściowego (konwertowany raz na dtype)
+        :param span: - zakres promieni
+        :param num_rays: - liczba promieni
+        :param projector: - model projektora (jeden z PROJECTORS)
+        :param dtype: - typ obliczeń i wierszy sinogramu
+        :param max_angles: - największa liczba pamiętanych wierszy
+        """
+        self.img = np.asarray(img, dtype=dtype)
+        self.shape = (self.img.shape[0], self.img.shape[1])
+        self.span = span
+        self.num_rays = int(num_rays)
+        self.projector = projector
+        self.dtype = self.img.dtype
+        self.max_angles = max_angles
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, angle):
+        return angle_key(angle) in self._rows
+
+    def add(self, angles, sinogram):
+        """
+        Dołożenie gotowych wierszy sinogramu (np. z wcześniejszego skanu tego samego obrazu
+        i z tymi samymi parametrami promieni)
+        """
+        sinogram = np.asarray(sinogram, dtype=self.dtype).reshape(-1, self.num_rays)
+        if len(sinogram) != len(np.ravel(angles)):
+            raise ValueError("Liczba wierszy sinogramu musi być równa liczbie kątów")
+        with self._lock:
+            for angle, row in zip(np.ravel(angles), sinogram):
+                self._store(angle_key(angle), row.copy())
+
+    def _store(self, key, row):
+        row.setflags(write=False)
+        self._rows[key] = row
+        while len(self._rows) > self.max_angles:
+            self._rows.popitem(last=False)
+
+    def missing(self, angles):
+        """
+        :return: kąty harmonogramu (bez powtórzeń, w kolejności harmonogramu), których nie ma w cache'u
+        """
+        seen = set()
+        missing = []
+        with self._lock:
+            for angle in np.ravel(angles):
+                key = angle_key(angle)
+                if key not in self._rows and key not in seen:
+                    seen.add(key)
+                    missing.append(float(angle))
+        return missing
+
+    def _project(self, angles):
+        # Zwraca wyliczone wiersze niezależnie od tego, czy zmieściły się w cache'u
+        geometry = ScheduleGeometry(self.shape, angles, self.span, self.num_rays, projector=self.projector)
+        with stage('sinogram.projection'):
+            rows = (geometry.typed(self.dtype) @ np.ravel(self.img)).reshape(len(angles), self.num_rays)
+        count('rays_projected', rows.size)
+        count('pixels_visited', geometry.matrix.nnz)
+        computed = {angle_key(angle): row for angle, row in zip(angles, rows)}
+        with self._lock:
+            for key, row in computed.items():
+                self._store(key, row)
+        return computed
+
+    def iter_sinogram(self, angles):
+        """
+        Generatorowa wersja sinogram() - wiersze w kolejności harmonogramu, brakujące kąty są
+        liczone paczkami po ANGLE_BATCH, gdy generator do nich dojdzie
+
+        :return: generator krotek (numer kroku, kąt, wiersz sinogramu)
+        """
+        angles = np.ravel(angles)
+        hits = 0
+        for idx, angle in enumerate(angles):
+            key = angle_key(angle)
+            with self._lock:
+                row = self._rows.get(key)
+            if row is None:
+                # Bieżący kąt jest zawsze w paczce - inny wątek mógł go w międzyczasie dodać do cache'a
+                batch = [float(angle)] + [other for other in self.missing(angles[idx + 1:])
+                                          if angle_key(other) != key][:ANGLE_BATCH - 1]
+                row = self._project(batch)[key]
+            else:
+                hits += 1
+            yield idx, float(angle), row
+        count('angles_reused', hits)
+
+    def sinogram(self, angles, out=None):
+        """
+        Sinogram dla dowolnego harmonogramu kątów; liczone są tylko kąty, których nie ma w cache'u
+
+        :param angles: - kąty kolejnych kroków (w stopniach)
+        :param out: - opcjonalna tablica (len(angles), num_rays) na wynik
+        :return: ndarray o wymiarach (len(angles), num_rays)
+        """
+        angles = np.ravel(angles)
+        sinogram = np.empty((len(angles), self.num_rays), dtype=self.dtype) if out is None else out
+        for idx, _, row in self.iter_sinogram(angles):
+            sinogram[idx] = row
+        return sinogram
+
+
+class AngleBackprojection:
+    """
+    Nieznormalizowana projekcja wsteczna jako suma wkładów pojedynczych kątów (wkłady są addytywne).
+    update() z nowym harmonogramem i sinogramem dodaje wkłady kątów nowych lub o zmienionych wierszach
+    i odejmuje wkłady kątów usuniętych, więc zmiana harmonogramu kosztuje tyle, ile kątów się zmieniło.
+    """
+
+    def __init__(self, shape, span, num_rays, method='ray', projector='bresenham', dtype=np.float64):
+        """
+        :param shape: - kształt obrazu (wysokość, szerokość)
+        :param method: - 'ray' lub 'pixel', jak w reverse_radon_transform
+        :param dtype: - typ obliczeń i obrazu
+        """
+        if method not in BACKPROJECTION_METHODS:
+            raise ValueError("Niepoprawna metoda projekcji wstecznej. Dozwolone metody: 'ray', 'pixel'")
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.span = span
+        self.num_rays = int(num_rays)
+        self.method = method
+        self.projector = projector
+        self.dtype = np.dtype(dtype)
+        self.image = np.zeros(self.shape, dtype=self.dtype)
+        self._rows = {}
+
+    def _entries(self, angles, sinogram):
+        # Klucz (kąt, numer wystąpienia) - powtórzony kąt w harmonogramie to osobny wkład
+        entries = {}
+        occurrences = {}
+        for angle, row in zip(np.ravel(angles), sinogram):
+            key = angle_key(angle)
+            occurrences[key] = occurrences.get(key, -1) + 1
+            entries[(key, occurrences[key])] = (float(angle), row)
+        return entries
+
+    def _contribution(self, entries):
+        geometry = ScheduleGeometry(self.shape, [angle for angle, _ in entries], self.span, self.num_rays,
+                                    trace=self.method == 'ray', projector=self.projector)
+        with stage('reconstruction.backprojection'):
+            image = geometry.backproject_rows(np.stack([row for _, row in entries]), 0, self.method)
+        count('rays_backprojected', len(entries) * self.num_rays)
+        return image
+
+    def update(self, angles, sinogram):
+        """
+        :param angles: - kąty kolejnych wierszy sinogramu (w stopniach)
+        :param sinogram: - sinogram (np. przefiltrowany) o wymiarach (len(angles), num_rays)
+        :return: nieznormalizowany obraz - suma wkładów wszystkich kątów harmonogramu
+        """
+        sinogram = np.asarray(sinogram, dtype=self.dtype).reshape(-1, self.num_rays)
+        if len(sinogram) != len(np.ravel(angles)):
+            raise ValueError("Liczba wierszy sinogramu musi być równa liczbie kątów")
+        target = self._entries(angles, sinogram)
+        removed = [key for key, (_, row) in self._rows.items()
+                   if key not in target or not np.array_equal(row, target[key][1])]
+        changed = set(removed)
+        added = [key for key in target if key not in self._rows or key in changed]
+
+        # Gdy prawie wszystko się zmieniło, suma od nowa jest tańsza i nie kumuluje błędów zaokrągleń
+        if len(removed) >= len(target) - len(removed):
+            self.image[...] = 0
+            removed = []
+            added = list(target)
+        if removed:
+            self.image -= self._contribution([self._rows[key] for key in removed])
+        if added:
+            self.image += self._contribution([target[key] for key in added])
+        count('angles_reused', len(target) - len(added))
+        self._rows = {key: (angle, np.array(row)) for key, (angle, row) in target.items()}
+        return self.image
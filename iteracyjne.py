@@ -0,0 +1,148 @@
+import numpy as np
+
+from geometria import get_geometry
+from obliczenia import rmse
+
+ALGORITHMS = ('sart', 'sirt', 'art')
+
+
+def _subset_rows(steps, num_rays, subsets):
+    """
+    Podział kątów na uporządkowane podzbiory (co subsets-ty kąt), tak żeby kolejne podzbiory
+    zawierały możliwie różne kierunki
+
+    :return: lista tablic numerów wierszy macierzy systemowej
+    """
+    subsets = max(1, min(subsets, steps))
+    rays = np.arange(num_rays)
+    return [(np.arange(first, steps, subsets)[:, None] * num_rays + rays).ravel() for first in range(subsets)]
+
+
+def _inverse(values):
+    # Odwrotność z zerami tam, gdzie promień lub piksel nie ma żadnych przecięć
+    out = np.zeros_like(values, dtype=np.float64)
+    np.divide(1.0, values, out=out, where=values > 0)
+    return out
+
+
+def _iterate(update, x, shape, iterations, tolerance, non_negative, callback):
+    """
+    Wspólna pętla iteracji z warunkiem stopu na zmianie RMSE między kolejnymi przybliżeniami
+    """
+    for iteration in range(iterations):
+        previous = x.copy()
+        update(x)
+        if non_negative:
+            np.maximum(x, 0, out=x)
+        change = rmse(x, previous)
+        if callback is not None:
+            callback(iteration, x.reshape(shape), change)
+        if tolerance is not None and change < tolerance:
+            break
+    return x
+
+
+def sart(img, sinogram, steps, span, num_rays, max_angle, iterations=10, relaxation=1.0, subsets=None,
+         non_negative=True, tolerance=1e-4, initial=None, callback=None, projector='bresenham'):
+    """
+    Rekonstrukcja metodą SART z uporządkowanymi podzbiorami kątów (OS-SART)
+
+    :param img: - ndarray obrazu wejściowego (potrzebny tylko jego kształt)
+    :param sinogram: - sinogram wejściowy o wymiarach (steps, num_rays)
+    :param steps: - ilość kroków (emiterów oraz detektorów)
+    :param span: - zakres promieni
+    :param num_rays: - liczba promieni
+    :param max_angle: - maksymalny kąt
+    :param iterations: - maksymalna liczba pełnych przejść przez wszystkie kąty
+    :param relaxation: - współczynnik relaksacji (lambda)
+    :param subsets: - liczba podzbiorów kątów, None oznacza jeden kąt na podzbiór (klasyczny SART)
+    :param non_negative: - obcinanie ujemnych wartości po każdej iteracji
+    :param tolerance: - zatrzymanie gdy RMSE między kolejnymi iteracjami spadnie poniżej tej wartości (None - bez)
+    :param initial: - przybliżenie początkowe (domyślnie obraz zerowy)
+    :param callback: - funkcja wywoływana po każdej iteracji z argumentami (iteracja, obraz, zmiana RMSE)
+    :param projector: - model projektora macierzy systemowej (jeden z PROJECTORS); 'siddon' daje
+                        wagi równe długościom przecięć, zgodne z fizycznym modelem sinogramu
+
+    :return: ndarray zrekonstruowanego obrazu (w jednostkach obrazu wejściowego, bez normalizacji)
+    """
+    geometry = get_geometry(img.shape, steps, span, num_rays, max_angle, projector=projector)
+    matrix = geometry.matrix
+    b = np.ravel(sinogram).astype(np.float64)
+
+    # Macierze podzbiorów oraz sumy wierszy i kolumn liczone raz, przed iteracjami
+    blocks = []
+    for rows in _subset_rows(steps, num_rays, steps if subsets is None else subsets):
+        block = matrix[rows]
+        blocks.append((block, b[rows], _inverse(np.asarray(block.sum(axis=1)).ravel()),
+                       _inverse(np.asarray(block.sum(axis=0)).ravel())))
+
+    def update(x):
+        for block, b_subset, inv_row_sums, inv_col_sums in blocks:
+            residual = (b_subset - block @ x) * inv_row_sums
+            x += relaxation * inv_col_sums * (block.T @ residual)
+
+    x = np.zeros(matrix.shape[1]) if initial is None else np.array(initial, dtype=np.float64).ravel()
+    x = _iterate(update, x, geometry.shape, iterations, tolerance, non_negative, callback)
+    return x.reshape(geometry.shape)
+
+
+def sirt(img, sinogram, steps, span, num_rays, max_angle, iterations=50, relaxation=1.0, non_negative=True,
+         tolerance=1e-4, initial=None, callback=None, projector='bresenham'):
+    """
+    Rekonstrukcja metodą SIRT - wszystkie promienie aktualizują obraz jednocześnie
+    (SART z jednym podzbiorem). Parametry jak w sart
+
+    :return: ndarray zrekonstruowanego obrazu (bez normalizacji)
+    """
+    return sart(img, sinogram, steps, span, num_rays, max_angle, iterations=iterations, relaxation=relaxation,
+                subsets=1, non_negative=non_negative, tolerance=tolerance, initial=initial, callback=callback,
+                projector=projector)
+
+
+def art(img, sinogram, steps, span, num_rays, max_angle, iterations=5, relaxation=0.5, non_negative=True,
+        tolerance=1e-4, initial=None, callback=None, projector='bresenham'):
+    """
+    Rekonstrukcja metodą ART (Kaczmarza) - obraz jest rzutowany kolejno na hiperpłaszczyznę
+    każdego promienia. Parametry jak w sart
+
+    :return: ndarray zrekonstruowanego obrazu (bez normalizacji)
+    """
+    geometry = get_geometry(img.shape, steps, span, num_rays, max_angle, projector=projector)
+    matrix = geometry.matrix
+    b = np.ravel(sinogram).astype(np.float64)
+    norms = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+
+    # Kolejność promieni zgodna z podziałem na podzbiory, żeby kolejne rzuty były możliwie niezależne
+    order = np.concatenate(_subset_rows(steps, num_rays, steps))
+
+    def update(x):
+        for row in order:
+            if norms[row] == 0:
+                continue
+            start, end = indptr[row], indptr[row + 1]
+            weights = data[start:end]
+            pixels = indices[start:end]
+            x[pixels] += relaxation * (b[row] - weights @ x[pixels]) / norms[row] * weights
+
+    x = np.zeros(matrix.shape[1]) if initial is None else np.array(initial, dtype=np.float64).ravel()
+    x = _iterate(update, x, geometry.shape, iterations, tolerance, non_negative, callback)
+    return x.reshape(geometry.shape)
+
+
+def iterative_reconstruction(img, sinogram, steps, span, num_rays, max_angle, algorithm='sart', **kwargs):
+    """
+    Funkcja wybierająca algorytm rekonstrukcji iteracyjnej
+
+    :param algorithm: - 'sart', 'sirt' lub 'art'
+    :param kwargs: - parametry przekazywane do wybranego algorytmu
+
+    :return: ndarray zrekonstruowanego obrazu (bez normalizacji)
+    """
+    if algorithm == 'sart':
+        return sart(img, sinogram, steps, span, num_rays, max_angle, **kwargs)
+    if algorithm == 'sirt':
+        return sirt(img, sinogram, steps, span, num_rays, max_angle, **kwargs)
+    if algorithm == 'art':
+        return art(img, sinogram, steps, span, num_rays, max_angle, **kwargs)
+    raise ValueError("Niepoprawny algorytm. Dozwolone algorytmy: 'sart', 'sirt', 'art'")
@@ -0,0 +1,166 @@
+import os
+import warnings
+
+import numpy as np
+
+from geometria import get_bresenham_points
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Implementacje jąder projekcji: 'python' - referencyjna (pętle po punktach z get_bresenham_points),
+# 'numpy' - macierz systemowa CSR, 'numba' - skompilowane jądra łączące rasteryzację z sumowaniem
+BACKENDS = ('python', 'numpy', 'numba')
+DEFAULT_BACKEND = 'numpy'
+
+# Zmienna środowiskowa z domyślną implementacją (gdy parametr backend nie jest podany)
+BACKEND_ENV = "CT_BACKEND"
+
+# W czystym Pythonie prange to zwykły range, numba zamienia go na pętlę równoległą
+prange = numba.prange if numba is not None else range
+
+
+def available_backends():
+    """
+    :return: implementacje, których można użyć w tym środowisku
+    """
+    return tuple(name for name in BACKENDS if name != 'numba' or numba is not None)
+
+
+def resolve_backend(backend=None, projector='bresenham'):
+    """
+    Wybór implementacji: parametr, potem zmienna CT_BACKEND, potem DEFAULT_BACKEND. Brakująca numba
+    oznacza powrót do 'numpy' (z ostrzeżeniem), a projektor inny niż Bresenham jest obsługiwany
+    tylko przez macierz systemową
+
+    :return: nazwa implementacji, która zostanie użyta
+    """
+    name = backend if backend is not None else os.environ.get(BACKEND_ENV, DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError("Niepoprawna implementacja. Dozwolone implementacje: 'python', 'numpy', 'numba'")
+    if name == 'numba' and numba is None:
+        warnings.warn("Pakiet numba nie jest zainstalowany - używana jest implementacja 'numpy'", RuntimeWarning)
+        name = 'numpy'
+    if projector != 'bresenham':
+        name = 'numpy'
+    return name
+
+
+def _endpoints(rays):
+    # floaty -> inty (obcięcie w stronę zera tak jak int() w get_bresenham_points)
+    rays = np.reshape(rays, (-1, 2, 2))
+    return tuple(np.ascontiguousarray(np.trunc(rays[:, axis, end]).astype(np.int64))
+                 for axis, end in ((0, 0), (0, 1), (1, 0), (1, 1)))
+
+
+def _walk_project(x1s, x2s, y1s, y2s, img, out):
+    # Sumy pikseli wzdłuż linii Bresenhama, bez listy punktów. Punkty są odwiedzane od emitera,
+    # w tej samej kolejności co w macierzy systemowej, więc sumy są identyczne
+    height, width = img.shape
+    for r in prange(x1s.shape[0]):
+        x1, x2, y1, y2 = x1s[r], x2s[r], y1s[r], y2s[r]
+        steep = abs(y2 - y1) > abs(x2 - x1)
+        a1, a2, b1, b2 = (y1, y2, x1, x2) if steep else (x1, x2, y1, y2)
+        swapped = a1 > a2
+        if swapped:
+            a1, a2, b1, b2 = a2, a1, b2, b1
+        da = a2 - a1
+        db = abs(b2 - b1)
+        error = da // 2
+        b_step = 1 if b1 < b2 else -1
+        total = 0.0
+        for i in range(da + 1):
+            t = da - i if swapped else i
+            # Liczba kroków osi pobocznej przed krokiem t, jak w rasterize_rays
+            b = b1 + b_step * (-((error - t * db) // max(da, 1)))
+            px, py = (b, a1 + t) if steep else (a1 + t, b)
+            if 0 <= px < height and 0 <= py < width:
+                total += img[px, py]
+        out[r] = total
+
+
+def _walk_backproject(x1s, x2s, y1s, y2s, values, out):
+    # Dodanie wartości promieni do pikseli linii Bresenhama; szeregowo i w kolejności promieni,
+    # bo równoległe dodawanie do tego samego piksela wymagałoby synchronizacji
+    height, width = out.shape
+    for r in range(x1s.shape[0]):
+        x1, x2, y1, y2 = x1s[r], x2s[r], y1s[r], y2s[r]
+        steep = abs(y2 - y1) > abs(x2 - x1)
+        a1, a2, b1, b2 = (y1, y2, x1, x2) if steep else (x1, x2, y1, y2)
+        swapped = a1 > a2
+        if swapped:
+            a1, a2, b1, b2 = a2, a1, b2, b1
+        da = a2 - a1
+        db = abs(b2 - b1)
+        error = da // 2
+        b_step = 1 if b1 < b2 else -1
+        value = values[r]
+        for i in range(da + 1):
+            t = da - i if swapped else i
+            b = b1 + b_step * (-((error - t * db) // max(da, 1)))
+            px, py = (b, a1 + t) if steep else (a1 + t, b)
+            if 0 <= px < height and 0 <= py < width:
+                out[px, py] += value
+
+
+if numba is not None:
+    _walk_project_compiled = numba.njit(parallel=True, cache=True)(_walk_project)
+    _walk_backproject_compiled = numba.njit(cache=True)(_walk_backproject)
+
+
+def _rays(geometry, first, last):
+    return np.concatenate([geometry.rays(idx) for idx in range(first, last)])
+
+
+def project(geometry, img, first, last, backend, dtype=np.float64):
+    """
+    Projekcja kroków [first, last) wybraną implementacją
+
+    :param geometry: - ScanGeometry (dla 'numpy' z wyznaczoną macierzą systemową)
+    :param img: - ndarray obrazu
+    :param backend: - nazwa implementacji zwrócona przez resolve_backend
+    :param dtype: - typ obrazu i wyniku ('python' i 'numba' sumują piksele promienia w float64)
+    :return: ndarray o wymiarach ((last - first) * num_rays,)
+    """
+    if backend == 'numpy':
+        return geometry.rows(first, last, dtype) @ np.ravel(np.asarray(img, dtype=dtype))
+    img = np.ascontiguousarray(img, dtype=dtype)
+    rays = _rays(geometry, first, last)
+    out = np.zeros(len(rays), dtype=dtype)
+    if backend == 'numba':
+        _walk_project_compiled(*_endpoints(rays), img, out)
+        return out
+    height, width = img.shape
+    for r, ray in enumerate(rays):
+        total = 0.0
+        for x, y in get_bresenham_points(ray[0][0], ray[0][1], ray[1][0], ray[1][1]):
+            if 0 <= x < height and 0 <= y < width:
+                total += img[x][y]
+        out[r] = total
+    return out
+
+
+def backproject(geometry, rows, first, backend, dtype=np.float64):
+    """
+    Projekcja wsteczna (sterowana promieniami) wierszy sinogramu kolejnych kroków od first
+
+    :param dtype: - typ wierszy i wyniku
+    :return: suma wkładów podanych kroków jako obraz o kształcie geometry.shape
+    """
+    rows = np.atleast_2d(np.asarray(rows, dtype=dtype))
+    if backend == 'numpy':
+        return geometry.backproject_rows(rows, first)
+    values = np.ascontiguousarray(np.ravel(rows))
+    rays = _rays(geometry, first, first + len(rows))
+    out = np.zeros(geometry.shape, dtype=dtype)
+    if backend == 'numba':
+        _walk_backproject_compiled(*_endpoints(rays), values, out)
+        return out
+    height, width = geometry.shape
+    for ray, value in zip(rays, values):
+        for x, y in get_bresenham_points(ray[0][0], ray[0][1], ray[1][0], ray[1][1]):
+            if 0 <= x < height and 0 <= y < width:
+                out[x][y] += value
+    return out
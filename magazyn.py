@@ -0,0 +1,294 @@
+import json
+import os
+
+import numpy as np
+
+from obliczenia import (BACKPROJECTION_METHODS, INTERMEDIATE_CHECKPOINTS, calculate_sinogram, filter_sinogram_fft,
+                        normalize, reverse_radon_transform)
+from wyniki_posrednie import BackprojectionSteps, checkpoint_steps
+
+# Plik z nagłówkiem (geometria skanu, opis tablic) w katalogu magazynu
+META_FILE = 'meta.json'
+META_VERSION = 1
+
+# Nazwy standardowych tablic magazynu: (przekroje, steps, num_rays) lub (przekroje, H, W)
+SINOGRAM = 'sinogram'
+FILTERED = 'filtered'
+RECONSTRUCTION = 'reconstruction'
+CHECKPOINTS = 'checkpoints'
+DONE = 'done'
+
+# Parametry przetwarzania, od których zależą gotowe przekroje (poza geometrią skanu)
+PROCESSING_KEYS = ('window', 'method', 'projector')
+
+
+class VolumeStore:
+    """
+    Dyskowy magazyn sinogramów, wyników pośrednich i zrekonstruowanych objętości. Każda tablica
+    to osobny plik .npy otwierany jako memmap, w którym pierwszą osią jest numer przekroju,
+    więc jeden przekrój to jeden ciągły fragment pliku i można go czytać i zapisywać bez
+    wczytywania całości. Nagłówek meta.json zapisuje geometrię skanu i opis tablic.
+    """
+
+    def __init__(self, path, mode='r'):
+        """
+        Otwarcie istniejącego magazynu (nowy tworzy create_store)
+
+        :param path: - katalog magazynu
+        :param mode: - 'r' tylko odczyt, 'r+' odczyt i zapis
+        """
+        if mode not in ('r', 'r+'):
+            raise ValueError("Niepoprawny tryb magazynu. Dozwolone tryby: 'r', 'r+'")
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != META_VERSION:
+            raise ValueError(f"Nieobsługiwana wersja magazynu: {self.meta.get('version')}")
+        self._arrays = {}
+
+    @property
+    def slices(self):
+        return self.meta['slices']
+
+    @property
+    def shape(self):
+        return tuple(self.meta['geometry']['shape'])
+
+    @property
+    def geometry_args(self):
+        """
+        :return: krotka (shape, steps, span, num_rays, max_angle) jak w get_geometry
+        """
+        geometry = self.meta['geometry']
+        return (self.shape, geometry['steps'], geometry['span'], geometry['num_rays'], geometry['max_angle'])
+
+    @property
+    def attributes(self):
+        return self.meta['attributes']
+
+    @property
+    def processing(self):
+        """
+        :return: słownik parametrów przetwarzania (PROCESSING_KEYS) gotowych przekrojów lub None. Magazyny
+                 bez tego pola (starsze) mogą je mieć tylko w atrybutach zapisanych przez objetosc.py
+        """
+        if 'processing' in self.meta:
+            return self.meta['processing']
+        if all(key in self.meta['attributes'] for key in PROCESSING_KEYS):
+            return {key: self.meta['attributes'][key] for key in PROCESSING_KEYS}
+        return None
+
+    def check_processing(self, window, method, projector):
+        """
+        Sprawdzenie, czy przekroje oznaczone jako gotowe (DONE) policzono z tymi samymi parametrami
+        przetwarzania - inaczej pominięte przekroje nie odpowiadałyby zapisanym parametrom. Magazyn bez
+        zapisanych parametrów przyjmuje podane
+        """
+        processing = {'window': window, 'method': method, 'projector': projector}
+        stored = self.processing
+        if stored is not None and stored != processing:
+            raise ValueError(f"W katalogu {self.path} jest magazyn policzony z innymi parametrami przetwarzania "
+                             f"({stored}, podano {processing}) - wyniki należy zapisać w innym katalogu")
+        if self.meta.get('processing') != processing:
+            self.meta['processing'] = processing
+            self._write_meta()
+
+    def __contains__(self, name):
+        return name in self.meta['arrays']
+
+    def __getitem__(self, name):
+        """
+        :return: memmap tablicy o podanej nazwie (wszystkie przekroje)
+        """
+        if name not in self._arrays:
+            if name not in self:
+                raise KeyError(name)
+            self._arrays[name] = np.load(self._file(name), mmap_mode=self.mode)
+        return self._arrays[name]
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    def _write_meta(self):
+        # Zapis przez plik tymczasowy - przerwany zapis nie zostawia uszkodzonego nagłówka
+        partial_path = os.path.join(self.path, META_FILE + '.part')
+        with open(partial_path, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(partial_path, os.path.join(self.path, META_FILE))
+
+    def create_array(self, name, slice_shape, dtype=np.float32):
+        """
+        Utworzenie (lub otwarcie istniejącej, zgodnej) tablicy o kształcie (slices, *slice_shape)
+
+        :param name: - nazwa tablicy (np. SINOGRAM, RECONSTRUCTION)
+        :param slice_shape: - kształt jednego przekroju
+        :param dtype: - typ danych zapisywanych na dysku
+        :return: memmap tablicy
+        """
+        if self.mode != 'r+':
+            raise ValueError("Magazyn otwarty tylko do odczytu")
+        shape = (self.slices,) + tuple(int(n) for n in slice_shape)
+        dtype = np.dtype(dtype)
+        if name in self:
+            array = self[name]
+            if array.shape != shape or array.dtype != dtype:
+                raise ValueError(f"Tablica {name} ma kształt {array.shape} i typ {array.dtype}, "
+                                 f"oczekiwano {shape} i {dtype}")
+            return array
+        self._arrays[name] = np.lib.format.open_memmap(self._file(name), mode='w+', dtype=dtype, shape=shape)
+        self.meta['arrays'][name] = {'shape': list(shape), 'dtype': dtype.str}
+        self._write_meta()
+        return self._arrays[name]
+
+    def set_attributes(self, **attributes):
+        """
+        Zapis dodatkowych informacji w nagłówku (muszą dać się zapisać w JSON)
+        """
+        self.meta['attributes'].update(attributes)
+        self._write_meta()
+
+    def flush(self):
+        for array in self._arrays.values():
+            if isinstance(array, np.memmap) and self.mode == 'r+':
+                array.flush()
+
+    def close(self):
+        self.flush()
+        self._arrays.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def backprojection_steps(self, idx, method='ray', projector='bresenham'):
+        """
+        Wyniki pośrednie projekcji wstecznej przekroju idx odtworzone z zapisanego sinogramu
+        i punktów kontrolnych (bez ponownych obliczeń)
+
+        :return: obiekt BackprojectionSteps
+        """
+        name = FILTERED if FILTERED in self else SINOGRAM
+        shape, steps, span, num_rays, max_angle = self.geometry_args
+        return BackprojectionSteps(shape, steps, span, num_rays, max_angle, self[name][idx],
+                                   checkpoint_steps(steps, INTERMEDIATE_CHECKPOINTS), self[CHECKPOINTS][idx], method,
+                                   projector)
+
+
+def create_store(path, slices, shape, steps, span, num_rays, max_angle, attributes=None, processing=None):
+    """
+    Utworzenie pustego magazynu dla danej geometrii skanu. Jeżeli w katalogu jest już magazyn
+    o tej samej geometrii, liczbie przekrojów i parametrach przetwarzania, jest on otwierany
+    (można dokończyć przerwane obliczenia)
+
+    :param path: - katalog magazynu
+    :param slices: - liczba przekrojów
+    :param shape: - kształt przekroju (wysokość, szerokość)
+    :param steps: - ilość kroków (emiterów oraz detektorów)
+    :param span: - zakres promieni
+    :param num_rays: - liczba promieni
+    :param max_angle: - maksymalny kąt
+    :param attributes: - dodatkowe informacje zapisywane w nagłówku (np. dane pacjenta)
+    :param processing: - opcjonalny słownik z oknem filtra, metodą i projektorem (PROCESSING_KEYS)
+                         sprawdzany przez check_processing
+    :return: obiekt VolumeStore otwarty do zapisu
+    """
+    geometry = {'shape': [int(shape[0]), int(shape[1])], 'steps': int(steps), 'span': span,
+                'num_rays': int(num_rays), 'max_angle': max_angle}
+    if os.path.exists(os.path.join(path, META_FILE)):
+        store = VolumeStore(path, 'r+')
+        if store.meta['geometry'] != geometry or store.slices != slices:
+            raise ValueError(f"W katalogu {path} jest magazyn o innej geometrii lub liczbie przekrojów")
+        if processing is not None:
+            store.check_processing(**processing)
+        if attributes:
+            store.set_attributes(**attributes)
+        return store
+
+    os.makedirs(path, exist_ok=True)
+    meta = {'version': META_VERSION, 'slices': int(slices), 'geometry': geometry, 'arrays': {},
+            'attributes': dict(attributes or {})}
+    if processing is not None:
+        meta['processing'] = {key: processing[key] for key in PROCESSING_KEYS}
+    partial_path = os.path.join(path, META_FILE + '.part')
+    with open(partial_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(partial_path, os.path.join(path, META_FILE))
+    return VolumeStore(path, 'r+')
+
+
+def open_store(path, mode='r'):
+    """
+    Otwarcie istniejącego magazynu - wyniki są dostępne jako memmapy, bez ponownych obliczeń
+    """
+    return VolumeStore(path, mode)
+
+
+def scan_slice(store, idx, img, window=None, method='ray', intermediate=False, projector='bresenham'):
+    """
+    Sinogram, (opcjonalnie) filtrowanie i rekonstrukcja jednego przekroju z zapisem wyników
+    bezpośrednio do memmapów magazynu
+
+    :param store: - magazyn otwarty do zapisu
+    :param idx: - numer przekroju
+    :param img: - ndarray przekroju o kształcie store.shape
+    :param window: - okno filtra (jedno z FILTER_WINDOWS) lub None - bez filtrowania
+    :param method: - 'ray' lub 'pixel'
+    :param intermediate: - zapis punktów kontrolnych projekcji wstecznej (CHECKPOINTS)
+    :param projector: - model projektora (jeden z PROJECTORS)
+    """
+    if method not in BACKPROJECTION_METHODS:
+        raise ValueError("Niepoprawna metoda projekcji wstecznej. Dozwolone metody: 'ray', 'pixel'")
+    shape, steps, span, num_rays, max_angle = store.geometry_args
+    if tuple(np.shape(img)) != shape:
+        raise ValueError(f"Przekrój ma kształt {np.shape(img)}, magazyn oczekuje {shape}")
+
+    sinograms = store.create_array(SINOGRAM, (steps, num_rays))
+    calculate_sinogram(img, steps, span, num_rays, max_angle, out=sinograms[idx], projector=projector)
+    sinogram = sinograms[idx]
+    if window is not None:
+        filtered = store.create_array(FILTERED, (steps, num_rays))
+        filtered[idx] = filter_sinogram_fft(sinogram, window)
+        sinogram = filtered[idx]
+
+    reconstruction = store.create_array(RECONSTRUCTION, shape)
+    if intermediate:
+        checkpoints = store.create_array(CHECKPOINTS, (min(INTERMEDIATE_CHECKPOINTS, steps),) + shape)
+        result = reverse_radon_transform(img, sinogram, steps, span, num_rays, max_angle, intermediate=True,
+                                         method=method, projector=projector)
+        checkpoints[idx] = result.checkpoint_images
+        reconstruction[idx] = normalize(result[-1])
+    else:
+        reverse_radon_transform(img, sinogram, steps, span, num_rays, max_angle, method=method,
+                                out=reconstruction[idx], projector=projector)
+
+    store.create_array(DONE, (), dtype=np.uint8)[idx] = 1
+    store.flush()
+
+
+def scan_volume(store, images, window=None, method='ray', intermediate=False, log=None, projector='bresenham'):
+    """
+    Skanowanie i rekonstrukcja kolejnych przekrojów z zapisem do magazynu. Przekroje mogą
+    pochodzić z generatora, więc w pamięci jest naraz tylko jeden przekrój, a przekroje
+    oznaczone jako gotowe w poprzednim przebiegu są pomijane (przebieg z innymi parametrami
+    przetwarzania kończy się błędem, check_processing)
+
+    :param store: - magazyn otwarty do zapisu
+    :param images: - iterowalny zbiór ndarray przekrojów (w kolejności numerów przekrojów)
+    :param window: - okno filtra lub None
+    :param method: - 'ray' lub 'pixel'
+    :param intermediate: - zapis punktów kontrolnych projekcji wstecznej
+    :param log: - opcjonalna funkcja wypisująca postęp
+    :param projector: - model projektora (jeden z PROJECTORS)
+    """
+    store.check_processing(window, method, projector)
+    done = store.create_array(DONE, (), dtype=np.uint8)
+    for idx, img in enumerate(images):
+        if done[idx]:
+            continue
+        scan_slice(store, idx, img, window, method, intermediate, projector)
+        if log is not None:
+            log(f"[{idx + 1}/{store.slices}] slice reconstructed")
@@ -0,0 +1,199 @@
+import argparse
+import datetime
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from geometria import GeometryCache, configure_geometry_cache, geometry_cache_dir, get_geometry
+from magazyn import DONE, FILTERED, RECONSTRUCTION, SINOGRAM, create_store, open_store, scan_slice
+from obliczenia import BACKPROJECTION_METHODS, FILTER_WINDOWS, PROJECTORS
+from pliki_dicom import load_image, read_study_date, save_series_as_dicom, slice_position, sort_series
+
+# Podkatalog magazynu z dyskowym cache'em geometrii współdzielonym przez procesy
+GEOMETRY_DIR = 'geometry'
+
+
+def find_series(paths):
+    """
+    Pliki .dcm z podanych plików i katalogów (bez podkatalogów)
+    """
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+        else:
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith('.dcm'))
+    return files
+
+
+def _slice_spacing(positions):
+    # Odstęp między przekrojami jako mediana różnic położeń (1 mm, jeżeli nie da się go wyznaczyć)
+    values = [position for position in positions if position is not None]
+    if len(values) < 2:
+        return 1.0
+    spacing = float(np.median(np.abs(np.diff(values))))
+    return spacing if spacing > 0 else 1.0
+
+
+def _reconstruct_slice(store_path, idx, path, window, method, projector):
+    # Każdy proces otwiera magazyn osobno i zapisuje tylko swój przekrój
+    store = open_store(store_path, 'r+')
+    img, _ = load_image(path)
+    scan_slice(store, idx, img, window, method, projector=projector)
+    store.close()
+    return idx
+
+
+def reconstruct_series(paths, store_path, steps, span, num_rays, max_angle, window='shepp-logan', method='ray',
+                       workers=1, log=print, projector='bresenham'):
+    """
+    Symulacja skanu i rekonstrukcja wszystkich przekrojów serii DICOM. Przekroje są sortowane wzdłuż
+    osi serii, geometria skanu jest wyznaczana raz (i zapisywana na dysku dla procesów), a przekroje
+    są liczone równolegle w puli procesów i zapisywane do magazynu dyskowego. Przekroje gotowe
+    w poprzednim przebiegu są pomijane
+
+    :param paths: - lista plików .dcm serii (w dowolnej kolejności)
+    :param store_path: - katalog magazynu z wynikami
+    :param steps: - ilość kroków (emiterów oraz detektorów)
+    :param span: - zakres promieni
+    :param num_rays: - liczba promieni
+    :param max_angle: - maksymalny kąt
+    :param window: - okno filtra sinogramu lub None - bez filtrowania
+    :param method: - sposób projekcji wstecznej ('ray' lub 'pixel')
+    :param workers: - liczba procesów (1 - obliczenia w bieżącym procesie)
+    :param log: - funkcja wypisująca postęp
+    :param projector: - model projektora (jeden z PROJECTORS)
+    :return: magazyn (VolumeStore) z wynikami
+    """
+    series = sort_series(paths)
+    if not series:
+        raise ValueError("Seria nie zawiera żadnych plików DICOM")
+    shape = (int(series[0][1].Rows), int(series[0][1].Columns))
+    for path, dcm in series:
+        if (int(dcm.Rows), int(dcm.Columns)) != shape:
+            raise ValueError(f"Przekrój {path} ma wymiary {dcm.Rows}x{dcm.Columns}, oczekiwano {shape[0]}x{shape[1]}")
+
+    first = series[0][1]
+    positions = [slice_position(dcm) for _, dcm in series]
+    attributes = {
+        'files': [path for path, _ in series],
+        'positions': [None if dcm.get('ImagePositionPatient') is None else
+                      [float(value) for value in dcm.ImagePositionPatient] for _, dcm in series],
+        'orientation': None if first.get('ImageOrientationPatient') is None else
+        [float(value) for value in first.ImageOrientationPatient],
+        'pixel_spacing': [float(value) for value in first.get('PixelSpacing', (1.0, 1.0))],
+        'slice_spacing': _slice_spacing(positions),
+        'patient_name': str(first.get('PatientName', 'Unknown')),
+        'patient_id': str(first.get('PatientID', '')),
+        'study_date': read_study_date(first).isoformat(),
+        'study_uid': str(first.get('StudyInstanceUID', '')) or None,
+        'window': window, 'method': method, 'projector': projector,
+    }
+    store = create_store(store_path, len(series), shape, steps, span, num_rays, max_angle, attributes,
+                         processing={'window': window, 'method': method, 'projector': projector})
+
+    # Tablice są tworzone przed startem procesów, żeby nagłówek był zapisywany tylko tutaj
+    store.create_array(SINOGRAM, (steps, num_rays))
+    if window is not None:
+        store.create_array(FILTERED, (steps, num_rays))
+    store.create_array(RECONSTRUCTION, shape)
+    done = store.create_array(DONE, (), dtype=np.uint8)
+    todo = [(idx, path) for idx, (path, _) in enumerate(series) if not done[idx]]
+    log(f"{len(todo)} slice(s) to reconstruct, {len(series) - len(todo)} already done")
+
+    # Katalog geometrii przebiegu jest ustawiany tylko na czas obliczeń (lub w procesach puli) -
+    # współdzielony cache procesu wywołującego nie zapisuje potem do katalogu tego przebiegu
+    geometry_dir = os.path.join(store_path, GEOMETRY_DIR)
+    finished = 0
+    if workers <= 1:
+        with geometry_cache_dir(geometry_dir):
+            for idx, path in todo:
+                scan_slice(store, idx, load_image(path)[0], window, method, projector=projector)
+                finished += 1
+                log(f"[{finished}/{len(todo)}] {path}")
+        store.flush()
+        return store
+
+    # Geometria wyznaczana raz, przed uruchomieniem procesów, które wczytują ją z dysku
+    if todo:
+        GeometryCache(cache_dir=geometry_dir).put(get_geometry(shape, steps, span, num_rays, max_angle,
+                                                               projector=projector))
+
+    with ProcessPoolExecutor(workers, initializer=configure_geometry_cache, initargs=(None, geometry_dir)) as pool:
+        pending = {}
+        queue = iter(todo)
+        while True:
+            for idx, path in queue:
+                pending[pool.submit(_reconstruct_slice, store_path, idx, path, window, method, projector)] = path
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                path = pending.pop(future)
+                future.result()
+                finished += 1
+                log(f"[{finished}/{len(todo)}] {path}")
+    # Memmapy procesu głównego widzą zapisy procesów, ale nagłówek trzeba wczytać ponownie
+    return open_store(store_path, 'r+')
+
+
+def write_series(store, directory, comments=""):
+    """
+    Zapis zrekonstruowanej objętości z magazynu jako wieloprzekrojowej serii DICOM z położeniami
+    i danymi pacjenta z serii wejściowej
+
+    :return: lista ścieżek zapisanych plików
+    """
+    attributes = store.attributes
+    positions = attributes.get('positions')
+    if positions is None or any(position is None for position in positions):
+        positions = None
+    return save_series_as_dicom(store[RECONSTRUCTION], directory, attributes.get('patient_name', 'Unknown'),
+                                attributes.get('patient_id', ''),
+                                datetime.date.fromisoformat(attributes['study_date']) if 'study_date' in attributes
+                                else datetime.date.today(), comments, positions=positions,
+                                orientation=attributes.get('orientation'),
+                                pixel_spacing=attributes.get('pixel_spacing', (1.0, 1.0)),
+                                slice_thickness=attributes.get('slice_spacing', 1.0),
+                                study_uid=attributes.get('study_uid'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconstruct every slice of a DICOM series (sorted by "
+                                                 "ImagePositionPatient/InstanceNumber) and write the volume as "
+                                                 "a multi-instance DICOM series.")
+    parser.add_argument("inputs", nargs="+", help="series directory or .dcm files")
+    parser.add_argument("-o", "--output", required=True, help="output directory for the reconstructed series")
+    parser.add_argument("--store", help="directory for the on-disk volume store (default: <output>/store)")
+    parser.add_argument("--steps", type=int, default=180, help="number of scan steps (default: 180)")
+    parser.add_argument("--span", type=float, default=120, help="detector spread in degrees (default: 120)")
+    parser.add_argument("--num-rays", type=int, default=250, help="number of detectors (default: 250)")
+    parser.add_argument("--max-angle", type=float, default=180, help="total rotation in degrees (default: 180)")
+    parser.add_argument("--filter", default="shepp-logan", choices=FILTER_WINDOWS + ('none',),
+                        help="sinogram filter window (default: shepp-logan)")
+    parser.add_argument("--method", default="ray", choices=BACKPROJECTION_METHODS,
+                        help="back-projection method (default: ray)")
+    parser.add_argument("--projector", default="bresenham", choices=PROJECTORS,
+                        help="ray model: Bresenham pixel walk or Siddon exact intersection lengths "
+                             "(default: bresenham)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--comments", default="", help="ImageComments written to every slice")
+    args = parser.parse_args(argv)
+
+    files = find_series(args.inputs)
+    store_path = args.store or os.path.join(args.output, 'store')
+    store = reconstruct_series(files, store_path, args.steps, args.span, args.num_rays, args.max_angle,
+                               None if args.filter == 'none' else args.filter, args.method, args.workers,
+                               projector=args.projector)
+    paths = write_series(store, args.output, args.comments)
+    print(f"{len(paths)} slice(s) written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
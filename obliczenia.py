@@ -1,105 +1,138 @@
-import copy
+import functools
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from scipy.signal import convolve2d
 
-def get_parallel_rays(radius, pos, angle, span, num_rays):
+from geometria import (BACKPROJECTION_METHODS, PROJECTORS, get_parallel_rays, get_bresenham_points, get_geometry,
+                       iter_geometry_steps, typed_matrix)
+from harmonogram import get_schedule_geometry
+from jadra import backproject, project, resolve_backend
+from profilowanie import count, run_in_context, stage
+from wyniki_posrednie import SinogramSteps, BackprojectionSteps
+
+# Liczba punktów kontrolnych zapisywanych dla wyników pośrednich projekcji wstecznej
+INTERMEDIATE_CHECKPOINTS = 8
+
+# Typy danych obliczeń: float64 (domyślny) oraz float32 - połowa pamięci sinogramów, obrazów i wag
+# macierzy systemowej. Zmierzone różnice float32 względem float64 (względem największej wartości
+# wyniku, fantom Shepp-Logana 64-512 px): sinogram i przefiltrowany sinogram 4e-7 - 6e-6 (rosną
+# z rozmiarem), znormalizowana rekonstrukcja 3e-7 - 3e-6, RMSE do 2e-7; FLOAT32_TOLERANCE to
+# dopuszczalna różnica, którą sprawdza benchmark.py --parity
+COMPUTE_DTYPES = (np.dtype(np.float64), np.dtype(np.float32))
+FLOAT32_TOLERANCE = 1e-4
+
+# Poziomy podglądu rekonstrukcji (dzielniki rozdzielczości), od najgrubszego do pełnej rozdzielczości
+PREVIEW_LEVELS = (4, 2, 1)
+
+
+def _compute_dtype(dtype, *arrays):
+    """
+    Typ obliczeń: podany dtype, a jeżeli None - typ danych wejściowych (liczby całkowite -> float64)
     """
-    Funkcja obliczająca współrzędne emitorów i detektorów dla zadanych parametrów
+    if dtype is None:
+        dtype = np.result_type(*[np.asarray(array) for array in arrays])
+        if dtype not in COMPUTE_DTYPES:
+            dtype = np.float64
+    dtype = np.dtype(dtype)
+    if dtype not in COMPUTE_DTYPES:
+        raise ValueError("Niepoprawny typ danych. Dozwolone typy: float64, float32")
+    return dtype
 
-    :param radius: promień okręgu
-    :param pos: środek badanego zdjęcia
-    :param angle: kąt pod którym padają promienie (w równaniach oznaczany alfa)
-    :param span: rozpiętość promieni (w równania oznaczana phi)
-    :param num_rays: liczba emiterów oraz detektorów
 
-    :return: ndarray współrzędnych emiterów i odpowiadających im detektorów
+def _step_chunks(steps, n_chunks):
     """
+    Podział kroków na ciągłe, możliwie równe przedziały [first, last)
+    """
+    bounds = np.linspace(0, steps, min(n_chunks, steps) + 1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
 
-    alpha = np.radians(angle)
-    theta = np.radians(span)
 
-    # Wektor indeksów promieni
-    ray_indices = np.linspace(0, num_rays - 1, num_rays)
+def _run_chunks(func, tasks, n_workers, executor):
+    """
+    Wykonanie zadań szeregowo lub w puli wątków/procesów. Wyniki są zwracane zawsze
+    w kolejności zadań, dzięki czemu redukcja jest deterministyczna
 
-    # Obliczenie kątów dla detektorów i emiterów
-    detector_angles = alpha - (ray_indices * theta / (num_rays - 1)) + theta / 2
-    emitter_angles = alpha + np.pi - (theta / 2) + (ray_indices * theta / (num_rays - 1))
+    :param func: - funkcja wykonywana dla każdego zadania (musi dać się zserializować dla puli procesów)
+    :param tasks: - lista krotek argumentów
+    :param n_workers: - liczba wątków tworzonej puli (None lub 1 oznacza obliczenia szeregowe)
+    :param executor: - gotowa pula z concurrent.futures (ma pierwszeństwo przed n_workers)
+    """
+    if executor is None and (n_workers is None or n_workers <= 1):
+        for task in tasks:
+            yield func(*task)
+        return
+
+    own_pool = executor is None
+    pool = ThreadPoolExecutor(n_workers) if own_pool else executor
+    futures = []
+    try:
+        if isinstance(pool, ThreadPoolExecutor):
+            # Wątki puli liczą do profilu wywołującego (kopia kontekstu dla każdego zadania)
+            futures = [pool.submit(run_in_context(func), *task) for task in tasks]
+        else:
+            futures = [pool.submit(func, *task) for task in tasks]
+        for future in futures:
+            yield future.result()
+    finally:
+        if own_pool:
+            # Ręczne anulowanie zamiast shutdown(cancel_futures=True), które wymaga Pythona 3.9
+            for future in futures:
+                future.cancel()
+            pool.shutdown()
 
-    # Obliczenie współrzędnych emiterów
-    x_e = radius * np.cos(emitter_angles) + pos[0]
-    y_e = radius * np.sin(emitter_angles) + pos[1]
 
-    # Obliczenie współrzędnych detektorów
-    x_d = radius * np.cos(detector_angles) + pos[0]
-    y_d = radius * np.sin(detector_angles) + pos[1]
+def _chunk_count(n_workers, executor):
+    if executor is None and (n_workers is None or n_workers <= 1):
+        return 1
+    return n_workers if n_workers is not None else os.cpu_count() or 1
 
-    # Łączenie współrzędnych w jedną tablicę: dla każdego promienia
-    # element = [[x_det, x_em], [y_det, y_em]]
-    rays = np.empty((num_rays, 2, 2))
-    rays[:, 0, 0] = x_e
-    rays[:, 0, 1] = x_d
-    rays[:, 1, 0] = y_e
-    rays[:, 1, 1] = y_d
 
-    return rays
+def _block(geometry, first, last, dtype):
+    # Cała macierz bez kopiowania, gdy przedział obejmuje wszystkie kroki (domyślna ścieżka szeregowa);
+    # fragment jest wycinany dopiero w zadaniu, więc naraz istnieją tylko fragmenty liczonych przedziałów
+    if first == 0 and last == geometry.steps:
+        return geometry.typed(dtype)
+    return geometry.rows(first, last, dtype)
 
-def get_bresenham_points(x1, x2, y1, y2):
-    """
-    Funkcja obliczająca współrzędne promieni na podstawie algorytmu Bresenhama
 
-    :param x1: - współrzędne x emitera
-    :param x2: - współrzędne x detektora
-    :param y1: - współrzędne y emitera
-    :param y2: - współrzędne y detektora
+def _project_block(geometry, first, last, dtype, img_flat):
+    return _block(geometry, first, last, dtype) @ img_flat
+
+
+def _backproject_block(geometry, first, last, dtype, rows, shape):
+    return (_block(geometry, first, last, dtype).T @ np.ravel(rows)).reshape(shape)
+
+
+def _project_kernel_block(geometry, img, first, last, backend, dtype):
+    return project(geometry, img, first, last, backend, dtype)
 
-    :return: lista punktów odpowiadających wiązce
-    """
-    # floaty -> inty
-    x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-    dx = x2 - x1
-    dy = y2 - y1
 
-    # Określenie wiodącej osi
-    is_steep = abs(dy) > abs(dx)
+def _backproject_kernel_block(geometry, rows, first, backend, dtype):
+    return backproject(geometry, rows, first, backend, dtype)
 
-    # Jeżeli OY jest wiodąca odwracamy współrzędne inaczej dzielenie przez 0 przy kącie prostym
-    if is_steep:
-        x1, y1 = y1, x1
-        x2, y2 = y2, x2
 
-    # Jeżeli współrzędne są odwrócone to zamieniamy na potrzeby obliczeń
-    swapped = False
-    if x1 > x2:
-        x1, x2 = x2, x1
-        y1, y2 = y2, y1
-        swapped = True
+def _backproject_pixel_block(geometry, rows, first):
+    return geometry.backproject_pixels(rows, first)
 
-    # Obliczenie delt jeszcze raz po posprzątaniu inputu
-    dx = x2 - x1
-    dy = y2 - y1
 
-    # Obliczenie błędu
-    error = int(dx / 2.0)
-    ystep = 1 if y1 < y2 else -1
+def _backproject_points_block(geometry, rows, first, x, y):
+    return geometry.backproject_points(rows, x, y, first)
 
-    y = y1
-    points = []
-    for x in range(x1, x2 + 1):
-        coord = (y, x) if is_steep else (x, y)
-        points.append(coord)
-        error -= abs(dy)
-        if error < 0:
-            y += ystep
-            error += dx
 
-    # Odwrócenie współrzędnych punktów jeżeli były w złej kolejności na potrzeby obliczeń
-    if swapped:
-        points.reverse()
-    return points
+def _scan_geometry(shape, steps, span, num_rays, max_angle, angles, trace, projector):
+    # Geometria równomierna (współdzielona przez GeometryCache) albo o podanym harmonogramie kątów
+    if angles is None:
+        return get_geometry(shape, steps, span, num_rays, max_angle, trace=trace, projector=projector)
+    if len(np.ravel(angles)) != steps:
+        raise ValueError("Liczba kątów harmonogramu musi być równa liczbie kroków")
+    return get_schedule_geometry(shape, angles, span, num_rays, projector, trace=trace)
 
 
-def calculate_sinogram(img, steps, span, num_rays, max_angle, intermediate=False):
+def calculate_sinogram(img, steps, span, num_rays, max_angle, intermediate=False, n_workers=None, executor=None,
+                       out=None, projector='bresenham', backend=None, dtype=np.float64, angles=None):
     """
     Funkcja obliczająca sinogram obrazu wejściowego
 
@@ -109,40 +142,57 @@ def calculate_sinogram(img, steps, span, num_rays, max_angle, intermediate=False
     :param num_rays: - liczba promieni
     :param max_angle: - maksymalny kąt
     :param intermediate: możliwość uzyskania wyników pośrednich jeżeli True
+    :param n_workers: - liczba wątków, między które dzielone są kroki (None - obliczenia szeregowe)
+    :param executor: - opcjonalna pula concurrent.futures (np. ProcessPoolExecutor) zamiast n_workers
+    :param out: - opcjonalna tablica (steps, num_rays), np. memmap z magazynu, do której trafia wynik
+    :param projector: - 'bresenham' - suma pikseli linii Bresenhama, 'siddon' - suma pikseli ważona
+                        dokładną długością przecięcia promienia z pikselem
+    :param backend: - implementacja jąder projekcji (jedna z jadra.BACKENDS, domyślnie ze zmiennej CT_BACKEND
+                      lub 'numpy'); 'python' i 'numba' nie budują macierzy systemowej
+    :param dtype: - typ obliczeń i wyniku (jeden z COMPUTE_DTYPES); obraz jest konwertowany raz na wejściu,
+                    a dla float32 używane są wagi float32 macierzy systemowej
+    :param angles: - opcjonalny harmonogram steps kątów (np. z harmonogram.golden_angles), max_angle
+                     jest wtedy pomijany
 
     :return ndarray odpowiadający sinogramowi
     """
-    # Pusty ndarray wypełniany dalej sinogramem (czarny obraz)
-    sinogram = np.zeros((steps, num_rays))
-    if intermediate:
-        iterations = []
-
-    for idx in range(steps):
-        # Kąt padania promieni i współrzędne emiterów oraz detektorów
-        angle = idx * (max_angle/steps)
-        rays = get_parallel_rays(max(img.shape[0]//2, img.shape[1]//2) * np.sqrt(2),
-                                 (img.shape[0]//2, img.shape[1]//2), angle, span, num_rays)
-        for ray_idx, ray in enumerate(rays):
-            # Współrzędne wiązek z emiterów
-            emitter_value = 0
-            points = get_bresenham_points(ray[0][0], ray[0][1], ray[1][0], ray[1][1])
-            for point in points:
-                # Rozświetlanie pikseli w granicach obrazu
-                if (0 <= point[0] < img.shape[0]) and (0 <= point[1] < img.shape[1]):
-                    emitter_value += img[point[0]][point[1]]
-            sinogram[idx][ray_idx] = emitter_value
-        if intermediate:
-            iterations.append(copy.deepcopy(sinogram))
+    dtype = _compute_dtype(dtype)
+    img = np.asarray(img, dtype=dtype)
+    backend = resolve_backend(backend, projector)
+    # Geometria (macierz systemowa) jest wyznaczana raz i współdzielona z projekcją wsteczną
+    with stage('sinogram.geometry'):
+        geometry = _scan_geometry(img.shape, steps, span, num_rays, max_angle, angles, backend == 'numpy',
+                                  projector)
+    with stage('sinogram.projection'):
+        chunks = _step_chunks(steps, _chunk_count(n_workers, executor))
+        if backend == 'numpy':
+            func = _project_block
+            img_flat = np.ravel(img)
+            tasks = [(geometry, first, last, dtype, img_flat) for first, last in chunks]
+        else:
+            func = _project_kernel_block
+            tasks = [(geometry, img, first, last, backend, dtype) for first, last in chunks]
+        sinogram = np.empty((steps, num_rays), dtype=dtype) if out is None else out
+        # Każdy przedział od razu trafia na swoje miejsce (także do memmapu), bez sklejania całości
+        for (first, last), rows in zip(chunks, _run_chunks(func, tasks, n_workers, executor)):
+            sinogram[first:last] = rows.reshape(last - first, num_rays)
+    count('rays_projected', steps * num_rays)
+    if geometry.matrix is not None:
+        count('pixels_visited', geometry.matrix.nnz)
+    count('bytes_allocated', sinogram.nbytes)
 
     # By wyświetlić prawidłowo trezeba transponować ponieważ format odpowiada formatowi
     # danych zbieranych przez rzeczywisty tomograf (każdy wiersz to wyniki uzyskane
     # dla danego kąta), który powodowałby błędne wykreślenie sinogramu
     if intermediate:
-        return iterations
+        # Stan po kroku k to pierwsze k + 1 wierszy sinogramu, więc wystarczy przechować sam sinogram
+        return SinogramSteps(sinogram)
     else:
         return sinogram
 
-def reverse_radon_transform(img, sinogram, steps, span, num_rays, max_angle, intermediate=False):
+def reverse_radon_transform(img, sinogram, steps, span, num_rays, max_angle, intermediate=False, n_workers=None,
+                            executor=None, method='ray', out=None, projector='bresenham', backend=None,
+                            dtype=np.float64, angles=None):
     """
     Funkcja uzyskująca rekonstrukcję oryginalnego obrazu na podstawie sinogramu używając
     odwróconej transformaty Radona
@@ -154,33 +204,226 @@ def reverse_radon_transform(img, sinogram, steps, span, num_rays, max_angle, int
     :param num_rays: - liczba promieni
     :param max_angle: - maksymalny kąt
     :param intermediate: możliwość uzyskania wyników pośrednich jeżeli True
+    :param n_workers: - liczba wątków, między które dzielone są kroki (None - obliczenia szeregowe)
+    :param executor: - opcjonalna pula concurrent.futures (np. ProcessPoolExecutor) zamiast n_workers
+    :param method: - 'ray' - projekcja sterowana promieniami (Bresenham), 'pixel' - sterowana pikselami
+                     z interpolacją liniową między detektorami (szybsza i bez artefaktów mory)
+    :param out: - opcjonalna tablica o kształcie obrazu (np. memmap z magazynu) na znormalizowany wynik,
+                  nie łączy się z intermediate
+    :param projector: - model projektora dla metody 'ray' (jeden z PROJECTORS), metoda 'pixel' go nie używa
+    :param backend: - implementacja jąder projekcji wstecznej 'ray' (jedna z jadra.BACKENDS), jak w calculate_sinogram
+    :param dtype: - typ obliczeń i wyniku (jeden z COMPUTE_DTYPES), sinogram jest konwertowany raz na wejściu
+    :param angles: - harmonogram kątów wierszy sinogramu jak w calculate_sinogram, nie łączy się z intermediate
 
     :return: ndarray przedstawiąjący zrekonstruowany obraz wejściowy
     """
-    out_image = np.zeros((img.shape[0], img.shape[1]))
+    dtype = _compute_dtype(dtype)
+    if method not in BACKPROJECTION_METHODS:
+        raise ValueError("Niepoprawna metoda projekcji wstecznej. Dozwolone metody: 'ray', 'pixel'")
+    if intermediate and out is not None:
+        raise ValueError("Parametr out nie jest obsługiwany razem z intermediate")
+    if intermediate and angles is not None:
+        raise ValueError("Parametr angles nie jest obsługiwany razem z intermediate")
+    backend = resolve_backend(backend, projector)
+    with stage('reconstruction.geometry'):
+        geometry = _scan_geometry(img.shape, steps, span, num_rays, max_angle, angles,
+                                  method == 'ray' and backend == 'numpy', projector)
+    shape = (img.shape[0], img.shape[1])
+    sinogram = np.asarray(sinogram, dtype=dtype)
+    n_chunks = _chunk_count(n_workers, executor)
     if intermediate:
-        iterations = []
-
-    for idx in range(steps):
-        angle = idx * max_angle / steps
-        rays = get_parallel_rays(max(img.shape[0] // 2, img.shape[1] // 2) * np.sqrt(2),
-                                 (img.shape[0] // 2, img.shape[1] // 2), angle, span, num_rays)
-        for ray_idx, ray in enumerate(rays):
-            points = get_bresenham_points(ray[0][0], ray[0][1], ray[1][0], ray[1][1])
-            for point in points:
-                # Tylko dla punktów zawierających się w sinogramie
-                if (0 <= point[0] < img.shape[0]) and (0 <= point[1] < img.shape[1]):
-                    out_image[point[0]][point[1]] += sinogram[idx][ray_idx]
-        if intermediate:
-            iterations.append(copy.deepcopy(out_image))
+        # Granice przedziałów są jednocześnie punktami kontrolnymi wyników pośrednich
+        n_chunks = max(n_chunks, INTERMEDIATE_CHECKPOINTS)
+    chunks = _step_chunks(steps, n_chunks)
+    if method == 'pixel':
+        func = _backproject_pixel_block
+        tasks = [(geometry, sinogram[first:last], first) for first, last in chunks]
+    elif backend != 'numpy':
+        func = _backproject_kernel_block
+        tasks = [(geometry, sinogram[first:last], first, backend, dtype) for first, last in chunks]
+    else:
+        func = _backproject_block
+        tasks = [(geometry, first, last, dtype, sinogram[first:last], shape) for first, last in chunks]
+
+    # Częściowe obrazy przedziałów są sumowane na bieżąco, w stałej kolejności
+    out_image = np.zeros(shape, dtype=dtype)
+    checkpoints = []
+    with stage('reconstruction.backprojection'):
+        for partial in _run_chunks(func, tasks, n_workers, executor):
+            with stage('reconstruction.accumulate'):
+                out_image += partial
+            if intermediate:
+                with stage('reconstruction.checkpoints'):
+                    checkpoints.append(out_image.astype(np.float32))
+    count('rays_backprojected', steps * num_rays)
+    if method == 'pixel':
+        count('pixels_visited', steps * out_image.size)
+    elif geometry.matrix is not None:
+        count('pixels_visited', geometry.matrix.nnz)
+    count('bytes_allocated', out_image.nbytes * (len(chunks) + 1) + sum(c.nbytes for c in checkpoints))
 
     if intermediate:
-        return iterations
+        return BackprojectionSteps(shape, steps, span, num_rays, max_angle, sinogram,
+                                   [last - 1 for _, last in chunks], checkpoints, method, projector)
+    elif out is not None:
+        out[...] = normalize(out_image)
+        return out
     else:
         return normalize(out_image)
 
-def normalize(img):
-    return (img - img.min()) / (img.max() - img.min())
+def region_grid(shape, roi=None, output_shape=None):
+    """
+    Siatka punktów rekonstrukcji fragmentu obrazu w dowolnej rozdzielczości
+
+    :param shape: - kształt obrazu wejściowego (wysokość, szerokość)
+    :param roi: - prostokąt (x0, y0, x1, y1) w pikselach obrazu wejściowego (x - wiersze, y - kolumny,
+                  x1 i y1 nie wchodzą do prostokąta), domyślnie cały obraz
+    :param output_shape: - kształt wyniku (wysokość, szerokość), domyślnie rozmiar prostokąta w pikselach
+    :return: współrzędne środków pikseli wyniku (x, y) względem środka obrotu
+    """
+    x0, y0, x1, y1 = (0, 0, shape[0], shape[1]) if roi is None else roi
+    if not x1 > x0 or not y1 > y0:
+        raise ValueError("Niepoprawny prostokąt ROI: wymagane x0 < x1 oraz y0 < y1")
+    if output_shape is None:
+        output_shape = (max(1, int(round(x1 - x0))), max(1, int(round(y1 - y0))))
+    height, width = int(output_shape[0]), int(output_shape[1])
+    if height < 1 or width < 1:
+        raise ValueError("Kształt wyniku musi mieć dodatnie wymiary")
+    # Środki pikseli wyniku, tak jak w backproject_pixels (środek obrotu w (H // 2, W // 2))
+    x = x0 + (np.arange(height) + 0.5) * ((x1 - x0) / height) - shape[0] // 2
+    y = y0 + (np.arange(width) + 0.5) * ((y1 - y0) / width) - shape[1] // 2
+    return x, y
+
+
+def reconstruct_region(img, sinogram, steps, span, num_rays, max_angle, roi=None, output_shape=None,
+                       n_workers=None, executor=None, dtype=np.float64):
+    """
+    Rekonstrukcja (projekcja wsteczna sterowana pikselami) tylko wybranego prostokąta obrazu
+    i w dowolnej rozdzielczości - koszt zależy od liczby pikseli wyniku, a nie od rozmiaru obrazu.
+    Nie wymaga macierzy systemowej, więc kolejne poziomy podglądu nie wyznaczają geometrii od nowa
+    (używana jest geometria z cache'a, jeżeli już jest)
+
+    :param img: - ndarray obrazu wejściowego (używany jest tylko jego kształt)
+    :param sinogram: - sinogram wejściowy
+    :param roi: - prostokąt (x0, y0, x1, y1) w pikselach obrazu wejściowego, domyślnie cały obraz
+    :param output_shape: - kształt wyniku (wysokość, szerokość), domyślnie rozmiar prostokąta
+    :param n_workers: - liczba wątków, między które dzielone są kroki (None - obliczenia szeregowe)
+    :param executor: - opcjonalna pula concurrent.futures zamiast n_workers
+    :param dtype: - typ obliczeń i wyniku (jeden z COMPUTE_DTYPES)
+    :return: ndarray o kształcie output_shape znormalizowany do [0, 1] w obrębie prostokąta
+    """
+    dtype = _compute_dtype(dtype)
+    shape = (img.shape[0], img.shape[1])
+    x, y = region_grid(shape, roi, output_shape)
+    sinogram = np.asarray(sinogram, dtype=dtype)
+    with stage('reconstruction.geometry'):
+        geometry = get_geometry(shape, steps, span, num_rays, max_angle, trace=False)
+    chunks = _step_chunks(steps, _chunk_count(n_workers, executor))
+    tasks = [(geometry, sinogram[first:last], first, x, y) for first, last in chunks]
+    out_image = np.zeros((len(x), len(y)), dtype=dtype)
+    with stage('reconstruction.backprojection'):
+        for partial in _run_chunks(_backproject_points_block, tasks, n_workers, executor):
+            out_image += partial
+    count('rays_backprojected', steps * num_rays)
+    count('pixels_visited', steps * out_image.size)
+    return normalize(out_image)
+
+
+def iter_preview(img, sinogram, steps, span, num_rays, max_angle, roi=None, output_shape=None,
+                 levels=PREVIEW_LEVELS, n_workers=None, executor=None, dtype=np.float64):
+    """
+    Podgląd od zgrubnego do pełnego: rekonstrukcja prostokąta (lub całego obrazu) najpierw
+    w 1/4, potem w 1/2 i na końcu w pełnej rozdzielczości. Zgrubne poziomy kosztują 1/16 i 1/4
+    pełnej rekonstrukcji, więc pierwszy obraz jest dostępny prawie od razu
+
+    :param levels: - dzielniki rozdzielczości kolejnych poziomów
+    Pozostałe parametry jak w reconstruct_region
+    :return: generator krotek (dzielnik, znormalizowany obraz)
+    """
+    x0, y0, x1, y1 = (0, 0, img.shape[0], img.shape[1]) if roi is None else roi
+    if output_shape is None:
+        output_shape = (max(1, int(round(x1 - x0))), max(1, int(round(y1 - y0))))
+    for factor in levels:
+        level_shape = (max(1, -(-int(output_shape[0]) // factor)), max(1, -(-int(output_shape[1]) // factor)))
+        yield factor, reconstruct_region(img, sinogram, steps, span, num_rays, max_angle, (x0, y0, x1, y1),
+                                         level_shape, n_workers, executor, dtype)
+
+
+def iter_sinogram(img, steps, span, num_rays, max_angle, projector='bresenham', dtype=np.float64):
+    """
+    Generatorowa wersja calculate_sinogram - wiersze sinogramu są zwracane od razu po
+    obliczeniu danego kąta
+
+    :param img: - ndarray obrazu wejściowego
+    :param steps: - ilość kroków (emiterów oraz detektorów)
+    :param span: - zakres promieni
+    :param num_rays: - liczba promieni
+    :param max_angle: - maksymalny kąt
+    :param projector: - model projektora, jak w calculate_sinogram
+    :param dtype: - typ obliczeń, jak w calculate_sinogram
+
+    :return: generator krotek (numer kroku, kąt, wiersz sinogramu)
+    """
+    dtype = _compute_dtype(dtype)
+    img_flat = np.ravel(np.asarray(img, dtype=dtype))
+    for idx, angle, block in iter_geometry_steps(img.shape, steps, span, num_rays, max_angle, projector):
+        with stage('sinogram.projection'):
+            row = typed_matrix(block, dtype) @ img_flat
+        count('rays_projected', num_rays)
+        count('pixels_visited', block.nnz)
+        yield idx, angle, row
+
+def iter_reconstruction(img, sinogram, steps, span, num_rays, max_angle, method='ray', projector='bresenham',
+                        dtype=np.float64):
+    """
+    Generatorowa wersja reverse_radon_transform - po każdym kącie zwracany jest
+    (nieznormalizowany) obraz z dotychczas zsumowanych projekcji. Zwracany jest zawsze
+    ten sam bufor, więc stan, który ma zostać zachowany, trzeba skopiować
+
+    :param img: - ndarray obrazu wejściowego
+    :param sinogram: - sinogram wejściowy
+    :param steps: - ilość kroków (emiterów oraz detektorów)
+    :param span: - zakres promieni
+    :param num_rays: - liczba promieni
+    :param max_angle: - maksymalny kąt
+    :param method: - 'ray' lub 'pixel', jak w reverse_radon_transform
+    :param projector: - model projektora dla metody 'ray'
+    :param dtype: - typ obliczeń, jak w reverse_radon_transform
+
+    :return: generator krotek (numer kroku, kąt, częściowy obraz)
+    """
+    dtype = _compute_dtype(dtype)
+    shape = (img.shape[0], img.shape[1])
+    sinogram = np.asarray(sinogram, dtype=dtype)
+    out_image = np.zeros(shape, dtype=dtype)
+    if method == 'pixel':
+        geometry = get_geometry(shape, steps, span, num_rays, max_angle, trace=False)
+        for idx in range(steps):
+            with stage('reconstruction.backprojection'):
+                out_image += geometry.backproject_pixels(sinogram[idx], idx)
+            count('rays_backprojected', num_rays)
+            count('pixels_visited', out_image.size)
+            yield idx, geometry.angle(idx), out_image
+        return
+    for idx, angle, block in iter_geometry_steps(shape, steps, span, num_rays, max_angle, projector):
+        with stage('reconstruction.backprojection'):
+            out_image += (typed_matrix(block, dtype).T @ sinogram[idx]).reshape(shape)
+        count('rays_backprojected', num_rays)
+        count('pixels_visited', block.nnz)
+        yield idx, angle, out_image
+
+def normalize(img, dtype=None):
+    """
+    Przeskalowanie obrazu do przedziału [0, 1] (jedna tablica wynikowa, dzielenie w miejscu)
+
+    :param dtype: - typ wyniku (jeden z COMPUTE_DTYPES), domyślnie typ obrazu
+    """
+    dtype = _compute_dtype(dtype, img)
+    with stage('normalize'):
+        low, high = img.min(), img.max()
+        out = np.subtract(img, low, dtype=dtype)
+        out /= dtype.type(high - low)
+        return out
 
 def __create_kernel(size, kernel_type):
     """
@@ -243,18 +486,100 @@ def create_shepp_logan_kernel(size):
     kernel_2d = np.outer(kernel_1d, kernel_1d)
     return kernel_2d
 
-def filter_sinogram(sinogram, kernel):
+def filter_sinogram(sinogram, kernel, dtype=None):
     """
     Dokonuje dwuwymiarowego splotu sinogramu z podanym 2D kernelem.
 
     :param sinogram: macierz sinogramu (2D ndarray)
     :param kernel: dwuwymiarowy jądro filtra (2D ndarray)
+    :param dtype: typ obliczeń i wyniku (jeden z COMPUTE_DTYPES), domyślnie typ sinogramu
     :return: ndarray przefiltrowanego sinogramu o tych samych wymiarach co wejściowy
     """
+    dtype = _compute_dtype(dtype, sinogram)
+    sinogram = np.asarray(sinogram, dtype=dtype)
+    kernel = np.asarray(kernel, dtype=dtype)
     # Wykonywany jest splot 2D z trybem 'same', który zapewnia, że wynik ma te same wymiary co macierz wejściowa.
-    filtered = convolve2d(sinogram, kernel, mode='same', boundary='fill', fillvalue=0)
+    with stage('filter.convolve'):
+        filtered = convolve2d(sinogram, kernel, mode='same', boundary='fill', fillvalue=0)
     return filtered
 
 
-def rmse(img1, img2):
-    return np.sqrt(np.mean(np.square(img1 - img2)))
\ No newline at end of file
+FILTER_WINDOWS = ('ramp', 'shepp-logan', 'cosine', 'hamming', 'hanning')
+
+
+@functools.lru_cache(maxsize=32)
+def _filter_response(num_rays, window, dtype=np.dtype(np.float64)):
+    """
+    Odpowiedź częstotliwościowa filtra rampowego z oknem, wyznaczana raz dla (num_rays, window, dtype)
+
+    :param num_rays: - liczba detektorów (długość wiersza sinogramu)
+    :param window: - typ okna (jeden z FILTER_WINDOWS)
+    :param dtype: - typ odpowiedzi (taki jak typ filtrowanego sinogramu)
+    :return: odpowiedź dla rfft oraz długość z dopełnieniem zerami do potęgi dwójki
+    """
+    if window not in FILTER_WINDOWS:
+        raise ValueError(
+            "Niepoprawny typ filtra. Dozwolone typy: 'ramp', 'shepp-logan', 'cosine', 'hamming', 'hanning'")
+
+    # Dopełnienie zerami co najmniej do 2 * num_rays zapobiega splotowi kołowemu
+    padded = max(64, 1 << int(math.ceil(math.log2(2 * num_rays))))
+
+    # Filtr Ram-Lak wyznaczony w dziedzinie przestrzennej (bez aliasingu typowego dla |w|)
+    n = np.concatenate((np.arange(1, padded // 2 + 1, 2), np.arange(padded // 2 - 1, 0, -2)))
+    kernel = np.zeros(padded)
+    kernel[0] = 0.25
+    kernel[1::2] = -1 / (np.pi * n) ** 2
+    response = 2 * np.real(np.fft.fft(kernel))
+
+    omega = np.pi * np.fft.fftfreq(padded)[1:]
+    if window == 'shepp-logan':
+        response[1:] *= np.sin(omega) / omega
+    elif window == 'cosine':
+        response *= np.fft.fftshift(np.sin(np.linspace(0, np.pi, padded, endpoint=False)))
+    elif window == 'hamming':
+        response *= np.fft.fftshift(np.hamming(padded))
+    elif window == 'hanning':
+        response *= np.fft.fftshift(np.hanning(padded))
+
+    response = response[:padded // 2 + 1].astype(dtype)
+    response.setflags(write=False)
+    return response, padded
+
+
+def filter_sinogram_fft(sinogram, window='ramp', dtype=None):
+    """
+    Filtruje sinogram (lub cały stos sinogramów) wiersz po wierszu wzdłuż osi detektorów
+    w dziedzinie częstotliwości, tak jak w filtrowanej projekcji wstecznej.
+
+    :param sinogram: ndarray o kształcie (..., num_rays), np. (steps, num_rays) lub stos wyników pośrednich
+    :param window: typ okna: 'ramp' (Ram-Lak), 'shepp-logan', 'cosine', 'hamming', 'hanning'
+    :param dtype: typ obliczeń i wyniku (jeden z COMPUTE_DTYPES), domyślnie typ sinogramu; dla float32
+                  widmo jest liczone jako complex64
+    :return: ndarray przefiltrowanego sinogramu o tych samych wymiarach co wejściowy
+    """
+    dtype = _compute_dtype(dtype, sinogram)
+    sinogram = np.asarray(sinogram, dtype=dtype)
+    num_rays = sinogram.shape[-1]
+    response, padded = _filter_response(num_rays, window, dtype)
+
+    # Jedno rfft/irfft dla wszystkich wierszy naraz
+    with stage('filter.fft'):
+        spectrum = np.fft.rfft(sinogram, n=padded, axis=-1)
+        spectrum *= response
+        filtered = np.fft.irfft(spectrum, n=padded, axis=-1)
+        # Kopia ciągłego fragmentu - widok trzymałby w pamięci (i w cache'ach wyników) cały bufor z zerami
+        result = np.ascontiguousarray(filtered[..., :num_rays])
+    count('bytes_allocated', spectrum.nbytes + filtered.nbytes + result.nbytes)
+    return result
+
+
+def rmse(img1, img2, dtype=None):
+    """
+    Błąd średniokwadratowy (różnica jest podnoszona do kwadratu w miejscu)
+
+    :param dtype: - typ obliczeń (jeden z COMPUTE_DTYPES), domyślnie wspólny typ obrazów
+    """
+    dtype = _compute_dtype(dtype, img1, img2)
+    diff = np.subtract(img1, img2, dtype=dtype)
+    np.square(diff, out=diff)
+    return np.sqrt(np.mean(diff))
\ No newline at end of file
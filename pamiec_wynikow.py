@@ -0,0 +1,190 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Domyślne limity cache'a wyników: w pamięci procesu (512 MiB) i na dysku (2 GiB)
+DEFAULT_RESULT_BYTES = 1 << 29
+DEFAULT_DISK_BYTES = 1 << 31
+
+# Zmienna środowiskowa wskazująca katalog dyskowego cache'a wyników (.npy)
+RESULT_CACHE_DIR_ENV = "CT_RESULT_CACHE_DIR"
+
+# Rodzaje wpisów: sinogram obrazu, przefiltrowany sinogram i rekonstrukcja (punkty kontrolne)
+SINOGRAM = 'sinogram'
+FILTERED = 'filtered'
+RECONSTRUCTION = 'reconstruction'
+
+
+def image_digest(img):
+    """
+    Skrót zawartości obrazu (BLAKE2b, 128 bitów) razem z kształtem i typem danych. Liczony raz,
+    np. przy wczytaniu obrazu - dalsze klucze powstają już tylko z tego skrótu i parametrów
+
+    :return: skrót jako tekst szesnastkowy
+    """
+    img = np.ascontiguousarray(img)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img.shape}|{img.dtype.str}|".encode())
+    digest.update(memoryview(img).cast('B'))
+    return digest.hexdigest()
+
+
+def result_key(kind, parent, *params):
+    """
+    Klucz wpisu wyprowadzony z klucza wpisu nadrzędnego (lub skrótu obrazu) i parametrów kroku,
+    np. sinogram <- skrót obrazu + geometria, filtr <- klucz sinogramu + okno. Zmiana samego filtra
+    nie zmienia więc klucza sinogramu, a nic poza obrazem nie musi być haszowane
+
+    :param kind: - rodzaj wpisu (SINOGRAM, FILTERED, RECONSTRUCTION)
+    :param parent: - klucz wpisu nadrzędnego albo skrót obrazu
+    :param params: - parametry kroku (liczby i napisy)
+    :return: klucz jako tekst szesnastkowy
+    """
+    text = "|".join([kind, parent] + [repr(param) for param in params])
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache wyników adresowany treścią: tablice numpy pod kluczami z result_key, z limitem bajtów
+    w pamięci (LRU) oraz opcjonalnym katalogiem na dysku, który przetrwa restart aplikacji
+    i też jest przycinany do limitu (najdawniej używane pliki są usuwane pierwsze)
+    """
+
+    def __init__(self, max_bytes=DEFAULT_RESULT_BYTES, cache_dir=None, disk_bytes=DEFAULT_DISK_BYTES):
+        """
+        :param max_bytes: - maksymalny łączny rozmiar tablic trzymanych w pamięci
+        :param cache_dir: - katalog cache'a dyskowego, jeżeli None to używana jest zmienna CT_RESULT_CACHE_DIR
+        :param disk_bytes: - maksymalny łączny rozmiar plików w katalogu cache'a
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.disk_bytes = disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def _directory(self):
+        return self.cache_dir if self.cache_dir is not None else os.environ.get(RESULT_CACHE_DIR_ENV)
+
+    def _path(self, key):
+        return os.path.join(self._directory(), f"{key}.npy")
+
+    def get(self, key):
+        """
+        :return: tablica zapisana pod kluczem (tylko do odczytu) lub None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            directory = self._directory()
+            if directory is None or not os.path.exists(self._path(key)):
+                return None
+            try:
+                array = np.load(self._path(key))
+                # Czas modyfikacji pliku służy jako czas ostatniego użycia przy przycinaniu katalogu
+                os.utime(self._path(key))
+            except (OSError, ValueError, EOFError):
+                # Plik usunięty w międzyczasie przez inny proces (_trim_directory), niepełny lub uszkodzony
+                # to brak w cache'u - wynik zostanie policzony i zapisany od nowa
+                self._remove(self._path(key))
+                return None
+            self._store(key, array)
+            return array
+
+    def put(self, key, array):
+        """
+        Zapis tablicy pod kluczem (w pamięci i, jeżeli skonfigurowano katalog, na dysku)
+
+        :return: zapisana tablica (tylko do odczytu)
+        """
+        array = np.array(array)
+        with self._lock:
+            directory = self._directory()
+            if directory is not None:
+                os.makedirs(directory, exist_ok=True)
+                # Zapis przez plik tymczasowy o unikalnej nazwie - inny proces nigdy nie wczyta niepełnego
+                # pliku, także gdy kilka procesów zapisuje ten sam klucz
+                partial_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.part"
+                with open(partial_path, 'wb') as f:
+                    np.save(f, array)
+                os.replace(partial_path, self._path(key))
+                self._trim_directory(directory)
+            self._store(key, array)
+        return array
+
+    def _store(self, key, array):
+        array.setflags(write=False)
+        # Zbyt duże tablice nie trafiają do pamięci, żeby nie wypchnąć całej reszty
+        if array.nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key).nbytes
+        self._entries[key] = array
+        self._bytes += array.nbytes
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def _trim_directory(self, directory):
+        # Ten sam katalog może jednocześnie przycinać inny proces - pliki znikające w międzyczasie są pomijane
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith('.npy'):
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            self._remove(os.path.join(directory, name))
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+
+_cache = ResultCache()
+
+
+def get_result_cache():
+    """
+    :return: współdzielony (przez wszystkie sesje procesu) cache wyników
+    """
+    return _cache
+
+
+def configure_result_cache(max_bytes=None, cache_dir=None, disk_bytes=None):
+    """
+    Zmiana limitów pamięci i dysku oraz katalogu współdzielonego cache'a wyników
+    """
+    with _cache._lock:
+        if max_bytes is not None:
+            _cache.max_bytes = max_bytes
+            _cache._evict()
+        if cache_dir is not None:
+            _cache.cache_dir = cache_dir
+        if disk_bytes is not None:
+            _cache.disk_bytes = disk_bytes
@@ -0,0 +1,202 @@
+import datetime
+import os
+
+import numpy as np
+import pydicom
+from PIL import Image
+
+# Rozszerzenia plików obsługiwanych jako obrazy wejściowe
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.dcm')
+
+
+def load_image(path):
+    """
+    Wczytuje obraz wejściowy w skali szarości (PNG/JPG/BMP przez PIL, DICOM przez pydicom)
+
+    :param path: ścieżka do pliku
+    :return: ndarray float32 obrazu oraz dataset DICOM (lub None dla zwykłych obrazów)
+    """
+    if os.path.splitext(path)[1].lower() == '.dcm':
+        dcm = pydicom.dcmread(path)
+        pixels = dcm.pixel_array.astype(np.float32)
+        if pixels.ndim == 3:
+            # Obrazy RGB zapisane jako DICOM - luminancja jak w PIL convert("L")
+            pixels = pixels[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        return pixels, dcm
+    return np.array(Image.open(path).convert("L")).astype(np.float32), None
+
+
+def read_study_date(dcm):
+    """
+    Data badania z nagłówka DICOM (dzisiejsza, jeżeli jej brak lub jest niepoprawna)
+    """
+    try:
+        return datetime.datetime.strptime(str(dcm.get('StudyDate', '')), "%Y%m%d").date()
+    except ValueError:
+        return datetime.date.today()
+
+
+def slice_position(dcm):
+    """
+    Położenie przekroju wzdłuż normalnej do jego płaszczyzny (z ImagePositionPatient
+    i ImageOrientationPatient) lub None, jeżeli nagłówek go nie zawiera
+    """
+    position = dcm.get('ImagePositionPatient')
+    if position is None or len(position) != 3:
+        return None
+    position = [float(value) for value in position]
+    orientation = dcm.get('ImageOrientationPatient')
+    if orientation is None or len(orientation) != 6:
+        return position[2]
+    normal = np.cross([float(value) for value in orientation[:3]], [float(value) for value in orientation[3:]])
+    return float(np.dot(normal, position))
+
+
+def sort_series(paths):
+    """
+    Wczytuje nagłówki plików serii (bez danych obrazu) i sortuje przekroje wzdłuż osi serii:
+    po położeniu z ImagePositionPatient, potem po InstanceNumber, na końcu po nazwie pliku
+
+    :param paths: lista ścieżek do plików .dcm
+    :return: lista krotek (ścieżka, nagłówek DICOM) w kolejności przekrojów
+    """
+    headers = [(path, pydicom.dcmread(path, stop_before_pixels=True)) for path in paths]
+
+    def key(item):
+        path, dcm = item
+        position = slice_position(dcm)
+        instance = dcm.get('InstanceNumber')
+        return (position is None, position or 0.0, instance is None, int(instance or 0), path)
+
+    return sorted(headers, key=key)
+
+
+def to_uint16(image, low_percentile=1, high_percentile=99, window=None):
+    """
+    Okienkowanie percentylowe i przeskalowanie obrazu do pełnego zakresu uint16 (jak przy zapisie w aplikacji)
+
+    :param window: - gotowe granice okna (vmin, vmax), np. wspólne dla całej serii; wtedy percentyle są pomijane
+    """
+    if window is not None:
+        vmin, vmax = window
+    else:
+        vmin = np.percentile(image, low_percentile)
+        vmax = np.percentile(image, high_percentile)
+    if vmax <= vmin:
+        return np.zeros(image.shape, dtype=np.uint16)
+    clipped = np.clip(image, vmin, vmax)
+    return ((clipped - vmin) / (vmax - vmin) * 65535).astype(np.uint16)
+
+
+def save_as_dicom(image_array, filename, patient_name, patient_id, study_date, comments, study_uid=None,
+                  series_uid=None, instance_number=1, image_position=None, image_orientation=None,
+                  pixel_spacing=(1.0, 1.0), slice_thickness=1, frame_of_reference_uid=None, series_description=None):
+    # Pola serii (UID badania i serii, numer i położenie przekroju) są opcjonalne - pojedynczy obraz
+    # dostaje nowe UID jak dotychczas, a save_series_as_dicom przekazuje wspólne UID dla wszystkich przekrojów
+    # Normalize to uint16 if needed
+    if image_array.dtype != "uint16":
+        image_array = (image_array / image_array.max() * 65535).astype("uint16")
+
+    if len(image_array.shape) != 2:
+        print(image_array.shape)
+        raise ValueError("Image must be 2D grayscale.")
+
+    # Create file meta
+    file_meta = pydicom.Dataset()
+    file_meta.MediaStorageSOPClassUID = pydicom.uid.SecondaryCaptureImageStorage
+    file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+    file_meta.ImplementationClassUID = pydicom.uid.generate_uid()
+    file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+
+    # Create main dataset
+    dt = datetime.datetime.now()
+    ds = pydicom.FileDataset(filename, {}, file_meta=file_meta, preamble=b"\0" * 128)
+
+    # Core DICOM identifiers
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid or pydicom.uid.generate_uid()
+    ds.SeriesInstanceUID = series_uid or pydicom.uid.generate_uid()
+    if frame_of_reference_uid is not None:
+        ds.FrameOfReferenceUID = frame_of_reference_uid
+
+    # Patient & study info
+    ds.PatientName = patient_name
+    ds.PatientID = patient_id
+    ds.StudyDate = study_date.strftime("%Y%m%d")
+    ds.StudyTime = dt.strftime("%H%M%S")
+    ds.ContentDate = ds.StudyDate
+    ds.ContentTime = ds.StudyTime
+    ds.Modality = "CT"
+    ds.SeriesNumber = 1
+    ds.InstanceNumber = instance_number
+    ds.ImageComments = comments
+    if series_description is not None:
+        ds.SeriesDescription = series_description
+    if image_position is not None:
+        ds.ImagePositionPatient = [float(value) for value in image_position]
+        ds.ImageOrientationPatient = [float(value) for value in (image_orientation or (1, 0, 0, 0, 1, 0))]
+
+    # Image description
+    ds.Rows, ds.Columns = image_array.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.PixelSpacing = [float(value) for value in pixel_spacing]
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0  # Unsigned
+    ds.PixelData = image_array.tobytes()
+
+    # Windowing (for proper display)
+    ds.WindowCenter = int(image_array.max() / 2)
+    ds.WindowWidth = int(image_array.max())
+    ds.RescaleIntercept = 0
+    ds.RescaleSlope = 1
+
+    # Optional: extra tags for viewer compatibility
+    ds.Manufacturer = "CT Simulator"
+    ds.SliceThickness = slice_thickness
+    ds.KVP = 120
+    ds.BodyPartExamined = "HEAD"
+
+    # Save file
+    ds.save_as(filename)
+
+
+def save_series_as_dicom(volume, directory, patient_name, patient_id, study_date, comments, positions=None,
+                         orientation=None, pixel_spacing=(1.0, 1.0), slice_thickness=1, study_uid=None,
+                         series_description="CT Simulator reconstruction", low_percentile=1, high_percentile=99):
+    """
+    Zapis objętości jako serii DICOM: jeden plik na przekrój, wspólne UID badania, serii i układu
+    odniesienia, kolejne InstanceNumber oraz wspólne okno szarości dla całej serii
+
+    :param volume: - ndarray lub memmap o kształcie (przekroje, H, W)
+    :param directory: - katalog docelowy (pliki slice_0001.dcm, slice_0002.dcm, ...)
+    :param positions: - ImagePositionPatient kolejnych przekrojów (domyślnie co slice_thickness wzdłuż osi z)
+    :param orientation: - ImageOrientationPatient wspólne dla serii
+    :param study_uid: - UID badania (np. z serii wejściowej), domyślnie nowy
+    :return: lista ścieżek zapisanych plików
+    """
+    os.makedirs(directory, exist_ok=True)
+    study_uid = study_uid or pydicom.uid.generate_uid()
+    series_uid = pydicom.uid.generate_uid()
+    frame_of_reference_uid = pydicom.uid.generate_uid()
+
+    # Okno liczone na próbce przekrojów, żeby nie wczytywać całej (być może zmapowanej) objętości
+    sample = np.asarray(volume[::max(1, len(volume) // 16)])
+    window = (np.percentile(sample, low_percentile), np.percentile(sample, high_percentile))
+
+    paths = []
+    for idx in range(len(volume)):
+        position = positions[idx] if positions is not None else (0.0, 0.0, idx * slice_thickness)
+        path = os.path.join(directory, f"slice_{idx + 1:04d}.dcm")
+        partial_path = path + '.part'
+        save_as_dicom(to_uint16(np.asarray(volume[idx]), window=window), partial_path, patient_name, patient_id,
+                      study_date, comments, study_uid=study_uid, series_uid=series_uid, instance_number=idx + 1,
+                      image_position=position, image_orientation=orientation, pixel_spacing=pixel_spacing,
+                      slice_thickness=slice_thickness, frame_of_reference_uid=frame_of_reference_uid,
+                      series_description=series_description)
+        os.replace(partial_path, path)
+        paths.append(path)
+    return paths
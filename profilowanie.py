@@ -0,0 +1,137 @@
+import contextlib
+import contextvars
+import threading
+import time
+
+# Aktywny profil (None - instrumentacja wyłączona). Zmienna kontekstowa, więc każdy wątek (np. zadania
+# w tle i wątek strony) ma własny profil; wątki puli w calculate_sinogram/reverse_radon_transform
+# dostają kopię kontekstu wywołującego (run_in_context), więc ich liczniki trafiają do tego samego profilu
+_active = contextvars.ContextVar('profile', default=None)
+
+
+class Profile:
+    """
+    Zebrane pomiary: łączny czas i liczba wywołań każdego nazwanego etapu oraz liczniki
+    (promienie, odwiedzone piksele, zaalokowane bajty itd.)
+    """
+
+    def __init__(self, callback=None):
+        """
+        :param callback: - opcjonalna funkcja wywoływana po zakończeniu każdego etapu
+                           z argumentami (nazwa etapu, czas w sekundach)
+        """
+        self.stages = {}
+        self.counters = {}
+        self.callback = callback
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, elapsed):
+        with self._lock:
+            calls, total = self.stages.get(name, (0, 0.0))
+            self.stages[name] = (calls + 1, total + elapsed)
+        if self.callback is not None:
+            self.callback(name, elapsed)
+
+    def add(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def as_dict(self):
+        """
+        :return: słownik gotowy do zapisu w JSON lub wyświetlenia w tabeli
+        """
+        with self._lock:
+            return {
+                'stages': {name: {'calls': calls, 'seconds': total}
+                           for name, (calls, total) in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def report(self):
+        """
+        :return: tekstowe podsumowanie (etapy od najdłuższego, potem liczniki)
+        """
+        lines = []
+        with self._lock:
+            for name, (calls, total) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+                lines.append(f"{name:40s} {total * 1000:10.2f} ms  x{calls}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:40s} {value:>13,d}")
+        return "\n".join(lines)
+
+
+class _Stage:
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.add_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Jeden współdzielony, pusty kontekst - przy wyłączonej instrumentacji stage() nic nie alokuje
+_NO_STAGE = contextlib.nullcontext()
+
+
+def stage(name):
+    """
+    Nazwany etap mierzony w aktywnym profilu, używany jako ``with stage('sinogram.projection'):``
+    """
+    profile = _active.get()
+    if profile is None:
+        return _NO_STAGE
+    return _Stage(profile, name)
+
+
+def count(name, value):
+    """
+    Zwiększenie licznika aktywnego profilu (bez efektu gdy instrumentacja jest wyłączona)
+    """
+    profile = _active.get()
+    if profile is not None:
+        profile.add(name, value)
+
+
+def enabled():
+    """
+    :return: True jeżeli instrumentacja jest włączona - pozwala pominąć kosztowne wyliczanie wartości liczników
+    """
+    return _active.get() is not None
+
+
+def run_in_context(func):
+    """
+    :return: funkcja wykonująca func w kopii bieżącego kontekstu (z aktywnym profilem) - do przekazania
+             wątkom puli, które inaczej nie widziałyby profilu wątku zlecającego
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return run
+
+
+@contextlib.contextmanager
+def profile(callback=None):
+    """
+    Włączenie instrumentacji na czas bloku with:
+
+        with profile() as p:
+            calculate_sinogram(...)
+        print(p.report())
+
+    :param callback: - opcjonalna funkcja (nazwa etapu, czas w sekundach) wywoływana po każdym etapie
+    :return: obiekt Profile z wynikami
+    """
+    token = _active.set(Profile(callback))
+    try:
+        yield _active.get()
+    finally:
+        _active.reset(token)
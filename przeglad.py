@@ -0,0 +1,218 @@
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from geometria import configure_geometry_cache, geometry_cache_dir
+from obliczenia import calculate_sinogram, filter_sinogram_fft, normalize, reverse_radon_transform, rmse
+from pamiec_wynikow import image_digest
+from pliki_dicom import load_image
+
+# Kolumny tabeli wyników w kolejności zapisu do CSV
+COLUMNS = ('image', 'steps', 'span', 'num_rays', 'max_angle', 'filter', 'rmse',
+           'sinogram_s', 'filter_s', 'reconstruction_s')
+
+# Nazwa pliku z gotowymi punktami w katalogu cache'a przeglądu
+RESULTS_FILE = 'sweep.jsonl'
+
+
+def parameter_grid(steps, span, num_rays, max_angle, filters=('none',)):
+    """
+    Iloczyn kartezjański wartości parametrów
+
+    :return: lista słowników z kluczami steps, span, num_rays, max_angle, filter
+    """
+    return [dict(steps=s, span=l, num_rays=n, max_angle=a, filter=f)
+            for s, l, n, a, f in itertools.product(steps, span, num_rays, max_angle, filters)]
+
+
+def _normalize_point(point):
+    # Jednolite typy wartości: 180 i 180.0 albo np.int64(90) i 90 to ten sam punkt (ten sam klucz)
+    return dict(steps=int(point['steps']), span=float(point['span']), num_rays=int(point['num_rays']),
+                max_angle=float(point['max_angle']), filter=str(point['filter']))
+
+
+def _point_key(image_key, point):
+    point = _normalize_point(point)
+    return f"{image_key}|{point['steps']}|{point['span']}|{point['num_rays']}|{point['max_angle']}|{point['filter']}"
+
+
+def _load_results(results_path):
+    """
+    Wczytanie gotowych punktów z pliku przeglądu. Przerwanie w trakcie dopisywania zostawia niepełny
+    ostatni wiersz - jest on pomijany i odcinany, żeby kolejne wpisy zaczynały się od nowego wiersza
+
+    :return: słownik klucz punktu -> wiersz tabeli wyników
+    """
+    done = {}
+    with open(results_path, 'rb') as f:
+        data = f.read()
+    complete = data.rfind(b'\n') + 1
+    for line in data[:complete].decode().splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        done[entry['key']] = entry['row']
+    if complete < len(data):
+        with open(results_path, 'r+b') as f:
+            f.truncate(complete)
+    return done
+
+
+def run_group(name, img, geometry, filters):
+    """
+    Obliczenia dla jednego obrazu i jednej geometrii: sinogram liczony raz i współdzielony
+    przez wszystkie filtry tej grupy
+
+    :param name: nazwa obrazu w tabeli wyników
+    :param img: ndarray obrazu
+    :param geometry: krotka (steps, span, num_rays, max_angle)
+    :param filters: lista okien filtra ('none' - bez filtrowania)
+    :return: lista wierszy tabeli wyników
+    """
+    steps, span, num_rays, max_angle = geometry
+    reference = normalize(img)
+
+    start = time.perf_counter()
+    sinogram = calculate_sinogram(img, steps, span, num_rays, max_angle)
+    sinogram_time = time.perf_counter() - start
+
+    rows = []
+    for window in filters:
+        start = time.perf_counter()
+        filtered = sinogram if window == 'none' else filter_sinogram_fft(sinogram, window)
+        filter_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reconstructed = reverse_radon_transform(img, filtered, steps, span, num_rays, max_angle)
+        reconstruction_time = time.perf_counter() - start
+
+        rows.append(dict(image=name, steps=steps, span=span, num_rays=num_rays, max_angle=max_angle, filter=window,
+                         rmse=float(rmse(reconstructed, reference)), sinogram_s=sinogram_time, filter_s=filter_time,
+                         reconstruction_s=reconstruction_time))
+    return rows
+
+
+def run_sweep(images, grid, workers=1, cache_dir=None, log=None):
+    """
+    Przegląd parametrów dla zestawu obrazów. Punkty siatki o tej samej geometrii są liczone
+    w jednym zadaniu (wspólny sinogram i macierz systemowa), zadania są wykonywane w puli
+    procesów, a każdy gotowy punkt jest dopisywany do pliku w cache_dir, więc przerwany
+    przegląd po ponownym uruchomieniu liczy tylko brakujące punkty
+
+    :param images: słownik nazwa -> ndarray obrazu
+    :param grid: lista punktów (np. z parameter_grid)
+    :param workers: liczba procesów (1 - obliczenia w bieżącym procesie)
+    :param cache_dir: katalog na wyniki punktów oraz dyskowy cache geometrii (None - bez cache'a)
+    :param log: opcjonalna funkcja wypisująca postęp
+    :return: lista wierszy (słowników z kluczami COLUMNS) w kolejności obrazów i siatki
+    """
+    done = {}
+    results_path = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        results_path = os.path.join(cache_dir, RESULTS_FILE)
+        if os.path.exists(results_path):
+            done = _load_results(results_path)
+
+    grid = [_normalize_point(point) for point in grid]
+    image_keys = {name: image_digest(img) for name, img in images.items()}
+
+    # Grupowanie brakujących punktów po (obraz, geometria)
+    groups = {}
+    for name in images:
+        for point in grid:
+            if _point_key(image_keys[name], point) in done:
+                continue
+            geometry = (point['steps'], point['span'], point['num_rays'], point['max_angle'])
+            filters = groups.setdefault((name, geometry), [])
+            if point['filter'] not in filters:
+                filters.append(point['filter'])
+
+    def record(rows):
+        for row in rows:
+            key = _point_key(image_keys[row['image']], row)
+            done[key] = row
+            if results_path is not None:
+                # Jeden zapis na wpis - przerwanie zostawia co najwyżej niepełny ostatni wiersz (_load_results)
+                with open(results_path, 'a') as f:
+                    f.write(json.dumps({'key': key, 'row': row}) + '\n')
+                    f.flush()
+        if log is not None:
+            log(f"{rows[0]['image']} steps={rows[0]['steps']} span={rows[0]['span']} "
+                f"num_rays={rows[0]['num_rays']} max_angle={rows[0]['max_angle']}: {len(rows)} point(s)")
+
+    geometry_cache = None if cache_dir is None else os.path.join(cache_dir, 'geometry')
+    tasks = [(name, images[name], geometry, filters) for (name, geometry), filters in groups.items()]
+    if workers <= 1:
+        # Katalog geometrii przeglądu tylko na czas obliczeń - cache procesu wywołującego go nie zachowuje
+        with geometry_cache_dir(geometry_cache) if geometry_cache is not None else contextlib.nullcontext():
+            for task in tasks:
+                record(run_group(*task))
+    else:
+        initializer = configure_geometry_cache if geometry_cache is not None else None
+        initargs = (None, geometry_cache) if geometry_cache is not None else ()
+        with ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as pool:
+            pending = set()
+            queue = iter(tasks)
+            while True:
+                # Ograniczona liczba zadań w toku - obrazy nie są kopiowane do wszystkich procesów naraz
+                for task in queue:
+                    pending.add(pool.submit(run_group, *task))
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(future.result())
+
+    return [done[_point_key(image_keys[name], point)] for name in images for point in grid]
+
+
+def write_csv(rows, path):
+    """
+    Zapis tabeli wyników do pliku CSV
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RMSE parameter sweep over steps, span, num_rays, max_angle "
+                                                 "and filter for a set of images.")
+    parser.add_argument("images", nargs="+", help="image files (png/jpg/bmp/dcm)")
+    parser.add_argument("--steps", type=int, nargs="+", default=[180])
+    parser.add_argument("--span", type=float, nargs="+", default=[180])
+    parser.add_argument("--num-rays", type=int, nargs="+", default=[180])
+    parser.add_argument("--max-angle", type=float, nargs="+", default=[180])
+    parser.add_argument("--filters", nargs="+", default=['none'])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--cache", help="directory for finished points (makes the sweep resumable)")
+    parser.add_argument("--csv", help="write the result table to this CSV file")
+    args = parser.parse_args(argv)
+
+    images = {os.path.basename(path): load_image(path)[0] for path in args.images}
+    grid = parameter_grid(args.steps, args.span, args.num_rays, args.max_angle, args.filters)
+    rows = run_sweep(images, grid, args.workers, args.cache, log=print)
+
+    if args.csv:
+        write_csv(rows, args.csv)
+    writer = csv.DictWriter(sys.stdout, fieldnames=COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,122 +1,312 @@
+import functools
+import os
 from time import sleep
 
 import numpy as np
 import streamlit as st
 from PIL import Image
-import matplotlib.pyplot as plt
 import pydicom
 import datetime
 
-import io
-
 from obliczenia import *
-
-
-@st.cache_data
-def compute_sinogram(img, steps, span, num_rays, max_angle, intermediate=False):
-    return calculate_sinogram(img, steps, span, num_rays, max_angle, intermediate)
-
-
-@st.cache_data
-def compute_reconstruction(img, sinogram, steps, span, num_rays, max_angle, intermediate=False):
-    return reverse_radon_transform(img, sinogram, steps, span, num_rays, max_angle, intermediate)
-
-
-@st.cache_data
-def compute_filter(sin):
-    sinogram = []
-    kernel = create_shepp_logan_kernel(9)
-
-    for i in sin:
-        sinogram.append(filter_sinogram(i, kernel))
-    return sinogram
-
-
-def save_as_dicom(image_array, filename, patient_name, patient_id, study_date, comments):
-    # Normalize to uint16 if needed
-    if image_array.dtype != "uint16":
-        image_array = (image_array / image_array.max() * 65535).astype("uint16")
-
-    if len(image_array.shape) != 2:
-        print(image_array.shape)
-        raise ValueError("Image must be 2D grayscale.")
-
-    # Create file meta
-    file_meta = pydicom.Dataset()
-    file_meta.MediaStorageSOPClassUID = pydicom.uid.SecondaryCaptureImageStorage
-    file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
-    file_meta.ImplementationClassUID = pydicom.uid.generate_uid()
-    file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
-
-    # Create main dataset
-    dt = datetime.datetime.now()
-    ds = pydicom.FileDataset(filename, {}, file_meta=file_meta, preamble=b"\0" * 128)
-
-    # Core DICOM identifiers
-    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
-    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
-    ds.StudyInstanceUID = pydicom.uid.generate_uid()
-    ds.SeriesInstanceUID = pydicom.uid.generate_uid()
-
-    # Patient & study info
-    ds.PatientName = patient_name
-    ds.PatientID = patient_id
-    ds.StudyDate = study_date.strftime("%Y%m%d")
-    ds.StudyTime = dt.strftime("%H%M%S")
-    ds.ContentDate = ds.StudyDate
-    ds.ContentTime = ds.StudyTime
-    ds.Modality = "CT"
-    ds.SeriesNumber = 1
-    ds.InstanceNumber = 1
-    ds.ImageComments = comments
-
-    # Image description
-    ds.Rows, ds.Columns = image_array.shape
-    ds.SamplesPerPixel = 1
-    ds.PhotometricInterpretation = "MONOCHROME2"
-    ds.PixelSpacing = [1.0, 1.0]
-    ds.BitsAllocated = 16
-    ds.BitsStored = 16
-    ds.HighBit = 15
-    ds.PixelRepresentation = 0  # Unsigned
-    ds.PixelData = image_array.tobytes()
-
-    # Windowing (for proper display)
-    ds.WindowCenter = int(image_array.max() / 2)
-    ds.WindowWidth = int(image_array.max())
-    ds.RescaleIntercept = 0
-    ds.RescaleSlope = 1
-
-    # Optional: extra tags for viewer compatibility
-    ds.Manufacturer = "CT Simulator"
-    ds.SliceThickness = 1
-    ds.KVP = 120
-    ds.BodyPartExamined = "HEAD"
-
-    # Save file
-    ds.save_as(filename)
+from harmonogram import ProjectionCache
+from animacja import encode_gif, render_frames, to_uint8
+from pamiec_wynikow import (FILTERED, RECONSTRUCTION, RESULT_CACHE_DIR_ENV, SINOGRAM, configure_result_cache,
+                            get_result_cache, image_digest, result_key)
+from pliki_dicom import save_as_dicom, to_uint16
+from profilowanie import profile
+from wyniki_posrednie import checkpoint_steps
+from zadania import JobManager, reconstruction_job, sinogram_job
+
+# Katalog dyskowego cache'a wyników aplikacji, jeżeli nie wskazano go zmienną CT_RESULT_CACHE_DIR
+APP_RESULT_CACHE_DIR = ".ct_cache"
+# Odstęp (w sekundach) między odświeżeniami strony, gdy w tle trwają obliczenia
+POLL_INTERVAL = 0.25
+# Limit bajtów wyrenderowanych klatek animacji trzymanych w sesji. Klatki są zmniejszane do rozmiaru
+# wyświetlania (animacja.MAX_FRAME_SIDE), więc cztery podglądy strony (180 kroków, 512 px) mieszczą się w limicie
+FRAMES_MAX_BYTES = 256 << 20
+# Dostępne rozdzielczości (dłuższy bok) podglądu wybranego fragmentu rekonstrukcji
+ROI_SIZES = [128, 256, 512, 1024]
+# Strony symulacji: (sinogram filtrowany, dane pacjenta z pliku .dcm)
+SIMULATION_PAGES = {"first": (False, False), "second": (True, False), "third": (False, True), "fourth": (True, True)}
+
+
+def _show_progress(placeholder, frame):
+    # Podgląd bez matplotlib - proste skalowanie min-max do uint8
+    low, high = frame.min(), frame.max()
+    scaled = (frame - low) / (high - low) if high > low else np.zeros_like(frame)
+    placeholder.image((scaled * 255).astype(np.uint8), use_container_width=True)
+
+
+def _jobs():
+    # Pula zadań w tle należy do sesji, więc każda karta przeglądarki ma własne obliczenia
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = JobManager()
+    return st.session_state.jobs
+
+
+def _projection_cache(img, digest, span, num_rays, projector, dtype):
+    # Wiersze sinogramu pamiętane kątami: zmiana Delta Alpha liczy tylko kąty, których jeszcze nie było.
+    # Sesja trzyma jeden cache - dla ostatniego obrazu i parametrów promieni
+    key = (digest, float(span), int(num_rays), projector, dtype)
+    cached = st.session_state.get("projection_cache")
+    if cached is None or cached[0] != key:
+        cached = (key, ProjectionCache(img, span, num_rays, projector, dtype))
+        st.session_state.projection_cache = cached
+    return cached[1]
+
+
+def _wait_for(slot, job, transpose=False):
+    # Zadanie w toku: pasek postępu, podgląd częściowego wyniku i ponowne uruchomienie skryptu po chwili.
+    # Wszystko, co strona narysowała wcześniej, zostaje na ekranie, a ruch suwaka nie czeka na koniec obliczeń
+    if not job.finished:
+        st.progress(job.progress, text=f"{slot}: step {job.done}/{job.total}")
+        if job.partial is not None:
+            _show_progress(st.empty(), np.transpose(job.partial) if transpose else job.partial)
+        if st.button("Cancel", key=f"cancel_{slot}"):
+            _jobs().cancel()
+            go_to_page("main")
+            st.rerun()
+        sleep(POLL_INTERVAL)
+        st.rerun()
+    if job.profile is not None:
+        st.session_state.profiles.append((slot, job.profile))
+    return job.result()
+
+
+def _profiled(func):
+    # Po włączeniu profilowania na stronie głównej pomiary etapów każdego wywołania trafiają do sesji
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not st.session_state.get("profiling"):
+            return func(*args, **kwargs)
+        with profile() as run:
+            result = func(*args, **kwargs)
+        st.session_state.setdefault("profiles", []).append((func.__name__, run))
+        return result
+    return wrapper
+
+
+# Wyniki są trzymane we wspólnym dla wszystkich sesji cache'u adresowanym treścią: klucz sinogramu
+# to skrót obrazu (liczony raz przy wczytaniu) i geometria, klucze filtra i rekonstrukcji powstają
+# z klucza swojego wejścia. Każda funkcja zwraca też klucz wyniku dla kolejnych kroków
+def compute_sinogram(img, digest, steps, span, num_rays, max_angle, intermediate=False, projector=None, dtype=None):
+    projector = projector if projector is not None else st.session_state.get("projector", "bresenham")
+    dtype = dtype if dtype is not None else st.session_state.get("precision", "float64")
+    key = result_key(SINOGRAM, digest, int(steps), float(span), int(num_rays), float(max_angle), projector, dtype)
+    sinogram = get_result_cache().get(key)
+    if sinogram is None:
+        # Sinogram liczy się w tle, a do końca skanowania rysowany jest jego dotychczasowy stan
+        job = _jobs().submit("sinogram", key, sinogram_job, img, steps, span, num_rays, max_angle, projector, dtype,
+                             total=steps, profiled=st.session_state.get("profiling", False),
+                             cache=_projection_cache(img, digest, span, num_rays, projector, dtype))
+        sinogram = get_result_cache().put(key, _wait_for("sinogram", job, transpose=True))
+    return (SinogramSteps(sinogram) if intermediate else sinogram), key
+
+
+def compute_reconstruction(img, sinogram, source_key, steps, span, num_rays, max_angle, intermediate=False,
+                           method=None, projector=None, slot="reconstruction"):
+    method = method if method is not None else st.session_state.get("method", "ray")
+    projector = projector if projector is not None else st.session_state.get("projector", "bresenham")
+    # Typ obliczeń jest typem sinogramu (zawarty już w kluczu źródła)
+    key = result_key(RECONSTRUCTION, source_key, method, projector)
+    # W cache'u są tylko punkty kontrolne - sinogram jest już zapisany pod kluczem źródła
+    checkpoints = checkpoint_steps(steps, INTERMEDIATE_CHECKPOINTS)
+    images = get_result_cache().get(key)
+    if images is None:
+        # Osobne miejsca zadań dla rekonstrukcji bez filtra i z filtrem - nowe parametry anulują tylko
+        # nieaktualne zadanie tego samego rodzaju
+        job = _jobs().submit(slot, key, reconstruction_job, img, sinogram, steps, span, num_rays, max_angle,
+                             method, projector, sinogram.dtype, total=steps, profiled=st.session_state.get("profiling", False),
+                             preview=st.session_state.get("preview", False))
+        images = get_result_cache().put(key, _wait_for(slot, job).checkpoint_images)
+    reconstructed = BackprojectionSteps(img.shape, steps, span, num_rays, max_angle, sinogram, checkpoints, images,
+                                        method, projector)
+    return (reconstructed if intermediate else normalize(reconstructed[-1])), key
+
+
+@_profiled
+def compute_filter(sin, source_key, window='shepp-logan'):
+    # Filtr działa wiersz po wierszu (po osi detektorów), a puste wiersze pozostają puste,
+    # więc wyniki pośrednie filtrowanego sinogramu wynikają z jednego przefiltrowanego sinogramu
+    key = result_key(FILTERED, source_key, window)
+    filtered = get_result_cache().get(key)
+    if filtered is None:
+        filtered = get_result_cache().put(key, filter_sinogram_fft(sin[-1], window))
+    return SinogramSteps(filtered), key
+
+
+def roi_view(img, sinogram, source_key, steps, span, num_rays):
+    """
+    Podgląd wybranego prostokąta rekonstrukcji w wybranej rozdzielczości (projekcja wsteczna
+    sterowana pikselami tylko w obrębie prostokąta, wynik w cache'u wyników)
+    """
+    height, width = img.shape[0], img.shape[1]
+    with st.expander("Region of interest"):
+        rows = st.slider("Rows", min_value=0, max_value=height, value=(height // 4, 3 * height // 4), key="roi_rows")
+        cols = st.slider("Columns", min_value=0, max_value=width, value=(width // 4, 3 * width // 4), key="roi_cols")
+        size = st.select_slider("Output size", options=ROI_SIZES, value=512, key="roi_size")
+        if rows[1] <= rows[0] or cols[1] <= cols[0]:
+            st.write(":red[Select a non-empty region]")
+            return
+        roi = (rows[0], cols[0], rows[1], cols[1])
+        # Dłuższy bok wyniku ma wybrany rozmiar, proporcje jak w prostokącie
+        scale = size / max(rows[1] - rows[0], cols[1] - cols[0])
+        output_shape = (max(1, round((rows[1] - rows[0]) * scale)), max(1, round((cols[1] - cols[0]) * scale)))
+        key = result_key(RECONSTRUCTION, source_key, "roi", roi, output_shape)
+        image = get_result_cache().get(key)
+        if image is None:
+            with st.spinner("Reconstructing the region..."):
+                image = get_result_cache().put(key, reconstruct_region(img, sinogram, steps, span, num_rays, 180,
+                                                                       roi, output_shape, dtype=sinogram.dtype))
+        st.image(to_uint8(image, 0.0, 1.0), use_container_width=True)
 
 
 st.set_page_config(layout="wide")
+
+if os.environ.get(RESULT_CACHE_DIR_ENV) is None:
+    configure_result_cache(cache_dir=APP_RESULT_CACHE_DIR)
 st.title("CT Simulator")
 
 if "page" not in st.session_state:
     st.session_state.page = "main"
 
+# Pomiary z poprzedniego przebiegu skryptu nie są już aktualne
+st.session_state.profiles = []
+
 
 def go_to_page(page_name):
     st.session_state.page = page_name
 
 
+def _frames(result, key, transpose=False):
+    # Klatki wyników pośrednich są renderowane raz dla danego zestawu parametrów (klucz wyniku
+    # z cache'a wyników), a suwak i animacja tylko wybierają gotowe obrazy
+    key = (key, transpose)
+    cache = st.session_state.setdefault("frames", {})
+    if key not in cache:
+        cache[key] = {"frames": render_frames(result, transpose), "gif": None}
+        # Najdawniej wyrenderowane zestawy są usuwane pierwsze, bieżący zostaje zawsze
+        while len(cache) > 1 and sum(entry["frames"].nbytes for entry in cache.values()) > FRAMES_MAX_BYTES:
+            del cache[next(iter(cache))]
+    return cache[key]
+
+
+def show_steps(result, key, animate=False, transpose=False):
+    """
+    Wspólny podgląd wyników pośrednich dla wszystkich stron: stan po kroku z suwaka "step"
+    albo animacja wszystkich kroków zakodowana raz jako GIF
+    """
+    rendered = _frames(result, key, transpose)
+    if animate:
+        if rendered["gif"] is None:
+            rendered["gif"] = encode_gif(rendered["frames"])
+        st.image(rendered["gif"], use_container_width=True)
+    else:
+        step = min(st.session_state.get("step", len(result)), len(result))
+        st.image(rendered["frames"][step - 1], use_container_width=True)
+
+
+def _dicom_form(image):
+    patient_name = st.text_input("Patient Name")
+    patient_id = st.text_input("Patient ID")
+    study_date = st.date_input("Study Date", value=datetime.date.today())
+    comments = st.text_input("Comments")
+
+    if st.button("Save DICOM"):
+        save_as_dicom(to_uint16(image), "zapisane_dicom.dcm", patient_name, patient_id, study_date, comments)
+
+
+def simulation_page(filtered, from_dicom):
+    """
+    Strona symulacji: model, sinogram i rekonstrukcja, a z filtrem także przefiltrowany sinogram
+    i rekonstrukcja z niego; dla plików .dcm obok formularza pokazywane są dane z pliku
+    """
+    st.title("Simulation")
+    if filtered:
+        st.write("filtr")
+
+    st.markdown(
+        f"**Delta Alpha:** {st.session_state.get('alpha', 'Not Set')}, **n:** {st.session_state.get('n', 'Not Set')}, **l:** {st.session_state.get('l', 'Not Set')}")
+
+    steps = 180 // st.session_state.alpha
+    span = st.session_state.get('l', 120)
+    num_rays = st.session_state.get('n', 250)
+    st.session_state.step = st.slider("step", min_value=1, max_value=steps, value=steps)
+    animate = st.button("show animation")
+
+    col1, col2, col3, _ = st.columns(4)
+
+    with col1:
+        st.image(st.session_state.image, caption="Model", use_container_width=True)
+
+    img_array = st.session_state.image_array
+    digest = st.session_state.image_digest
+
+    with col2:
+        with st.spinner("Computing the sinogram..."):
+            sinogram, sinogram_key = compute_sinogram(img_array, digest, steps=steps, span=span, num_rays=num_rays,
+                                                      max_angle=180, intermediate=True)
+        show_steps(sinogram, sinogram_key, animate, transpose=True)
+
+    if filtered:
+        with col3:
+            with st.spinner("Computing the sinogram with filter..."):
+                filtr_sin, filtered_key = compute_filter(sinogram, sinogram_key)
+            show_steps(filtr_sin, filtered_key, animate, transpose=True)
+        _, reconstruction_col, filtered_col, __ = st.columns(4)
+    else:
+        reconstruction_col = col3
+
+    with reconstruction_col:
+        with st.spinner("Computing the reconstructed image..."):
+            reconstructed, key = compute_reconstruction(img_array, sinogram[-1], sinogram_key, steps=steps,
+                                                        span=span, num_rays=num_rays, max_angle=180,
+                                                        intermediate=True)
+        show_steps(reconstructed, key, animate)
+
+    if filtered:
+        with filtered_col:
+            with st.spinner("Computing the reconstructed image with filter..."):
+                reconstructed, key = compute_reconstruction(img_array, filtr_sin[-1], filtered_key, steps=steps,
+                                                            span=span, num_rays=num_rays, max_angle=180,
+                                                            intermediate=True, slot="filtered reconstruction")
+            show_steps(reconstructed, key, animate)
+
+    if filtered:
+        roi_view(img_array, filtr_sin[-1], filtered_key, steps, span, num_rays)
+    else:
+        roi_view(img_array, sinogram[-1], sinogram_key, steps, span, num_rays)
+
+    st.success("Process finished!")
+
+    if from_dicom:
+        form_col, dicom_col = st.columns(2)
+
+        with form_col:
+            st.write("Input patient's data")
+            _dicom_form(reconstructed[-1])
+
+        with dicom_col:
+            st.write("Patient's name from .dcm file")
+
+            st.text_input("Name", st.session_state.get("name", None), disabled=True)
+            st.text_input("ID", st.session_state.get("id", None), disabled=True)
+            st.text_input("Date", st.session_state.get("date", None), disabled=True)
+            st.text_input("Comments", st.session_state.get("comm", None), disabled=True)
+    else:
+        _dicom_form(reconstructed[-1])
+
+    if st.button("Back to Main Page"):
+        go_to_page("main")
+
+
 global x
 x = False
 
 global it
 it = False
 
-global anim
-anim = False
-
 global fil
 fil = False
 
@@ -147,6 +337,10 @@ if st.session_state.page == "main":
             image = Image.open(uploaded_file)
 
         st.session_state.image = image
+        # Obraz wejściowy i jego skrót są wyznaczane raz, przy wczytaniu - dalsze klucze cache'a
+        # wyników pochodzą już tylko z tego skrótu i parametrów
+        st.session_state.image_array = np.array(image.convert("L")).astype(np.float32)
+        st.session_state.image_digest = image_digest(st.session_state.image_array)
 
     if "image" in st.session_state:
         st.image(st.session_state.image, use_container_width=False)
@@ -173,544 +367,30 @@ if st.session_state.page == "main":
     st.session_state.alpha = st.select_slider("Delta Alpha (α)", options=vals)
     st.session_state.n = st.slider("Number of Detectors (n)", min_value=20, max_value=500, value=250)
     st.session_state.l = st.slider("Detector Spread (l)", min_value=1, max_value=500, value=120)
+    st.session_state.method = st.radio("Back-projection", options=list(BACKPROJECTION_METHODS), horizontal=True,
+                                       format_func=lambda m: "ray-driven" if m == "ray" else "pixel-driven")
+    st.session_state.projector = st.radio("Projector", options=list(PROJECTORS), horizontal=True,
+                                          format_func=lambda p: "Bresenham" if p == "bresenham"
+                                          else "Siddon (exact lengths)")
+    st.session_state.precision = st.radio("Precision", options=["float64", "float32"], horizontal=True,
+                                          format_func=lambda d: "float64" if d == "float64"
+                                          else "float32 (half memory)")
+    st.session_state.preview = st.checkbox("Coarse-to-fine preview", value=st.session_state.get("preview", False),
+                                           help="Show 1/4 and 1/2 resolution reconstructions while the full "
+                                                "reconstruction is computed")
+    st.session_state.profiling = st.checkbox("Profile computations", value=st.session_state.get("profiling", False))
 
     # st.markdown(f"**Delta Alpha:** {st.session_state.get('alpha', 'Not Set')}")
     # st.markdown(f"**n:** {st.session_state.get('n', 'Not Set')}")
     # st.markdown(f"**l:** {st.session_state.get('l', 'Not Set')}")
 
-elif st.session_state.page == "first":
-    st.title("Simulation")
-
-    st.markdown(
-        f"**Delta Alpha:** {st.session_state.get('alpha', 'Not Set')}, **n:** {st.session_state.get('n', 'Not Set')}, **l:** {st.session_state.get('l', 'Not Set')}")
-
-    steps = 180 // st.session_state.alpha
-    st.session_state.step = st.slider("step", min_value=1, max_value=steps, value=steps)
-
-    if st.button("show animation"):
-        anim = True
-
-    col1, col2, col3, _ = st.columns(4)
-
-    with col1:
-        st.image(st.session_state.image, caption="Model", use_container_width=True)
-    with col2:
-        img_array = np.array(st.session_state.image.convert("L")).astype(np.float32)
-
-        with st.spinner("Computing the sinogram..."):
-            sinogram = compute_sinogram(img_array, steps=steps, span=st.session_state.get('l', '120'),
-                                        num_rays=st.session_state.get('n', '250'), max_angle=180, intermediate=True)
-
-        sin = np.transpose(sinogram[steps - 1])
-
-        vmin = np.percentile(sin, 1)
-        vmax = np.percentile(sin, 99)
-
-        if anim == False:
-            fig, ax = plt.subplots(figsize=(2, 2))
-            ax.imshow(np.transpose(sinogram[st.session_state.get("step", 0) - 1]), cmap="gray", aspect='auto',
-                      vmin=vmin, vmax=vmax)
-            ax.axis('off')
-
-            st.pyplot(fig, use_container_width=True)
-            plt.close()
-
-        elif anim == True:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(np.transpose(sinogram[i]), cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                plt.close()
-                sleep(1 / steps)
-
-    with col3:
-        with st.spinner("Computing the reconstructed image..."):
-            reconstructed = compute_reconstruction(img_array, sinogram[steps - 1], steps=steps,
-                                                   span=st.session_state.get('l', '120'),
-                                                   num_rays=st.session_state.get('n', '250'), max_angle=180,
-                                                   intermediate=True)
-
-        vmin = np.percentile(reconstructed[-1], 1)
-        vmax = np.percentile(reconstructed[-1], 99)
-
-        if anim == False:
-            fig2, ax2 = plt.subplots(figsize=(2, 2))
-            ax2.imshow(reconstructed[st.session_state.get("step", 0) - 1], cmap="gray", aspect='auto', vmin=vmin,
-                       vmax=vmax)
-            ax2.axis('off')
-
-            st.pyplot(fig2, use_container_width=True)
-            plt.close()
-
-        else:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(reconstructed[i], cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-            anim = False
-
-    st.success("Process finished!")
-
-    kernel = create_shepp_logan_kernel(9)
-
-    patient_name = st.text_input("Patient Name")
-    patient_id = st.text_input("Patient ID")
-    study_date = st.date_input("Study Date", value=datetime.date.today())
-    comments = st.text_input("Comments")
-
-    clipped = np.clip(reconstructed[-1], vmin, vmax)
-    image_array = ((clipped - vmin) / (vmax - vmin) * 65535).astype(np.uint16)
-
-    if st.button("Save DICOM"):
-        save_as_dicom(image_array, "zapisane_dicom.dcm", patient_name, patient_id, study_date, comments)
-
-    if st.button("Back to Main Page"):
-        go_to_page("main")
-
-elif st.session_state.page == "third":
-    st.title("Simulation")
-
-    st.markdown(
-        f"**Delta Alpha:** {st.session_state.get('alpha', 'Not Set')}, **n:** {st.session_state.get('n', 'Not Set')}, **l:** {st.session_state.get('l', 'Not Set')}")
-
-    steps = 180 // st.session_state.alpha
-    st.session_state.step = st.slider("step", min_value=1, max_value=steps, value=steps)
-
-    if st.button("show animation"):
-        anim = True
-
-    col1, col2, col3, _ = st.columns(4)
-
-    with col1:
-        st.image(st.session_state.image, caption="Model", use_container_width=True)
-
-    with col2:
-        img_array = np.array(st.session_state.image.convert("L")).astype(np.float32)
-
-        with st.spinner("Computing the sinogram..."):
-            sinogram = compute_sinogram(img_array, steps=steps, span=st.session_state.get('l', '120'),
-                                        num_rays=st.session_state.get('n', '250'), max_angle=180, intermediate=True)
-
-        sin = np.transpose(sinogram[steps - 1])
-
-        vmin = np.percentile(sin, 1)
-        vmax = np.percentile(sin, 99)
-
-        if anim == False:
-            fig, ax = plt.subplots(figsize=(2, 2))
-            ax.imshow(np.transpose(sinogram[st.session_state.get("step", 0) - 1]), cmap="gray", aspect='auto',
-                      vmin=vmin, vmax=vmax)
-            ax.axis('off')
-
-            st.pyplot(fig, use_container_width=True)
-            plt.close()
-
-        elif anim == True:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(np.transpose(sinogram[i]), cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-    with col3:
-        with st.spinner("Computing the reconstructed image..."):
-            reconstructed = compute_reconstruction(img_array, sinogram[steps - 1], steps=steps,
-                                                   span=st.session_state.get('l', '120'),
-                                                   num_rays=st.session_state.get('n', '250'), max_angle=180,
-                                                   intermediate=True)
-
-        vmin = np.percentile(reconstructed[-1], 1)
-        vmax = np.percentile(reconstructed[-1], 99)
-
-        if anim == False:
-            fig2, ax2 = plt.subplots(figsize=(2, 2))
-            ax2.imshow(reconstructed[st.session_state.get("step", 0) - 1], cmap="gray", aspect='auto', vmin=vmin,
-                       vmax=vmax)
-            ax2.axis('off')
+else:
+    # Strony symulacji różnią się tylko filtrem i danymi pacjenta z pliku .dcm
+    filtered, from_dicom = SIMULATION_PAGES[st.session_state.page]
+    simulation_page(filtered, from_dicom)
 
-            st.pyplot(fig2, use_container_width=True)
-            plt.close()
-
-        else:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(reconstructed[i], cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-            anim = False
-
-    st.success("Process finished!")
-
-    c1, c2 = st.columns(2)
-
-    with c1:
-        st.write("Input patient's data")
-
-        patient_name = st.text_input("Patient Name")
-        patient_id = st.text_input("Patient ID")
-        study_date = st.date_input("Study Date", value=datetime.date.today())
-        comments = st.text_input("Comments")
-
-        clipped = np.clip(reconstructed[-1], vmin, vmax)
-        image_array = ((clipped - vmin) / (vmax - vmin) * 65535).astype(np.uint16)
-
-        if st.button("Save DICOM"):
-            save_as_dicom(image_array, "zapisane_dicom.dcm", patient_name, patient_id, study_date, comments)
-
-    with c2:
-        st.write("Patient's name from .dcm file")
-
-        st.text_input("Name", st.session_state.get("name", None), disabled=True)
-        st.text_input("ID", st.session_state.get("id", None), disabled=True)
-        st.text_input("Date", st.session_state.get("date", None), disabled=True)
-        st.text_input("Comments", st.session_state.get("comm", None), disabled=True)
-
-    if st.button("Back to Main Page"):
-        go_to_page("main")
-
-elif st.session_state.page == "second":
-    st.title("Simulation")
-
-    st.write("filtr")
-
-    st.markdown(
-        f"**Delta Alpha:** {st.session_state.get('alpha', 'Not Set')}, **n:** {st.session_state.get('n', 'Not Set')}, **l:** {st.session_state.get('l', 'Not Set')}")
-
-    steps = 180 // st.session_state.alpha
-    st.session_state.step = st.slider("step", min_value=1, max_value=steps, value=steps)
-    if st.button("show animation"):
-        anim = True
-
-    col1, col2, col3, _ = st.columns(4)
-
-    with col1:
-        st.image(st.session_state.image, caption="Model", use_container_width=True)
-
-
-    with col2:
-        img_array = np.array(st.session_state.image.convert("L")).astype(np.float32)
-
-        steps = 180 // st.session_state.alpha
-
-        with st.spinner("Computing the sinogram..."):
-            sinogram = compute_sinogram(img_array, steps=steps, span=st.session_state.get('l', '120'),
-                                        num_rays=st.session_state.get('n', '250'), max_angle=180, intermediate=True)
-
-        sin = np.transpose(sinogram[-1])
-
-        vmin = np.percentile(sin, 1)
-        vmax = np.percentile(sin, 99)
-
-        if anim == False:
-            fig, ax = plt.subplots(figsize=(2, 2))
-            ax.imshow(np.transpose(sinogram[st.session_state.get("step", 0) - 1]), cmap="gray", aspect='auto',
-                      vmin=vmin, vmax=vmax)
-            ax.axis('off')
-
-            st.pyplot(fig, use_container_width=True)
-            plt.close()
-
-        elif anim == True:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(np.transpose(sinogram[i]), cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-    with col3:
-        img_array = np.array(st.session_state.image.convert("L")).astype(np.float32)
-
-        steps = 180 // st.session_state.alpha
-
-        with st.spinner("Computing the sinogram with filter..."):
-            filtr_sin = compute_filter(sinogram)
-
-        vmin = np.percentile(filtr_sin[-1], 1)
-        vmax = np.percentile(filtr_sin[-1], 99)
-
-        if anim == False:
-            fig, ax = plt.subplots(figsize=(2, 2))
-            ax.imshow(np.transpose(filtr_sin[st.session_state.get("step", 0) - 1]), cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-            ax.axis('off')
-            st.pyplot(fig, use_container_width=True)
-            plt.close()
-
-        elif anim == True:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(np.transpose(filtr_sin[i]), cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1/steps)
-                plt.close()
-
-    _, cl1, cl2, __ = st.columns(4)
-    with cl1:
-        with st.spinner("Computing the reconstructed image..."):
-            reconstructed = compute_reconstruction(img_array, sinogram[-1], steps=steps,
-                                                   span=st.session_state.get('l', '120'),
-                                                   num_rays=st.session_state.get('n', '250'), max_angle=180, intermediate=True)
-
-        vmin = np.percentile(reconstructed[-1], 1)
-        vmax = np.percentile(reconstructed[-1], 99)
-        if anim == False:
-            fig2, ax2 = plt.subplots(figsize=(2, 2))
-            ax2.imshow(reconstructed[st.session_state.get("step", 0) - 1], cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-            ax2.axis('off')
-
-            st.pyplot(fig2, use_container_width=True)
-            plt.close()
-
-        else:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(reconstructed[i], cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-    with cl2:
-        with st.spinner("Computing the reconstructed image with filter..."):
-            filtr_reconstructed = compute_reconstruction(img_array, filtr_sin[-1], steps=steps,
-                                                         span=st.session_state.get('l', '120'),
-                                                         num_rays=st.session_state.get('n', '250'), max_angle=180, intermediate=True)
-
-        vmin = np.percentile(filtr_reconstructed[-1], 1)
-        vmax = np.percentile(filtr_reconstructed[-1], 99)
-
-        if anim == False:
-            fig2, ax2 = plt.subplots(figsize=(2, 2))
-            ax2.imshow(filtr_reconstructed[st.session_state.get("step", 0) - 1], cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-            ax2.axis('off')
-
-            st.pyplot(fig2, use_container_width=True)
-            plt.close()
-
-        else:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(filtr_reconstructed[i], cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-            anim = False
-
-    st.success("Process finished!")
-
-    patient_name = st.text_input("Patient Name")
-    patient_id = st.text_input("Patient ID")
-    study_date = st.date_input("Study Date", value=datetime.date.today())
-    comments = st.text_input("Comments")
-
-    clipped = np.clip(filtr_reconstructed[-1], vmin, vmax)
-    image_array = ((clipped - vmin) / (vmax - vmin) * 65535).astype(np.uint16)
-
-    if st.button("Save DICOM"):
-        save_as_dicom(image_array, "zapisane_dicom.dcm", patient_name, patient_id, study_date, comments)
-
-    if st.button("Back to Main Page"):
-        go_to_page("main")
-
-elif st.session_state.page == "fourth":
-    st.title("Simulation")
-
-    st.write("filtr")
-
-    st.markdown(
-        f"**Delta Alpha:** {st.session_state.get('alpha', 'Not Set')}, **n:** {st.session_state.get('n', 'Not Set')}, **l:** {st.session_state.get('l', 'Not Set')}")
-
-    steps = 180 // st.session_state.alpha
-    st.session_state.step = st.slider("step", min_value=1, max_value=steps, value=steps)
-    if st.button("show animation"):
-        anim = True
-
-    col1, col2, col3, _ = st.columns(4)
-
-    with col1:
-        st.image(st.session_state.image, caption="Model", use_container_width=True)
-
-    with col2:
-        img_array = np.array(st.session_state.image.convert("L")).astype(np.float32)
-
-        steps = 180 // st.session_state.alpha
-
-        with st.spinner("Computing the sinogram..."):
-            sinogram = compute_sinogram(img_array, steps=steps, span=st.session_state.get('l', '120'),
-                                        num_rays=st.session_state.get('n', '250'), max_angle=180, intermediate=True)
-
-        sin = np.transpose(sinogram[-1])
-
-        vmin = np.percentile(sin, 1)
-        vmax = np.percentile(sin, 99)
-
-        if anim == False:
-            fig, ax = plt.subplots(figsize=(2, 2))
-            ax.imshow(np.transpose(sinogram[st.session_state.get("step", 0) - 1]), cmap="gray", aspect='auto',
-                      vmin=vmin, vmax=vmax)
-            ax.axis('off')
-
-            st.pyplot(fig, use_container_width=True)
-            plt.close()
-
-        elif anim == True:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(np.transpose(sinogram[i]), cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-    with col3:
-        img_array = np.array(st.session_state.image.convert("L")).astype(np.float32)
-
-        steps = 180 // st.session_state.alpha
-
-        with st.spinner("Computing the sinogram with filter..."):
-            filtr_sin = compute_filter(sinogram)
-
-        vmin = np.percentile(filtr_sin[-1], 1)
-        vmax = np.percentile(filtr_sin[-1], 99)
-
-        if anim == False:
-            fig, ax = plt.subplots(figsize=(2, 2))
-            ax.imshow(np.transpose(filtr_sin[st.session_state.get("step", 0) - 1]), cmap="gray", aspect='auto',
-                      vmin=vmin, vmax=vmax)
-            ax.axis('off')
-            st.pyplot(fig, use_container_width=True)
-            plt.close()
-
-        elif anim == True:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(np.transpose(filtr_sin[i]), cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-    _, cl1, cl2, __ = st.columns(4)
-    with cl1:
-        with st.spinner("Computing the reconstructed image..."):
-            reconstructed = compute_reconstruction(img_array, sinogram[-1], steps=steps,
-                                                   span=st.session_state.get('l', '120'),
-                                                   num_rays=st.session_state.get('n', '250'), max_angle=180,
-                                                   intermediate=True)
-
-        vmin = np.percentile(reconstructed[-1], 1)
-        vmax = np.percentile(reconstructed[-1], 99)
-        if anim == False:
-            fig2, ax2 = plt.subplots(figsize=(2, 2))
-            ax2.imshow(reconstructed[st.session_state.get("step", 0) - 1], cmap="gray", aspect='auto', vmin=vmin,
-                       vmax=vmax)
-            ax2.axis('off')
-
-            st.pyplot(fig2, use_container_width=True)
-            plt.close()
-
-        else:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(reconstructed[i], cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-    with cl2:
-        with st.spinner("Computing the reconstructed image with filter..."):
-            filtr_reconstructed = compute_reconstruction(img_array, filtr_sin[-1], steps=steps,
-                                                         span=st.session_state.get('l', '120'),
-                                                         num_rays=st.session_state.get('n', '250'), max_angle=180,
-                                                         intermediate=True)
-
-        vmin = np.percentile(filtr_reconstructed[-1], 1)
-        vmax = np.percentile(filtr_reconstructed[-1], 99)
-
-        if anim == False:
-            fig2, ax2 = plt.subplots(figsize=(2, 2))
-            ax2.imshow(filtr_reconstructed[st.session_state.get("step", 0) - 1], cmap="gray", aspect='auto', vmin=vmin,
-                       vmax=vmax)
-            ax2.axis('off')
-
-            st.pyplot(fig2, use_container_width=True)
-            plt.close()
-
-        else:
-            placeholder = st.empty()
-            for i in range(steps):
-                fig, ax = plt.subplots(figsize=(2, 2))
-                ax.imshow(filtr_reconstructed[i], cmap="gray", aspect='auto', vmin=vmin, vmax=vmax)
-                ax.axis('off')
-
-                placeholder.pyplot(fig, use_container_width=True)
-                sleep(1 / steps)
-                plt.close()
-
-            anim = False
-
-    st.success("Process finished!")
-
-    cc1, cc2 = st.columns(2)
-
-    with cc1:
-        st.write("Input patient's data")
-
-        patient_name = st.text_input("Patient Name")
-        patient_id = st.text_input("Patient ID")
-        study_date = st.date_input("Study Date", value=datetime.date.today())
-        comments = st.text_input("Comments")
-
-        clipped = np.clip(filtr_reconstructed[-1], vmin, vmax)
-        image_array = ((clipped - vmin) / (vmax - vmin) * 65535).astype(np.uint16)
-
-        if st.button("Save DICOM"):
-            save_as_dicom(image_array, "zapisane_dicom.dcm", patient_name, patient_id, study_date, comments)
-
-    with cc2:
-        st.write("Patient's name from .dcm file")
-
-        st.text_input("Name", st.session_state.get("name", None), disabled=True)
-        st.text_input("ID", st.session_state.get("id", None), disabled=True)
-        st.text_input("Date", st.session_state.get("date", None), disabled=True)
-        st.text_input("Comments", st.session_state.get("comm", None), disabled=True)
-
-    if st.button("Back to Main Page"):
-        go_to_page("main")
\ No newline at end of file
+if st.session_state.page != "main" and st.session_state.profiles:
+    with st.expander("Profile"):
+        for name, run in st.session_state.profiles:
+            st.markdown(f"**{name}**")
+            st.code(run.report() or "(cached)")
@@ -0,0 +1,213 @@
+import functools
+
+import numpy as np
+
+from geometria import ScanGeometry
+
+
+class FanBeamGeometry(ScanGeometry):
+    """
+    Geometria wiązki wachlarzowej: punktowe źródło na okręgu o promieniu source_distance wokół środka
+    obrazu i łukowy detektor o promieniu detector_distance ze środkiem w źródle. Detektory są
+    rozmieszczone równokątowo, span to kąt rozwarcia wachlarza.
+
+    Promień j w kroku idx wychodzi ze źródła pod kątem beta = angle(idx) i jest odchylony o
+    gamma_j = span/2 - j * span/(num_rays - 1) od promienia centralnego, więc leży na tej samej
+    prostej co promień równoległy o kierunku beta + gamma_j i odległości source_distance * sin(gamma_j)
+    od środka. Promienie są obcinane do okręgu opisanego na obrazie (tak jak w get_parallel_rays),
+    więc macierz systemowa, projekcja i projekcja wsteczna działają bez zmian.
+    """
+
+    def __init__(self, shape, steps, span, num_rays, max_angle, source_distance, detector_distance, matrix=None,
+                 trace=True, projector='bresenham'):
+        """
+        :param source_distance: - odległość źródła od środka obrotu (w pikselach)
+        :param detector_distance: - odległość źródła od detektora (w pikselach)
+        Pozostałe parametry jak w ScanGeometry
+        """
+        radius = max(int(shape[0]) // 2, int(shape[1]) // 2) * np.sqrt(2)
+        if source_distance <= radius:
+            raise ValueError(f"Źródło musi leżeć poza obrazem (odległość większa niż {radius:.1f} pikseli)")
+        if detector_distance <= source_distance:
+            raise ValueError("Odległość źródło-detektor musi być większa niż odległość źródło-środek obrotu")
+        self.source_distance = float(source_distance)
+        self.detector_distance = float(detector_distance)
+        super().__init__(shape, steps, span, num_rays, max_angle, matrix, trace, projector)
+
+    @property
+    def key(self):
+        return super().key + ('fan', self.source_distance, self.detector_distance)
+
+    def fan_angles(self):
+        """
+        :return: kąty odchylenia gamma kolejnych promieni od promienia centralnego (w radianach)
+        """
+        theta = np.radians(self.span)
+        return theta / 2 - np.arange(self.num_rays) * theta / (self.num_rays - 1)
+
+    def rays(self, idx):
+        beta = np.radians(self.angle(idx))
+        gamma = self.fan_angles()
+        psi = beta + gamma
+        center = np.array(self.center, dtype=np.float64)
+
+        # Źródło leży naprzeciw kierunku promienia centralnego
+        source = center - self.source_distance * np.array([np.cos(beta), np.sin(beta)])
+        direction = np.stack([np.cos(psi), np.sin(psi)], axis=1)
+
+        # Przecięcia prostej źródło + t * kierunek z okręgiem o promieniu radius
+        offset = source - center
+        half = direction @ offset
+        disc = half ** 2 - (offset @ offset - self.radius ** 2)
+        root = np.sqrt(np.maximum(disc, 0))
+        # Promienie omijające okrąg (a więc i obraz) dostają zdegenerowany odcinek poza obrazem
+        t_in, t_out = -half - root, -half + root
+        start = source + t_in[:, None] * direction
+        end = source + t_out[:, None] * direction
+
+        rays = np.empty((self.num_rays, 2, 2))
+        rays[:, 0, 0] = start[:, 0]
+        rays[:, 0, 1] = end[:, 0]
+        rays[:, 1, 0] = start[:, 1]
+        rays[:, 1, 1] = end[:, 1]
+        return rays
+
+
+@functools.lru_cache(maxsize=4)
+def _fan_geometry(shape, steps, span, num_rays, max_angle, source_distance, detector_distance, projector):
+    return FanBeamGeometry(shape, steps, span, num_rays, max_angle, source_distance, detector_distance,
+                           projector=projector)
+
+
+def get_fan_geometry(shape, steps, span, num_rays, max_angle, source_distance, detector_distance,
+                     projector='bresenham'):
+    """
+    Funkcja zwracająca (współdzieloną) geometrię wiązki wachlarzowej z wyznaczoną macierzą systemową
+
+    :return: obiekt FanBeamGeometry
+    """
+    return _fan_geometry((int(shape[0]), int(shape[1])), int(steps), float(span), int(num_rays), float(max_angle),
+                         float(source_distance), float(detector_distance), projector)
+
+
+def calculate_fan_sinogram(img, steps, span, num_rays, max_angle, source_distance, detector_distance,
+                           projector='bresenham'):
+    """
+    Sinogram w geometrii wachlarzowej
+
+    :param img: - ndarray obrazu wejściowego
+    :param steps: - ilość położeń źródła
+    :param span: - kąt rozwarcia wachlarza
+    :param num_rays: - liczba detektorów
+    :param max_angle: - zakres obrotu źródła (360 - pełny obrót)
+    :param source_distance: - odległość źródła od środka obrotu (w pikselach)
+    :param detector_distance: - odległość źródła od detektora (w pikselach)
+    :param projector: - model projektora (jeden z PROJECTORS)
+    :return: ndarray o wymiarach (steps, num_rays)
+    """
+    geometry = get_fan_geometry(img.shape, steps, span, num_rays, max_angle, source_distance, detector_distance,
+                                projector)
+    return geometry.project(img)
+
+
+def parallel_parameters(shape, steps, span, num_rays, max_angle, source_distance):
+    """
+    Parametry geometrii równoległej (steps, span, num_rays, max_angle), na którą można przepróbkować
+    sinogram wachlarzowy: ta sama liczba kroków i detektorów, zakres obrotu 180 stopni i rozpiętość
+    obejmująca ten sam pas co wachlarz
+    """
+    radius = max(int(shape[0]) // 2, int(shape[1]) // 2) * np.sqrt(2)
+    reach = min(1.0, source_distance * np.sin(np.radians(span) / 2) / radius)
+    return steps, float(np.degrees(2 * np.arcsin(reach))), num_rays, 180
+
+
+@functools.lru_cache(maxsize=16)
+def _rebinning_table(fan, parallel):
+    shape, steps, span, num_rays, max_angle, source_distance = fan
+    p_steps, p_span, p_num_rays, p_max_angle = parallel
+    radius = max(shape[0] // 2, shape[1] // 2) * np.sqrt(2)
+
+    # Proste docelowych promieni równoległych: kierunek alpha i odległość s od środka
+    alpha = np.radians(np.arange(p_steps) * (p_max_angle / p_steps))[:, None]
+    p_theta = np.radians(p_span)
+    s = radius * np.sin(p_theta / 2 - np.arange(p_num_rays) * p_theta / (p_num_rays - 1))[None, :]
+    alpha, s = np.broadcast_arrays(alpha, s)
+
+    theta = np.radians(span)
+    delta_gamma = theta / (num_rays - 1)
+    delta_beta = np.radians(max_angle / steps)
+    full_turn = np.isclose(max_angle, 360)
+
+    indices = np.zeros(alpha.shape + (4,), dtype=np.int64)
+    weights = np.zeros(alpha.shape + (4,))
+    filled = np.zeros(alpha.shape, dtype=bool)
+    ratio = s / source_distance
+    reachable = np.abs(ratio) <= 1
+    gamma0 = np.arcsin(np.clip(ratio, -1, 1))
+
+    # Prosta nieskierowana ma dwie reprezentacje wachlarzowe: (alpha - gamma, gamma)
+    # oraz (alpha + pi + gamma, -gamma); używana jest pierwsza, która mieści się w zebranych danych
+    for beta, gamma in ((alpha - gamma0, gamma0), (alpha + np.pi + gamma0, -gamma0)):
+        b = np.mod(beta, 2 * np.pi) / delta_beta
+        g = (theta / 2 - gamma) / delta_gamma
+        valid = reachable & ~filled & (g >= 0) & (g <= num_rays - 1)
+        if full_turn:
+            b = np.mod(b, steps)
+        else:
+            valid &= b <= steps - 1
+        b = np.where(valid, b, 0)
+        g = np.where(valid, g, 0)
+        b0 = np.floor(b).astype(np.int64)
+        g0 = np.floor(g).astype(np.int64)
+        wb, wg = b - b0, g - g0
+        # Sąsiedni kąt źródła - przy pełnym obrocie ostatni krok sąsiaduje z pierwszym
+        b1 = (b0 + 1) % steps if full_turn else np.minimum(b0 + 1, steps - 1)
+        g1 = np.minimum(g0 + 1, num_rays - 1)
+        corners = ((b0, g0, (1 - wb) * (1 - wg)), (b0, g1, (1 - wb) * wg),
+                   (b1, g0, wb * (1 - wg)), (b1, g1, wb * wg))
+        for k, (bi, gi, w) in enumerate(corners):
+            indices[..., k] = np.where(valid, bi * num_rays + gi, indices[..., k])
+            weights[..., k] = np.where(valid, w, weights[..., k])
+        filled |= valid
+
+    indices = indices.reshape(-1, 4)
+    weights = weights.reshape(-1, 4)
+    indices.setflags(write=False)
+    weights.setflags(write=False)
+    return indices, weights
+
+
+def rebinning_table(shape, steps, span, num_rays, max_angle, source_distance, parallel=None):
+    """
+    Tablice interpolacji (indeksy i wagi interpolacji dwuliniowej) przepróbkowania sinogramu
+    wachlarzowego na równoległy, wyznaczane raz dla danej pary geometrii
+
+    :param parallel: - parametry geometrii równoległej (steps, span, num_rays, max_angle),
+                       domyślnie z parallel_parameters
+    :return: krotka (indeksy, wagi) o kształcie (p_steps * p_num_rays, 4) każda
+    """
+    if parallel is None:
+        parallel = parallel_parameters(shape, steps, span, num_rays, max_angle, source_distance)
+    fan = ((int(shape[0]), int(shape[1])), int(steps), float(span), int(num_rays), float(max_angle),
+           float(source_distance))
+    parallel = (int(parallel[0]), float(parallel[1]), int(parallel[2]), float(parallel[3]))
+    return _rebinning_table(fan, parallel)
+
+
+def rebin_to_parallel(sinogram, shape, steps, span, num_rays, max_angle, source_distance, parallel=None):
+    """
+    Przepróbkowanie sinogramu wachlarzowego (lub stosu sinogramów) na geometrię równoległą,
+    którą obsługują reverse_radon_transform i filter_sinogram_fft. Dla całego stosu to jedno
+    pobranie wartości według gotowych tablic indeksów
+
+    :param sinogram: - ndarray o kształcie (..., steps, num_rays)
+    :param parallel: - parametry docelowej geometrii równoległej (steps, span, num_rays, max_angle)
+    :return: ndarray o kształcie (..., p_steps, p_num_rays)
+    """
+    if parallel is None:
+        parallel = parallel_parameters(shape, steps, span, num_rays, max_angle, source_distance)
+    indices, weights = rebinning_table(shape, steps, span, num_rays, max_angle, source_distance, parallel)
+    sinogram = np.asarray(sinogram)
+    flat = sinogram.reshape(sinogram.shape[:-2] + (-1,))
+    rebinned = np.einsum('...pk,pk->...p', flat[..., indices], weights)
+    return rebinned.reshape(sinogram.shape[:-2] + (int(parallel[0]), int(parallel[2])))
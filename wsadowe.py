@@ -0,0 +1,199 @@
+import argparse
+import datetime
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from geometria import configure_geometry_cache
+from obliczenia import (FILTER_WINDOWS, BACKPROJECTION_METHODS, PROJECTORS, calculate_sinogram,
+                        filter_sinogram_fft, reverse_radon_transform)
+from pliki_dicom import IMAGE_EXTENSIONS, load_image, read_study_date, save_as_dicom, to_uint16
+from profilowanie import profile
+
+
+def find_inputs(paths, recursive=False):
+    """
+    Zbiera pliki obrazów z podanych plików i katalogów
+
+    :param paths: lista ścieżek do plików lub katalogów
+    :param recursive: przeszukiwanie podkatalogów
+    :return: posortowana lista krotek (ścieżka pliku, ścieżka względem katalogu wejściowego)
+    """
+    inputs = []
+    for path in paths:
+        if os.path.isfile(path):
+            inputs.append((path, os.path.basename(path)))
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    file_path = os.path.join(root, name)
+                    inputs.append((file_path, os.path.relpath(file_path, path)))
+            if not recursive:
+                break
+    return inputs
+
+
+def output_name(relative_path):
+    # Rozszerzenie trafia do nazwy, bo np. Kwadraty2.png i Kwadraty2.dcm leżą w tym samym katalogu
+    stem, ext = os.path.splitext(relative_path)
+    return f"{stem}_{ext.lstrip('.').lower()}.dcm"
+
+
+def process_file(path, output_path, params):
+    """
+    Pełny przebieg dla jednego pliku: sinogram, filtrowanie, rekonstrukcja i zapis do DICOM.
+    Plik jest zapisywany pod nazwą tymczasową i podmieniany na końcu, więc przerwany
+    przebieg nigdy nie zostawia pliku, który zostałby uznany za gotowy
+
+    :param path: ścieżka do obrazu wejściowego
+    :param output_path: ścieżka pliku DICOM z wynikiem
+    :param params: słownik parametrów skanu (steps, span, num_rays, max_angle, filter, method, projector,
+                   patient_*, profile)
+    :return: krotka (czas przetwarzania w sekundach, raport profilowania lub None)
+    """
+    start = time.perf_counter()
+    if not params.get('profile'):
+        _process_file(path, output_path, params)
+        return time.perf_counter() - start, None
+    with profile() as run:
+        _process_file(path, output_path, params)
+    return time.perf_counter() - start, run.report()
+
+
+def _process_file(path, output_path, params):
+    img, dcm = load_image(path)
+    geometry_args = (params['steps'], params['span'], params['num_rays'], params['max_angle'])
+
+    projector = params.get('projector', 'bresenham')
+    sinogram = calculate_sinogram(img, *geometry_args, projector=projector)
+    if params['filter'] != 'none':
+        sinogram = filter_sinogram_fft(sinogram, params['filter'])
+    reconstructed = reverse_radon_transform(img, sinogram, *geometry_args, method=params['method'],
+                                            projector=projector)
+
+    if dcm is not None:
+        patient_name = str(dcm.get('PatientName', params['patient_name']))
+        patient_id = str(dcm.get('PatientID', params['patient_id']))
+        study_date = read_study_date(dcm)
+    else:
+        patient_name, patient_id, study_date = params['patient_name'], params['patient_id'], datetime.date.today()
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    partial_path = output_path + '.part'
+    save_as_dicom(to_uint16(reconstructed), partial_path, patient_name, patient_id, study_date, params['comments'])
+    os.replace(partial_path, output_path)
+
+
+def run_batch(jobs, params, workers=1, geometry_cache=None, log=print):
+    """
+    Przetwarza listę zadań w puli procesów. W danej chwili w toku jest co najwyżej
+    2 * workers plików, co ogranicza zużycie pamięci niezależnie od liczby plików
+
+    :param jobs: lista krotek (ścieżka wejściowa, ścieżka wyjściowa)
+    :param params: parametry skanu przekazywane do process_file
+    :param workers: liczba procesów (1 - przetwarzanie w bieżącym procesie)
+    :param geometry_cache: katalog dyskowego cache'a geometrii współdzielonego przez procesy
+    :param log: funkcja wypisująca postęp
+    :return: lista ścieżek, których nie udało się przetworzyć
+    """
+    failed = []
+    total = len(jobs)
+
+    def report(done, path, output_path, result, error):
+        if error is None:
+            elapsed, profile_report = result
+            log(f"[{done}/{total}] {path} -> {output_path} ({elapsed:.2f}s)")
+            if profile_report:
+                log(profile_report)
+        else:
+            failed.append(path)
+            log(f"[{done}/{total}] {path} FAILED: {error}")
+
+    if workers <= 1:
+        if geometry_cache is not None:
+            configure_geometry_cache(cache_dir=geometry_cache)
+        for done, (path, output_path) in enumerate(jobs, 1):
+            try:
+                report(done, path, output_path, process_file(path, output_path, params), None)
+            except Exception as error:
+                report(done, path, output_path, None, error)
+        return failed
+
+    initializer = configure_geometry_cache if geometry_cache is not None else None
+    initargs = (None, geometry_cache) if geometry_cache is not None else ()
+    with ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as pool:
+        pending = {}
+        queue = iter(jobs)
+        done = 0
+        while True:
+            for path, output_path in queue:
+                pending[pool.submit(process_file, path, output_path, params)] = (path, output_path)
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path, output_path = pending.pop(future)
+                done += 1
+                error = future.exception()
+                report(done, path, output_path, None if error else future.result(), error)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless CT simulation: sinogram, filtering and reconstruction "
+                                                 "of every image in the given files/directories, saved as DICOM.")
+    parser.add_argument("inputs", nargs="+", help="image files (png/jpg/bmp/dcm) or directories, e.g. scans modele")
+    parser.add_argument("-o", "--output", required=True, help="output directory for reconstructed DICOM files")
+    parser.add_argument("--steps", type=int, default=180, help="number of scan steps (default: 180)")
+    parser.add_argument("--span", type=float, default=120, help="detector spread in degrees (default: 120)")
+    parser.add_argument("--num-rays", type=int, default=250, help="number of detectors (default: 250)")
+    parser.add_argument("--max-angle", type=float, default=180, help="total rotation in degrees (default: 180)")
+    parser.add_argument("--filter", default="shepp-logan", choices=FILTER_WINDOWS + ('none',),
+                        help="sinogram filter window (default: shepp-logan)")
+    parser.add_argument("--method", default="ray", choices=BACKPROJECTION_METHODS,
+                        help="back-projection method (default: ray)")
+    parser.add_argument("--projector", default="bresenham", choices=PROJECTORS,
+                        help="ray model: Bresenham pixel walk or Siddon exact intersection lengths "
+                             "(default: bresenham)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--recursive", action="store_true", help="also scan subdirectories")
+    parser.add_argument("--overwrite", action="store_true", help="recompute outputs that already exist")
+    parser.add_argument("--geometry-cache", help="directory for the on-disk ray geometry cache shared by workers")
+    parser.add_argument("--patient-name", default="Unknown", help="patient name for non-DICOM inputs")
+    parser.add_argument("--patient-id", default="", help="patient ID for non-DICOM inputs")
+    parser.add_argument("--comments", default="", help="ImageComments written to every output")
+    parser.add_argument("--profile", action="store_true", help="print per-stage timings and counters for each file")
+    args = parser.parse_args(argv)
+
+    params = {
+        'steps': args.steps, 'span': args.span, 'num_rays': args.num_rays, 'max_angle': args.max_angle,
+        'filter': args.filter, 'method': args.method, 'projector': args.projector,
+        'patient_name': args.patient_name,
+        'patient_id': args.patient_id, 'comments': args.comments, 'profile': args.profile,
+    }
+
+    jobs = []
+    skipped = 0
+    for path, relative_path in find_inputs(args.inputs, args.recursive):
+        output_path = os.path.join(args.output, output_name(relative_path))
+        # Wznawianie: gotowe wyniki z poprzednich przebiegów są pomijane
+        if os.path.exists(output_path) and not args.overwrite:
+            skipped += 1
+            continue
+        jobs.append((path, output_path))
+
+    print(f"{len(jobs)} file(s) to process, {skipped} already done")
+    failed = run_batch(jobs, params, args.workers, args.geometry_cache)
+    if failed:
+        print(f"{len(failed)} file(s) failed", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import bisect
+
+import numpy as np
+
+from geometria import get_geometry
+from profilowanie import stage
+
+
+def checkpoint_steps(steps, count):
+    """
+    Kroki, po których zapisywane są punkty kontrolne (końce możliwie równych przedziałów)
+
+    :param steps: - ilość kroków
+    :param count: - liczba punktów kontrolnych
+    :return: lista numerów kroków
+    """
+    bounds = np.linspace(0, steps, min(count, steps) + 1).astype(int)
+    return [int(last) - 1 for last in bounds[1:]]
+
+
+def _step_index(idx, steps):
+    if idx < 0:
+        idx += steps
+    if not 0 <= idx < steps:
+        raise IndexError("Numer kroku poza zakresem")
+    return idx
+
+
+class SinogramSteps:
+    """
+    Wyniki pośrednie sinogramu przechowywane jako jeden sinogram. Stan po kroku k to
+    pierwsze k + 1 wierszy, pozostałe są puste (tak jak w trakcie skanowania)
+    """
+
+    def __init__(self, sinogram):
+        """
+        :param sinogram: - pełny sinogram o wymiarach (steps, num_rays)
+        """
+        self.sinogram = np.asarray(sinogram)
+
+    def __len__(self):
+        return self.sinogram.shape[0]
+
+    def __getitem__(self, idx):
+        idx = _step_index(idx, len(self))
+        partial = np.zeros_like(self.sinogram)
+        partial[:idx + 1] = self.sinogram[:idx + 1]
+        return partial
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    @property
+    def nbytes(self):
+        return self.sinogram.nbytes
+
+
+class BackprojectionSteps:
+    """
+    Wyniki pośrednie projekcji wstecznej. Zamiast obrazu po każdym kroku przechowywane są
+    wiersze sinogramu oraz kilka punktów kontrolnych (float32); stan po kroku k to najbliższy
+    wcześniejszy punkt kontrolny plus suma wkładów kolejnych kroków liczona na żądanie
+    """
+
+    def __init__(self, shape, steps, span, num_rays, max_angle, sinogram, checkpoint_steps, checkpoint_images,
+                 method='ray', projector='bresenham'):
+        """
+        :param shape: - kształt obrazu
+        :param steps: - ilość kroków (emiterów oraz detektorów)
+        :param span: - zakres promieni
+        :param num_rays: - liczba promieni
+        :param max_angle: - maksymalny kąt
+        :param sinogram: - sinogram użyty do projekcji wstecznej
+        :param checkpoint_steps: - rosnąca lista kroków, po których zapisano stan
+        :param checkpoint_images: - stany obrazu po krokach z checkpoint_steps
+        :param method: - sposób projekcji wstecznej ('ray' lub 'pixel')
+        :param projector: - model projektora dla metody 'ray' (jeden z PROJECTORS)
+        """
+        self.geometry_args = ((int(shape[0]), int(shape[1])), steps, span, num_rays, max_angle)
+        self.sinogram = np.asarray(sinogram)
+        # Stany są liczone w typie sinogramu (float32 lub float64), jak sama projekcja wsteczna
+        self.dtype = np.result_type(self.sinogram, np.float32)
+        self.checkpoint_steps = list(checkpoint_steps)
+        self.checkpoint_images = np.asarray(checkpoint_images, dtype=np.float32)
+        self.method = method
+        self.projector = projector
+
+    @property
+    def shape(self):
+        return self.geometry_args[0]
+
+    def __len__(self):
+        return self.geometry_args[1]
+
+    def _contribution(self, first, last):
+        # Suma wkładów kroków [first, last) - dla 'ray' jednym mnożeniem przez fragment macierzy systemowej
+        with stage('intermediate.recompute'):
+            geometry = get_geometry(*self.geometry_args, trace=self.method == 'ray', projector=self.projector)
+            return geometry.backproject_rows(self.sinogram[first:last], first, self.method)
+
+    def __getitem__(self, idx):
+        idx = _step_index(idx, len(self))
+        position = bisect.bisect_right(self.checkpoint_steps, idx) - 1
+        if position < 0:
+            return self._contribution(0, idx + 1)
+        state = self.checkpoint_images[position].astype(self.dtype)
+        checkpoint = self.checkpoint_steps[position]
+        if checkpoint < idx:
+            state += self._contribution(checkpoint + 1, idx + 1)
+        return state
+
+    def __iter__(self):
+        # Kolejne stany liczone przyrostowo, bez wracania do punktów kontrolnych
+        state = np.zeros(self.shape, dtype=self.dtype)
+        for idx in range(len(self)):
+            state += self._contribution(idx, idx + 1)
+            yield state.copy()
+
+    @property
+    def nbytes(self):
+        return self.sinogram.nbytes + self.checkpoint_images.nbytes
@@ -0,0 +1,193 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from harmonogram import uniform_angles
+from obliczenia import INTERMEDIATE_CHECKPOINTS, PREVIEW_LEVELS, iter_preview, iter_reconstruction, iter_sinogram
+from profilowanie import profile
+from wyniki_posrednie import BackprojectionSteps, checkpoint_steps
+
+# Liczba wątków puli jednej sesji: rekonstrukcja czeka na sinogram, ale rekonstrukcje
+# z sinogramu i z przefiltrowanego sinogramu mogą być liczone równolegle
+SESSION_WORKERS = 2
+
+
+class JobCancelled(Exception):
+    """
+    Zadanie zostało anulowane - zgłaszane wewnątrz funkcji zadania przy najbliższym raporcie postępu
+    """
+
+
+class Job:
+    """
+    Obliczenie wykonywane w tle. Funkcja zadania po każdym kroku wywołuje report(), które
+    zapisuje postęp i częściowy wynik oraz przerywa obliczenia, jeżeli zadanie anulowano.
+    Wątek strony czyta postęp i częściowy wynik bez czekania na koniec obliczeń.
+    """
+
+    def __init__(self, key, total):
+        """
+        :param key: - klucz parametrów, dla których liczone jest zadanie
+        :param total: - liczba kroków zadania
+        """
+        self.key = key
+        self.total = max(1, int(total))
+        self.done = 0
+        self.partial = None
+        self.profile = None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def progress(self):
+        return min(1.0, self.done / self.total)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def finished(self):
+        return self.future is not None and self.future.done()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def report(self, done, partial=None):
+        """
+        Zapis postępu (wywoływany z wątku zadania)
+
+        :param done: - liczba wykonanych kroków
+        :param partial: - opcjonalny częściowy wynik do podglądu (może to być bufor uzupełniany dalej)
+        """
+        if self.cancelled:
+            raise JobCancelled()
+        self.done = done
+        if partial is not None:
+            self.partial = partial
+
+    def result(self, timeout=None):
+        """
+        :return: wynik funkcji zadania (czeka na zakończenie; błąd zadania jest zgłaszany ponownie)
+        """
+        return self.future.result(timeout)
+
+
+def _run(job, func, args, kwargs, profiled):
+    if job.cancelled:
+        raise JobCancelled()
+    if not profiled:
+        return func(job, *args, **kwargs)
+    # Aktywny profil jest lokalny dla wątku zadania, więc pomiary równoległych zadań się nie mieszają
+    with profile() as run:
+        job.profile = run
+        return func(job, *args, **kwargs)
+
+
+class JobManager:
+    """
+    Pula wątków jednej sesji z nazwanymi miejscami na zadania (np. 'sinogram', 'reconstruction').
+    W każdym miejscu jest co najwyżej jedno aktualne zadanie: zlecenie zadania o innym kluczu
+    anuluje poprzednie, a ponowne zlecenie tego samego klucza zwraca zadanie już trwające.
+    Wątki (a nie procesy) pozwalają czytać częściowe wyniki bez kopiowania, a numpy i scipy.sparse
+    zwalniają GIL w mnożeniach, więc strona pozostaje responsywna.
+    """
+
+    def __init__(self, workers=SESSION_WORKERS):
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='ct-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, slot, key, func, *args, total=1, profiled=False, **kwargs):
+        """
+        Zlecenie zadania func(job, *args, **kwargs) w danym miejscu
+
+        :param slot: - nazwa miejsca zadania
+        :param key: - klucz parametrów (zadanie o tym samym kluczu nie jest zlecane ponownie)
+        :param func: - funkcja zadania, pierwszym argumentem jest obiekt Job
+        :param total: - liczba kroków zadania (do paska postępu)
+        :param profiled: - zbieranie pomiarów etapów do job.profile
+        :return: obiekt Job
+        """
+        with self._lock:
+            job = self._jobs.get(slot)
+            if job is not None and job.key == key and not job.cancelled:
+                return job
+            if job is not None:
+                job.cancel()
+            job = Job(key, total)
+            job.future = self._pool.submit(_run, job, func, args, kwargs, profiled)
+            self._jobs[slot] = job
+            return job
+
+    def get(self, slot):
+        with self._lock:
+            return self._jobs.get(slot)
+
+    def cancel(self, slot=None):
+        """
+        Anulowanie zadania w danym miejscu (None - wszystkich zadań)
+        """
+        with self._lock:
+            jobs = list(self._jobs.values()) if slot is None else [self._jobs.get(slot)]
+        for job in jobs:
+            if job is not None:
+                job.cancel()
+
+    @property
+    def running(self):
+        with self._lock:
+            return any(not job.finished for job in self._jobs.values())
+
+    def shutdown(self):
+        self.cancel()
+        self._pool.shutdown(wait=False)
+
+
+def sinogram_job(job, img, steps, span, num_rays, max_angle, projector='bresenham', dtype=np.float64, cache=None):
+    """
+    Zadanie liczące sinogram kąt po kącie; w trakcie job.partial to uzupełniany sinogram
+
+    :param cache: - opcjonalny harmonogram.ProjectionCache tego obrazu (z tymi samymi span, num_rays,
+                    projector i dtype) - liczone są wtedy tylko kąty, których jeszcze w nim nie ma
+    :return: ndarray o wymiarach (steps, num_rays) typu dtype
+    """
+    sinogram = np.zeros((steps, num_rays), dtype=dtype)
+    job.report(0, sinogram)
+    if cache is not None:
+        rows = cache.iter_sinogram(uniform_angles(steps, max_angle))
+    else:
+        rows = iter_sinogram(img, steps, span, num_rays, max_angle, projector, dtype)
+    for idx, _, row in rows:
+        sinogram[idx] = row
+        job.report(idx + 1)
+    return sinogram
+
+
+def reconstruction_job(job, img, sinogram, steps, span, num_rays, max_angle, method='ray', projector='bresenham',
+                       dtype=np.float64, preview=False):
+    """
+    Zadanie liczące projekcję wsteczną kąt po kącie; w trakcie job.partial to obraz
+    z dotychczas zsumowanych projekcji. Z preview=True najpierw liczone są zgrubne podglądy
+    (1/4 i 1/2 rozdzielczości, iter_preview) i to one są job.partial aż do końca zadania
+
+    :return: obiekt BackprojectionSteps z punktami kontrolnymi wyników pośrednich
+    """
+    shape = (img.shape[0], img.shape[1])
+    checkpoints = checkpoint_steps(steps, INTERMEDIATE_CHECKPOINTS)
+    images = []
+    job.report(0)
+    if preview:
+        for _, image in iter_preview(img, sinogram, steps, span, num_rays, max_angle, levels=PREVIEW_LEVELS[:-1],
+                                     dtype=dtype):
+            job.report(0, image)
+    for idx, _, partial in iter_reconstruction(img, sinogram, steps, span, num_rays, max_angle, method, projector,
+                                               dtype):
+        if idx in checkpoints:
+            images.append(partial.astype(np.float32))
+        job.report(idx + 1, None if preview else partial)
+    return BackprojectionSteps(shape, steps, span, num_rays, max_angle, sinogram, checkpoints, images, method,
+                               projector)